@@ -0,0 +1,44 @@
+"""Общие фикстуры тестов xrmd_agent_manager.py"""
+
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, TESTS_DIR)
+
+import fake_pymysql  # noqa: E402
+import xrmd_agent_manager as xam  # noqa: E402
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    """Хранилище SQLite во временном каталоге"""
+    store = xam.Database(str(tmp_path / "log_results.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def mysql_server(tmp_path, monkeypatch):
+    """pymysql, подключающийся к "серверу" в каталоге tmp_path (см. fake_pymysql)"""
+    monkeypatch.setattr(fake_pymysql, "DATA_DIR", str(tmp_path))
+    monkeypatch.setitem(sys.modules, "pymysql", fake_pymysql)
+    return fake_pymysql
+
+
+@pytest.fixture
+def mysql_store(mysql_server):
+    """Хранилище MySQL поверх заглушки pymysql"""
+    store = xam.MySQLResultStore({"name": "xrm_test"})
+    yield store
+    store.close()
+
+
+@pytest.fixture(params=["sqlite", "mysql"])
+def store(request):
+    """Каждая реализация ResultStore по очереди"""
+    return request.getfixturevalue(f"{request.param}_store")
+
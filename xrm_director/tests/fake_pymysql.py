@@ -0,0 +1,225 @@
+"""Замена пакета pymysql для тестов: сервер MySQL имитируется файлами SQLite.
+
+Переводится только та часть диалекта MySQL, которую использует MySQLResultStore:
+DDL с ENGINE/KEY, генерируемые столбцы с JSON-функциями, FULLTEXT и MATCH ... AGAINST,
+триггеры с ON DUPLICATE KEY UPDATE, information_schema и именованные блокировки.
+Контейнер с настоящим сервером для запуска тестов не нужен.
+"""
+
+import datetime
+import json
+import os
+import re
+import sqlite3
+import types
+
+DATA_DIR = None  # Каталог "сервера": база NAME хранится в файле DATA_DIR/NAME.db
+
+constants = types.SimpleNamespace(CLIENT=types.SimpleNamespace(FOUND_ROWS=2))
+
+
+class Error(Exception):
+    pass
+
+
+class OperationalError(Error):
+    pass
+
+
+class InterfaceError(Error):
+    pass
+
+
+def connect(host=None, port=None, user=None, password=None, database=None, **kwargs):
+    """Открытие соединения с базой database (None - соединение без базы)"""
+    return Connection(database)
+
+
+def _left(text, length):
+    return None if text is None else str(text)[:length]
+
+
+def _json_type(value):
+    """JSON_TYPE для значения, которое вернул json_extract SQLite (значение SQL, а не JSON)"""
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return "INTEGER"
+    if isinstance(value, float):
+        return "DOUBLE"
+    if isinstance(value, str) and value[:1] in "{[":
+        try:
+            parsed = json.loads(value)
+            return "OBJECT" if isinstance(parsed, dict) else "ARRAY"
+        except ValueError:
+            pass
+    return "STRING"
+
+
+def _json_unquote(value):
+    # json_extract SQLite уже возвращает строки без кавычек
+    return value
+
+
+def _match(*args):
+    """MATCH ... AGAINST (... IN BOOLEAN MODE): все термы +"..." должны встретиться в тексте"""
+    columns, query = args[:-1], args[-1]
+    terms = [term.strip().lower() for term in re.findall(r'\+"([^"]*)"', query or "")]
+    terms = [term for term in terms if term] or (query or "").lower().split()
+    text = " ".join(str(column) for column in columns if column is not None).lower()
+    if not terms or not all(term in text for term in terms):
+        return 0.0
+    return float(sum(text.count(term) for term in terms))
+
+
+def _to_sqlite(value):
+    """Значение параметра в том виде, в каком его передал бы на сервер pymysql"""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return str(value)
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+class Connection:
+    def __init__(self, database):
+        path = ":memory:" if database is None else os.path.join(DATA_DIR, f"{database}.db")
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        if database is not None:
+            self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA foreign_keys = ON")
+        self._db.create_function("mysql_left", 2, _left, deterministic=True)
+        self._db.create_function("mysql_json_type", 1, _json_type, deterministic=True)
+        self._db.create_function("mysql_json_unquote", 1, _json_unquote, deterministic=True)
+        self._db.create_function("mysql_match", -1, _match, deterministic=True)
+        self.open = True
+
+    def _check(self):
+        if not self.open:
+            raise InterfaceError(0, "Connection is closed")
+
+    def cursor(self):
+        self._check()
+        return Cursor(self)
+
+    def commit(self):
+        self._check()
+        self._db.commit()
+
+    def rollback(self):
+        self._check()
+        self._db.rollback()
+
+    def ping(self, reconnect=True):
+        self._check()
+        self._db.execute("SELECT 1")
+
+    def close(self):
+        if not self.open:
+            raise Error("Already closed")
+        self.open = False
+        self._db.close()
+
+
+class Cursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self._rows = []
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._rows = []
+
+    def execute(self, query, args=None):
+        self.connection._check()
+        db = self.connection._db
+        statements = _translate(query, args)
+
+        if callable(statements):
+            self._rows = statements(db)
+            self.rowcount = len(self._rows)
+            return self.rowcount
+
+        self._rows = []
+        self.rowcount = 0
+        for statement, params in statements:
+            cursor = db.execute(statement, params)
+            self._rows = cursor.fetchall()
+            self.rowcount = cursor.rowcount if cursor.rowcount >= 0 else len(self._rows)
+            self.lastrowid = cursor.lastrowid
+        return self.rowcount
+
+    def executemany(self, query, seq_of_args):
+        total = 0
+        for args in seq_of_args:
+            total += self.execute(query, args)
+        self.rowcount = total
+        return total
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+
+def _translate(query, args):
+    """Перевод запроса MySQL в список (запрос SQLite, параметры) или в функцию, возвращающую строки"""
+    sql = query.strip()
+
+    if args is None:
+        params = ()
+    elif isinstance(args, dict):
+        params = {key: _to_sqlite(value) for key, value in args.items()}
+    else:
+        params = [_to_sqlite(value) for value in args]
+
+    # Служебные запросы без аналога в SQLite
+    if re.match(r"CREATE DATABASE", sql, re.I):
+        return []
+    if re.search(r"\b(GET_LOCK|RELEASE_LOCK)\(", sql):
+        return lambda db: [(1,)]
+    if "information_schema.columns" in sql:
+        return lambda db: [(row[1],) for row in db.execute(f"PRAGMA table_xinfo({params[0]})")]
+    if "information_schema.statistics" in sql:
+        return lambda db: [(row[1],) for row in db.execute(f"PRAGMA index_list({params[0]})")]
+    if "information_schema.tables" in sql:
+        return lambda db: [(0, 0)]
+
+    # pymysql подставляет параметры через %, поэтому %% в запросе с параметрами - это %
+    sql = re.sub(r"MATCH\(([^)]*)\)\s*AGAINST\s*\((%s)\s+IN BOOLEAN MODE\)", r"mysql_match(\1, \2)", sql)
+    if args is not None:
+        sql = re.sub(r"%\((\w+)\)s", r":\1", sql)
+        sql = sql.replace("%s", "?").replace("%%", "%")
+
+    sql = re.sub(r"DATE_FORMAT\(([^,]+),\s*('[^']*')\)", r"strftime(\2, \1)", sql)
+    sql = re.sub(r"\bJSON_TYPE\(", "mysql_json_type(", sql)
+    sql = re.sub(r"\bJSON_UNQUOTE\(", "mysql_json_unquote(", sql)
+    sql = re.sub(r"\bLEFT\(", "mysql_left(", sql)
+    sql = sql.replace("ON DUPLICATE KEY UPDATE", "ON CONFLICT DO UPDATE SET")
+    sql = re.sub(r"CREATE FULLTEXT INDEX", "CREATE INDEX", sql)
+
+    create_table = re.match(r"CREATE TABLE IF NOT EXISTS (\w+)", sql)
+    if create_table:
+        table = create_table.group(1)
+        sql = re.sub(r"\)\s*ENGINE=.*$", ")", sql, flags=re.S)
+        sql = sql.replace("BIGINT AUTO_INCREMENT PRIMARY KEY", "INTEGER PRIMARY KEY AUTOINCREMENT")
+        indexes = re.findall(r",\s*KEY (\w+) \(([^)]*)\)", sql)
+        sql = re.sub(r",\s*KEY \w+ \([^)]*\)", "", sql)
+        return [(sql, params)] + [
+            (f"CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})", ()) for name, columns in indexes
+        ]
+
+    trigger = re.match(r"(CREATE TRIGGER \w+ AFTER \w+ ON \w+ FOR EACH ROW)\s+(.*)$", sql, re.S)
+    if trigger:
+        return [(f"{trigger.group(1)} BEGIN {trigger.group(2)}; END", params)]
+
+    return [(sql, params)]
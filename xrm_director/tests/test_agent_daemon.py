@@ -0,0 +1,120 @@
+"""Тесты протокола демона агентов: передача настроек клиента и отключение клиента"""
+
+import io
+import json
+import os
+import stat
+import threading
+import time
+import types
+
+import xrmd_agent_manager as xam
+
+
+class FakeMessenger:
+    """AgentMessenger, который запоминает запрос и отвечает одной порцией"""
+
+    def __init__(self):
+        self.kwargs = None
+        self.released = False
+
+    def send(self, message, **kwargs):
+        self.kwargs = kwargs
+        kwargs["emit"]("chunk", "ответ")
+        return True
+
+    def release_thread(self):
+        self.released = True
+
+
+class DisconnectedFile:
+    """Сокет клиента, закрытого до получения ответа"""
+
+    def __init__(self):
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        raise BrokenPipeError(32, "Broken pipe")
+
+    def flush(self):
+        pass
+
+
+def make_daemon():
+    daemon = xam.AgentDaemon.__new__(xam.AgentDaemon)
+    daemon.messenger = FakeMessenger()
+    daemon.server = None
+    return daemon
+
+
+def request_file(request):
+    return io.BytesIO((json.dumps(request) + "\n").encode("utf-8"))
+
+
+def test_client_flags_are_passed_to_messenger():
+    daemon = make_daemon()
+    wfile = io.BytesIO()
+
+    daemon.handle(request_file({"command": "send", "message": "привет", "stream": False, "show_references": True}), wfile)
+
+    assert daemon.messenger.kwargs["stream"] is False
+    assert daemon.messenger.kwargs["show_references"] is True
+    events = [json.loads(line) for line in wfile.getvalue().decode("utf-8").splitlines()]
+    assert events == [{"event": "chunk", "data": "ответ"}, {"event": "result", "data": True}]
+
+
+def test_old_client_uses_daemon_settings():
+    daemon = make_daemon()
+    daemon.handle(request_file({"command": "send", "message": "привет"}), io.BytesIO())
+    assert daemon.messenger.kwargs["stream"] is None
+    assert daemon.messenger.kwargs["show_references"] is None
+
+
+def test_disconnected_client_does_not_break_handler():
+    daemon = make_daemon()
+    wfile = DisconnectedFile()
+
+    daemon.handle(request_file({"command": "send", "message": "привет"}), wfile)
+
+    # После первой неудачной записи демон больше не пишет в сокет
+    assert wfile.writes == 1
+    assert daemon.messenger.released
+
+
+def test_cli_sends_flags_to_daemon(monkeypatch):
+    requests = []
+    monkeypatch.setitem(xam.CONFIG, "ENABLE_STREAMING", False)
+    monkeypatch.setitem(xam.CONFIG, "SHOW_REFERENCES", False)
+    monkeypatch.setattr(xam, "daemon_request", lambda request, on_event: requests.append(request) or True)
+
+    assert xam.cli_send_message("привет", agent_id="a")
+    assert requests[0]["stream"] is False
+    assert requests[0]["show_references"] is False
+
+
+def test_socket_is_private_from_creation(tmp_path, monkeypatch):
+    socket_path = str(tmp_path / "agent.sock")
+    daemon = xam.AgentDaemon.__new__(xam.AgentDaemon)
+    daemon.socket_path = socket_path
+    daemon.server = None
+    daemon.messenger = types.SimpleNamespace(directory=types.SimpleNamespace(list=lambda: []))
+    monkeypatch.setattr(xam, "daemon_request", lambda request, on_event, socket_path=None: None)
+    # Права сокета не должны зависеть от исправления после создания
+    monkeypatch.setattr(xam.os, "chmod", lambda path, mode: None)
+    umask = os.umask(0o022)
+    os.umask(umask)  # Текущая маска процесса: демон должен ее восстановить
+
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    for _ in range(100):
+        if daemon.server is not None and os.path.exists(socket_path):
+            break
+        time.sleep(0.01)
+    try:
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+        assert os.umask(umask) == umask
+    finally:
+        daemon.server.shutdown()
+        thread.join(5)
+    assert not os.path.exists(socket_path)
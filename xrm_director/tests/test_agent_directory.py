@@ -0,0 +1,98 @@
+"""Тесты кэша агентов AgentDirectory"""
+
+import json
+import threading
+import time
+import types
+
+import xrmd_agent_manager as xam
+
+
+class FakeRAGFlow:
+    """Сервер с заданным списком агентов (одна страница)"""
+
+    def __init__(self, count):
+        self.agents = [types.SimpleNamespace(id=f"id{i}", title=f"agent {i}", update_time=i) for i in range(count)]
+
+    def list_agents(self, page=1, page_size=30, orderby=None, desc=None):
+        return self.agents[(page - 1) * page_size:page * page_size]
+
+
+def test_cache_survives_concurrent_saves(tmp_path, monkeypatch, caplog):
+    dump = json.dump
+
+    def slow_dump(*args, **kwargs):
+        time.sleep(0.001)  # Запись кэша пересекается с записью из другого потока
+        dump(*args, **kwargs)
+
+    monkeypatch.setattr(xam.json, "dump", slow_dump)
+    cache_path = str(tmp_path / "agents_cache.json")
+    directory = xam.AgentDirectory(FakeRAGFlow(5), cache_path=cache_path)
+    directory.refresh()
+    errors = []
+
+    def use():
+        try:
+            for _ in range(50):
+                directory.record_use("id1")
+        except Exception as e:
+            errors.append(e)
+
+    def refresh():
+        try:
+            for _ in range(20):
+                directory.refresh()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=use) for _ in range(3)] + [threading.Thread(target=refresh)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert errors == []
+    assert "не сохранен" not in caplog.text
+    # Временные файлы переименованы в кэш, на диске остался только он
+    assert [path.name for path in tmp_path.iterdir()] == ["agents_cache.json"]
+    with open(cache_path, encoding="utf-8") as cache_file:
+        assert json.load(cache_file)["usage"] == {"id1": 150}
+
+    reloaded = xam.AgentDirectory(FakeRAGFlow(0), cache_path=cache_path)
+    assert reloaded.title("id3") == "agent 3"
+    assert reloaded.most_used(1) == [{"id": "id1", "title": "agent 1", "update_time": 1}]
+
+
+def test_usage_of_other_processes_is_kept(tmp_path):
+    cache_path = str(tmp_path / "agents_cache.json")
+    xam.AgentDirectory(FakeRAGFlow(3), cache_path=cache_path).refresh()
+    # Меню и демон открыли кэш одновременно и считают выборы независимо
+    menu = xam.AgentDirectory(FakeRAGFlow(3), cache_path=cache_path)
+    daemon = xam.AgentDirectory(FakeRAGFlow(3), cache_path=cache_path)
+
+    menu.record_use("id1")
+    daemon.record_use("id2")
+    daemon.record_use("id2")
+    menu.record_use("id1")
+
+    with open(cache_path, encoding="utf-8") as cache_file:
+        assert json.load(cache_file)["usage"] == {"id1": 2, "id2": 2}
+    assert menu.usage == {"id1": 2, "id2": 2}
+
+
+def test_menu_lists_agents_beyond_first_page(tmp_path, monkeypatch, capsys):
+    directory = xam.AgentDirectory(FakeRAGFlow(45), cache_path=str(tmp_path / "agents_cache.json"))
+    monkeypatch.setattr(xam, "AGENT_LIST_PAGE_SIZE", 30)
+    monkeypatch.setattr(directory, "get_agent", lambda entry: types.SimpleNamespace(**entry))
+    menu = xam.RAGFlowMenu.__new__(xam.RAGFlowMenu)
+    menu.rag_object = directory.rag_object
+    menu.messenger = types.SimpleNamespace(directory=directory)
+    answers = iter(["41"])
+    monkeypatch.setattr("builtins.input", lambda prompt: next(answers))
+
+    agent = menu.select_agent()
+
+    assert agent.id == "id40"
+    assert "Название: agent 44" in capsys.readouterr().out
+    menu.view_all_agents()
+    assert capsys.readouterr().out.count("ID: ") == 45
@@ -0,0 +1,171 @@
+"""Тесты AgentMessenger: локальный индекс сеансов, проверка сеансов и восстановление"""
+
+import types
+
+import pytest
+
+import xrmd_agent_manager as xam
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return {"code": 0, "data": self.data}
+
+
+class FakeRAGFlow:
+    """Клиент, который отвечает на поиск сеанса по ID и запоминает запросы"""
+
+    def __init__(self, sessions=()):
+        self.sessions = set(sessions)
+        self.requests = []
+
+    def get(self, path, params=None):
+        self.requests.append((path, params))
+        found = params.get("id") in self.sessions
+        return FakeResponse([{"id": params["id"]}] if found else [])
+
+
+class FakeSession:
+    """Сеанс, который отвечает заданным текстом или ошибкой сервера"""
+
+    def __init__(self, session_id, agent_id="a", answer="ответ", error=None):
+        self.id = session_id
+        self.agent_id = agent_id
+        self.answer = answer
+        self.error = error
+        self.questions = []
+
+    def ask(self, message, stream=True):
+        self.questions.append(message)
+        if self.error is not None:
+            raise self.error
+        yield types.SimpleNamespace(content=self.answer, reference=None)
+
+
+@pytest.fixture
+def messenger(monkeypatch):
+    monkeypatch.setattr(xam, "CHAT_TRANSCRIPTS_ENABLED", False)
+    return xam.AgentMessenger(directory=types.SimpleNamespace())
+
+
+def test_remembered_session_is_found_locally(messenger):
+    agent = types.SimpleNamespace(id="a", rag=FakeRAGFlow())
+    session = messenger.remember_session(FakeSession("s1"))
+
+    assert messenger.find_session(agent, "s1") is session
+    assert agent.rag.requests == []
+
+
+def test_unknown_session_is_built_without_request(messenger):
+    pytest.importorskip("ragflow_sdk")
+    agent = types.SimpleNamespace(id="a", rag=FakeRAGFlow())
+
+    session = messenger.find_session(agent, "s2")
+
+    assert (session.id, session.agent_id) == ("s2", "a")
+    assert agent.rag.requests == []
+    # Сеанс не подтвержден сервером: при ошибке вопроса он будет проверен
+    assert "s2" not in messenger._validated
+    assert messenger.find_session(agent, "s2") is session
+
+
+def test_session_of_other_agent_is_not_reused(messenger):
+    pytest.importorskip("ragflow_sdk")
+    messenger.remember_session(FakeSession("s1", agent_id="other"))
+    agent = types.SimpleNamespace(id="a", rag=FakeRAGFlow())
+
+    assert messenger.find_session(agent, "s1").agent_id == "a"
+
+
+def test_session_exists_queries_by_id(messenger):
+    pytest.importorskip("ragflow_sdk")
+    rag = FakeRAGFlow(sessions={"s1"})
+
+    assert messenger.session_exists(types.SimpleNamespace(id="s1", agent_id="a", rag=rag))
+    assert not messenger.session_exists(types.SimpleNamespace(id="s9", agent_id="a", rag=rag))
+    assert [(path, params["id"], params["page_size"]) for path, params in rag.requests] == [
+        ("/agents/a/sessions", "s1", 1), ("/agents/a/sessions", "s9", 1)
+    ]
+
+
+class Checks:
+    """Подмена session_exists: ответ сервера и число проверок"""
+
+    def __init__(self, exists):
+        self.exists = exists
+        self.calls = 0
+
+    def __call__(self, session):
+        self.calls += 1
+        return self.exists
+
+
+def test_answer_confirms_session_without_check(messenger):
+    messenger.session_exists = checks = Checks(exists=True)
+    session = messenger.remember_session(FakeSession("s1"), validated=False)
+    chunks = []
+
+    assert messenger.ask(session, "привет", chunks.append) == ("ответ", [])
+
+    assert chunks == ["ответ"]
+    assert checks.calls == 0
+    assert "s1" in messenger._validated
+
+
+def test_error_in_recently_confirmed_session_is_not_rechecked(messenger):
+    messenger.session_exists = checks = Checks(exists=False)
+    session = messenger.remember_session(FakeSession("s1", error=ConnectionError("timeout")))
+
+    with pytest.raises(ConnectionError):
+        messenger.ask(session, "привет")
+    assert checks.calls == 0
+
+
+def test_error_in_missing_session_raises_not_found(messenger, monkeypatch):
+    monkeypatch.setattr(xam, "SESSION_VALIDITY_TTL", 0)
+    messenger.session_exists = checks = Checks(exists=False)
+    session = messenger.remember_session(FakeSession("s1", error=Exception("Expecting value")))
+
+    with pytest.raises(xam.SessionNotFoundError):
+        messenger.ask(session, "привет")
+    assert checks.calls == 1
+    assert "s1" not in messenger._sessions
+
+
+def test_error_in_existing_session_is_reraised(messenger, monkeypatch):
+    monkeypatch.setattr(xam, "SESSION_VALIDITY_TTL", 0)
+    messenger.session_exists = checks = Checks(exists=True)
+    session = messenger.remember_session(FakeSession("s1", error=ConnectionError("reset")))
+
+    with pytest.raises(ConnectionError):
+        messenger.ask(session, "привет")
+    assert checks.calls == 1
+    assert "s1" in messenger._sessions
+
+
+def test_ask_with_recovery_recreates_deleted_session(messenger, monkeypatch):
+    monkeypatch.setattr(xam, "SESSION_VALIDITY_TTL", 0)
+    messenger.session_exists = Checks(exists=False)
+    deleted = messenger.remember_session(FakeSession("old", error=Exception("Expecting value")))
+    replacement = FakeSession("new", answer="новый ответ")
+    agent = types.SimpleNamespace(id="a", create_session=lambda: replacement)
+    recreated = []
+
+    session, answer, references = messenger.ask_with_recovery(
+        agent, deleted, "привет", on_recreate=lambda old, new: recreated.append((old.id, new.id))
+    )
+
+    assert (session, answer, references) == (replacement, "новый ответ", [])
+    assert recreated == [("old", "new")]
+    assert replacement.questions == ["привет"]
+    assert messenger._sessions["new"] is replacement
+
+
+def test_ask_with_recovery_keeps_working_session(messenger):
+    session = messenger.remember_session(FakeSession("s1"))
+    agent = types.SimpleNamespace(id="a", create_session=pytest.fail)
+
+    assert messenger.ask_with_recovery(agent, session, "привет") == (session, "ответ", [])
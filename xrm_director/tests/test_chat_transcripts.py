@@ -0,0 +1,114 @@
+"""Тесты истории чатов: нумерация ходов, постраничное чтение, поиск и чистый stdout"""
+
+import pytest
+
+import xrmd_agent_manager as xam
+
+
+def add_turns(store, session_id, count, agent_id="agent-1", prefix="вопрос"):
+    """Несколько ходов подряд в один сеанс, возвращает их номера"""
+    return [
+        store.add_chat_turn(session_id, agent_id, "Агент", f"{prefix} {i}", f"ответ {i}")
+        for i in range(count)
+    ]
+
+
+def test_turns_are_numbered_per_session(sqlite_store):
+    assert add_turns(sqlite_store, "s1", 3) == [1, 2, 3]
+    assert add_turns(sqlite_store, "s2", 2) == [1, 2]
+    assert add_turns(sqlite_store, "s1", 1) == [4]
+
+    turns = [turn for page in sqlite_store.iter_chat_turns("s1") for turn in page]
+    assert [(turn["turn"], turn["role"]) for turn in turns] == [
+        (n, role) for n in range(1, 5) for role in ("user", "assistant")
+    ]
+
+
+def test_turn_keeps_timings_and_references(sqlite_store):
+    sqlite_store.add_chat_turn("s1", "agent-1", "Агент", "вопрос", "ответ",
+                               first_chunk_time=0.5, total_time=1.25,
+                               references=[{"document_name": "doc.pdf"}])
+
+    question, answer = next(sqlite_store.iter_chat_turns("s1"))
+    assert question["references"] == [] and question["total_time"] is None
+    assert answer["references"] == [{"document_name": "doc.pdf"}]
+    assert (answer["first_chunk_time"], answer["total_time"]) == (0.5, 1.25)
+
+
+def test_iter_chat_turns_pages_by_id(sqlite_store):
+    add_turns(sqlite_store, "s1", 5)
+    add_turns(sqlite_store, "s2", 5)
+
+    pages = list(sqlite_store.iter_chat_turns("s1", page_size=4))
+
+    assert [len(page) for page in pages] == [4, 4, 2]
+    ids = [turn["id"] for page in pages for turn in page]
+    assert ids == sorted(ids) and len(set(ids)) == 10
+    assert {turn["session_id"] for page in pages for turn in page} == {"s1"}
+
+
+def test_iter_chat_turns_sees_turns_added_while_reading(sqlite_store):
+    add_turns(sqlite_store, "s1", 2)
+
+    pages = sqlite_store.iter_chat_turns("s1", page_size=2)
+    first = next(pages)
+    add_turns(sqlite_store, "s1", 1, prefix="новый")
+    rest = [turn for page in pages for turn in page]
+
+    assert [turn["turn"] for turn in first] == [1, 1]
+    assert [turn["content"] for turn in rest] == ["вопрос 1", "ответ 1", "новый 0", "ответ 0"]
+
+
+def test_iter_chat_turns_of_unknown_session_is_empty(sqlite_store):
+    assert list(sqlite_store.iter_chat_turns("missing")) == []
+
+
+def test_search_chat_turns_finds_words(sqlite_store):
+    if not sqlite_store.chat_search_enabled:
+        pytest.skip("SQLite собран без FTS5")
+    sqlite_store.add_chat_turn("s1", "agent-1", "Агент", "Почему упал сервис оплаты?", "Закончилась память")
+    sqlite_store.add_chat_turn("s2", "agent-1", "Агент", "Как перезапустить сервис?", "Командой restart")
+
+    found = sqlite_store.search_chat_turns("оплаты")
+    assert [(turn["session_id"], turn["role"]) for turn in found] == [("s1", "user")]
+    assert {turn["session_id"] for turn in sqlite_store.search_chat_turns("сервис")} == {"s1", "s2"}
+    assert sqlite_store.search_chat_turns("отсутствует") == []
+
+
+def test_search_chat_turns_without_fts(sqlite_store):
+    sqlite_store.chat_search_enabled = False
+    add_turns(sqlite_store, "s1", 3)
+
+    found = sqlite_store.search_chat_turns("ответ", limit=2)
+
+    assert [turn["content"] for turn in found] == ["ответ 2", "ответ 1"]
+
+
+def test_new_database_keeps_stdout_clean(tmp_path, capsys):
+    store = xam.Database(str(tmp_path / "log_results.db"))
+    store.close()
+
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert "успешно создана" in captured.err
+
+
+def test_recording_first_turn_keeps_stdout_clean(tmp_path, monkeypatch, capsys):
+    """Первая запись истории создает базу и не должна попадать в JSONL вывода --send-file"""
+    class FakeDirectory:
+        def title(self, agent_id):
+            return "Агент"
+
+    class FakeSession:
+        id = "s1"
+        agent_id = "agent-1"
+
+    monkeypatch.setattr(xam, "CHAT_TRANSCRIPTS_ENABLED", True)
+    monkeypatch.setattr(xam, "LOG_DB_PATH", str(tmp_path / "log_results.db"))
+    messenger = xam.AgentMessenger(directory=FakeDirectory())
+
+    messenger._record_turn(FakeSession(), "вопрос", "ответ", [], 0.1, 0.2)
+
+    assert capsys.readouterr().out == ""
+    assert [turn["content"] for turn in next(messenger.transcripts.iter_chat_turns("s1"))] == ["вопрос", "ответ"]
+    messenger.transcripts.close()
@@ -0,0 +1,158 @@
+"""Тесты пула соединений SQLConnectionPool"""
+
+import threading
+
+import pytest
+
+import xrmd_agent_manager as xam
+
+
+class FakeConnection:
+    """Соединение, которое запоминает вызовы пула"""
+
+    def __init__(self, number, broken=False):
+        self.number = number
+        self.broken = broken
+        self.closed = False
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+        if self.broken:
+            raise ConnectionError("server has gone away")
+
+    def close(self):
+        self.closed = True
+
+
+class Server:
+    """Фабрика соединений и проверка "живости" для пула"""
+
+    def __init__(self):
+        self.connections = []
+        self.pings = []
+        self.alive = True
+
+    def connect(self):
+        conn = FakeConnection(len(self.connections) + 1)
+        self.connections.append(conn)
+        return conn
+
+    def ping(self, conn):
+        self.pings.append(conn.number)
+        if not self.alive or conn.broken:
+            raise ConnectionError("server has gone away")
+
+
+@pytest.fixture
+def server():
+    return Server()
+
+
+def make_pool(server, **kwargs):
+    kwargs.setdefault("stale_timeout", 30)
+    return xam.SQLConnectionPool(server.connect, ping_func=server.ping, **kwargs)
+
+
+def test_connection_is_reused(server):
+    pool = make_pool(server)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert second is first
+    assert pool.stats()["created"] == 1
+    assert pool.stats()["reused"] == 1
+    # Соединение не простаивало дольше stale_timeout - проверка не нужна
+    assert server.pings == []
+
+
+def test_stale_connection_is_pinged(server):
+    pool = make_pool(server, stale_timeout=0)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert second is first
+    assert server.pings == [1]
+
+
+def test_stale_connection_that_fails_ping_is_discarded(server):
+    pool = make_pool(server, stale_timeout=0)
+    with pool.connection() as first:
+        pass
+    server.alive = False
+    with pool.connection() as second:
+        server.alive = True
+    assert second is not first
+    assert first.closed
+    assert pool.stats()["created"] == 2
+    assert pool.stats()["idle"] == 1
+
+
+def test_error_rolls_back_and_returns_connection(server):
+    pool = make_pool(server)
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            raise ValueError("query failed")
+    assert conn.rollbacks == 1
+    assert not conn.closed
+    assert pool.stats()["idle"] == 1
+    assert pool.stats()["in_use"] == 0
+
+
+def test_connection_that_fails_rollback_is_discarded(server):
+    pool = make_pool(server)
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            conn.broken = True
+            raise ValueError("query failed")
+    assert conn.closed
+    assert pool.stats()["idle"] == 0
+    with pool.connection() as replacement:
+        pass
+    assert replacement is not conn
+
+
+def test_pool_limits_open_connections(server):
+    pool = make_pool(server, max_connections=1, acquire_timeout=0.05)
+    with pool.connection():
+        with pytest.raises(TimeoutError):
+            with pool.connection():
+                pass
+    assert pool.stats()["waits"] == 1
+
+    # Освободившееся соединение достается ожидающему потоку
+    acquired = []
+
+    def waiter():
+        with pool.connection() as conn:
+            acquired.append(conn)
+
+    pool.acquire_timeout = 5
+    with pool.connection() as held:
+        thread = threading.Thread(target=waiter)
+        thread.start()
+    thread.join(5)
+    assert acquired == [held]
+    assert pool.stats()["created"] == 1
+
+
+def test_close_all_closes_idle_connections(server):
+    pool = make_pool(server)
+    with pool.connection() as conn:
+        pass
+    pool.close_all()
+    assert conn.closed
+    assert pool.stats()["idle"] == 0
+
+
+def test_mysql_store_replaces_dropped_connection(mysql_store):
+    mysql_store.pool.stale_timeout = 0
+    with mysql_store.pool.connection() as conn:
+        pass
+    created = mysql_store.pool.stats()["created"]
+    conn.close()  # Сервер закрыл простаивавшее соединение
+
+    assert mysql_store.get_stats_summary()["total_sessions"] == 0
+    assert mysql_store.pool.stats()["created"] == created + 1
@@ -0,0 +1,73 @@
+"""Тесты потоковой выгрузки результатов анализа (export_log_analysis)"""
+
+import csv
+import io
+import json
+
+import pytest
+
+import xrmd_agent_manager as xam
+
+FIELDS = [name for name, _ in xam.LOG_EXPORT_FIELDS]
+
+
+@pytest.fixture
+def results(sqlite_store):
+    run_id = sqlite_store.create_log_stats_session(3)
+    for i in range(3):
+        sqlite_store.save_log_analysis(
+            "analyzer", f"строка {i}, с запятой", f'Ответ\n{{"classification": "error", "confidence": 0.{i + 1}}}', 0.5, run_id
+        )
+    sqlite_store.save_log_analysis("other", "чужая строка", "без JSON", 0.1)
+    return sqlite_store, run_id
+
+
+def test_jsonl_export(results, tmp_path):
+    store, run_id = results
+    path = str(tmp_path / "out.jsonl")
+
+    assert xam.export_log_analysis(store, path, run_id=run_id, chunk_size=2) == 3
+
+    with open(path, encoding="utf-8") as output:
+        records = [json.loads(line) for line in output]
+    assert [record["log_text"] for record in records] == [f"строка {i}, с запятой" for i in range(3)]
+    assert list(records[0]) == FIELDS
+    assert records[0]["verdict_class"] == "ERROR"
+    assert records[0]["response"].startswith("Ответ\n")
+
+
+def test_csv_export_format_from_extension(results, tmp_path):
+    store, _ = results
+    path = str(tmp_path / "out.csv")
+
+    assert xam.export_log_analysis(store, path, agent_name="other") == 1
+
+    with open(path, encoding="utf-8", newline="") as output:
+        rows = list(csv.DictReader(output))
+    assert [row["log_text"] for row in rows] == ["чужая строка"]
+    assert list(rows[0]) == FIELDS
+
+
+def test_csv_to_stdout_keeps_crlf_rows(results, monkeypatch):
+    store, run_id = results
+    raw = io.BytesIO()
+    # stdout в Windows: текстовый поток, заменяющий "\n" на "\r\n"
+    stdout = io.TextIOWrapper(raw, encoding="cp1251", newline="\r\n")
+    monkeypatch.setattr(xam.sys, "stdout", stdout)
+
+    assert xam.export_log_analysis(store, "-", export_format="csv", run_id=run_id) == 3
+    stdout.write("после выгрузки\n")  # stdout не закрыт выгрузкой
+    stdout.flush()
+
+    data = raw.getvalue()
+    assert b"\r\r\n" not in data
+    tail = "после выгрузки\r\n".encode("cp1251")
+    assert data.endswith(tail)
+    rows = list(csv.DictReader(io.StringIO(data[:-len(tail)].decode("utf-8"), newline="")))
+    assert [row["log_text"] for row in rows] == [f"строка {i}, с запятой" for i in range(3)]
+
+
+def test_unknown_format_is_rejected(results, tmp_path):
+    store, _ = results
+    with pytest.raises(ValueError):
+        xam.export_log_analysis(store, str(tmp_path / "out.xml"), export_format="xml")
@@ -0,0 +1,100 @@
+"""Тесты пула keep-alive соединений с RAGFlow (RAGFlowHTTPPool) на локальном HTTP-сервере"""
+
+import http.server
+import json
+import threading
+
+import pytest
+
+import xrmd_agent_manager as xam
+
+pytest.importorskip("requests")
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Ответы в формате API RAGFlow; /stream - потоковый ответ из нескольких событий"""
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        if self.path.startswith("/api/v1/stream"):
+            body = "".join(f'data:{{"code": 0, "data": {{"answer": "part {i}"}}}}\n\n' for i in range(50)).encode()
+        else:
+            body = json.dumps({"code": 0, "data": self.path}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.daemon_threads = True
+    httpd.connections = set()
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def pool(server):
+    pool = xam.RAGFlowHTTPPool(f"http://127.0.0.1:{server.server_port}/api/v1", {"Authorization": "Bearer key"}, pool_size=2)
+    yield pool
+    pool.close()
+
+
+def test_requests_reuse_connection(server, pool):
+    for i in range(5):
+        assert pool.get(f"/agents?page={i}").json()["data"] == f"/api/v1/agents?page={i}"
+
+    stats = pool.stats()
+    assert (stats["requests"], stats["errors"], stats["in_flight"]) == (5, 0, 0)
+    assert (stats["connections_opened"], stats["connections_reused"]) == (1, 4)
+    assert len(server.connections) == 1
+
+
+def test_stream_stopped_early_returns_connection(server, pool):
+    response = pool.request("GET", "/stream", stream=True)
+    assert pool.stats()["open_streams"] == 1
+    lines = response.iter_lines(decode_unicode=True)
+    assert next(lines).startswith("data:")
+    lines.close()  # Как Session.ask на событии message_end
+
+    assert pool.stats()["open_streams"] == 0
+    pool.get("/agents")
+    assert len(server.connections) == 1  # Соединение потока вернулось в пул
+
+
+def test_failed_request_is_counted(pool):
+    pool.api_url = "http://127.0.0.1:1/api/v1"  # Порт, на котором никто не слушает
+    with pytest.raises(Exception):
+        pool.get("/agents")
+    stats = pool.stats()
+    assert (stats["requests"], stats["errors"], stats["in_flight"]) == (1, 1, 0)
+
+
+def test_pool_only_grows(pool):
+    pool.resize(8)
+    pool.resize(4)
+    assert pool.stats()["pool_size"] == 8
+
+
+def test_client_routes_sdk_requests_through_pool(server, monkeypatch):
+    monkeypatch.setitem(xam.CONFIG, "BASE_URL", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(xam, "_ragflow_clients", {})
+    pytest.importorskip("ragflow_sdk")
+
+    client = xam.get_ragflow_client(pool_size=3)
+
+    assert xam.get_ragflow_client() is client
+    assert client.http_pool.stats()["pool_size"] >= 3
+    client.get("/agents")
+    assert client.http_pool.stats()["requests"] == 1
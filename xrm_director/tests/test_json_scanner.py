@@ -0,0 +1,92 @@
+"""Тесты извлечения JSON из ответов агента: JSONObjectScanner и repair_json_object"""
+
+import sys
+
+import pytest
+
+import xrmd_agent_manager as xam
+
+
+@pytest.fixture(autouse=True)
+def without_json_repair(monkeypatch):
+    """Встроенное восстановление JSON проверяется без необязательного пакета json_repair"""
+    monkeypatch.setitem(sys.modules, "json_repair", None)
+
+
+def parse(text):
+    scanner = xam.JSONObjectScanner()
+    scanner.feed(text)
+    return scanner.parse()
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('Ответ: {"classification": "ERROR", "confidence": 0.9}', {"classification": "ERROR", "confidence": 0.9}),
+    ('{"a": {"b": {"c": [1, {"d": 2}]}}} хвост', {"a": {"b": {"c": [1, {"d": 2}]}}}),
+    ('{"text": "скобки } и { в строке"}', {"text": "скобки } и { в строке"}),
+    ('{"text": "кавычка \\" и скобка }", "n": 1}', {"text": 'кавычка " и скобка }', "n": 1}),
+    ('{"path": "C:\\\\logs\\\\"}', {"path": "C:\\logs\\"}),
+    ('{не json} затем {"class": "ok"}', {"class": "ok"}),
+    ('{"first": 1} {"second": 2}', {"first": 1}),
+    ('{см. {"class": "ok"}}', {"class": "ok"}),
+])
+def test_first_json_object(text, expected):
+    assert parse(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "обычный ответ без JSON",
+    "подставьте {placeholder} в шаблон",
+    "",
+])
+def test_text_without_json(text):
+    assert parse(text) is None
+
+
+def test_chunked_feed_matches_single_feed():
+    text = 'Вывод {"msg": "a \\"}\\" b\\\\", "nested": {"x": "{"}} и {"second": true}'
+    expected = xam.JSONObjectScanner()
+    expected.feed(text)
+    # Граница порции может попасть на любой символ, в том числе на обратную косую черту
+    for cut in range(len(text) + 1):
+        scanner = xam.JSONObjectScanner()
+        scanner.feed(text[:cut])
+        scanner.feed(text[cut:])
+        assert scanner.candidates == expected.candidates, cut
+    assert len(expected.candidates) == 2
+
+
+def test_feed_returns_objects_completed_in_chunk():
+    scanner = xam.JSONObjectScanner()
+    assert scanner.feed('{"a": ') == []
+    assert scanner.unclosed() == '{"a": '
+    assert scanner.feed('1} {"b"') == ['{"a": 1}']
+    assert scanner.feed(': 2}') == ['{"b": 2}']
+    assert scanner.unclosed() is None
+
+
+def test_trailing_comma_is_repaired():
+    assert parse('{"classification": "INFO", "confidence": 0.4,}') == {"classification": "INFO", "confidence": 0.4}
+
+
+def test_truncated_answer_is_repaired():
+    text = 'Итог: {"classification": "ERROR", "confidence": 0.9, "matched_entry": "disk fu'
+    assert parse(text) == {"classification": "ERROR", "confidence": 0.9, "matched_entry": "disk fu"}
+
+
+def test_truncated_nested_answer_drops_incomplete_tail():
+    value = parse('{"classification": "WARN", "details": {"lines": [1, 2], "host": ')
+    assert value["classification"] == "WARN"
+    assert value["details"]["lines"] == [1, 2]
+
+
+def test_repair_rejects_non_objects():
+    assert xam.repair_json_object("[1, 2, 3]") is None
+    assert xam.repair_json_object("{}") is None
+    assert xam.repair_json_object("совсем не json") is None
+
+
+def test_extract_json_is_compact():
+    store = xam.ResultStore()
+    text = 'Ответ:\n{\n  "classification": "ОШИБКА",\n  "confidence": 1\n}'
+    assert store.extract_json_from_response(text) == '{"classification":"ОШИБКА","confidence":1}'
+    assert store.extract_json_from_response("нет JSON") is None
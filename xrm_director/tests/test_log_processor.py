@@ -0,0 +1,127 @@
+"""Тесты потока обработки логов: учет статистики при остановке и повторных запросах"""
+
+import queue
+import threading
+import types
+
+import pytest
+
+import xrmd_agent_manager as xam
+
+
+class FakeSession:
+    """Сеанс агента, отвечающий заданными ответами по очереди"""
+
+    def __init__(self, answers, gate=None):
+        self.answers = list(answers)
+        self.gate = gate
+        self.asking = threading.Event()
+
+    def ask(self, prompt, stream=True):
+        self.asking.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        yield types.SimpleNamespace(content=self.answers.pop(0))
+
+
+class UnfinishedThread:
+    """Поток, который не успевает завершиться за время ожидания stop_processing"""
+
+    def __init__(self, thread):
+        self.thread = thread
+
+    def join(self, timeout=None):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def no_delay(monkeypatch):
+    monkeypatch.setattr(xam, "LOG_PROCESSING_DELAY", 0)
+
+
+def make_processor(store, session, lines, prompt_key=None):
+    processor = xam.LogProcessor.__new__(xam.LogProcessor)
+    processor.rag_menu = types.SimpleNamespace(rag_object=None)
+    processor.db = store
+    processor.result_writer = xam.LogResultWriter(store)
+    processor.current_agent = types.SimpleNamespace(title="analyzer")
+    processor.current_session = session
+    processor.prompt_template = "NO_PROMPT"
+    processor.verdict_schema = xam.VerdictSchema.for_prompt(prompt_key)
+    processor.requeue_attempts = {}
+    processor.log_queue = queue.Queue()
+    for line_number, line in enumerate(lines, 1):
+        processor.log_queue.put((line_number, line))
+    processor.current_stats_id = store.create_log_stats_session(len(lines))
+    processor.stats_buffer = xam.LogStatsBuffer(store, processor.current_stats_id, flush_interval=3600)
+    processor.processing_flag = True
+    processor.paused = False
+    processor.processor_thread = None
+    return processor
+
+
+def test_answer_after_stop_timeout_is_counted(sqlite_store):
+    gate = threading.Event()
+    session = FakeSession(['{"classification": "INFO"}'], gate=gate)
+    processor = make_processor(sqlite_store, session, ["line"])
+    thread = threading.Thread(target=processor.process_logs)
+    thread.start()
+    assert session.asking.wait(5)
+
+    processor.processor_thread = UnfinishedThread(thread)
+    assert processor.stop_processing()
+    assert sqlite_store.get_recent_stats(limit=1)[0]["processed_logs"] == 0
+
+    gate.set()  # Ответ приходит уже после записи статуса "stopped"
+    thread.join(5)
+
+    stats = sqlite_store.get_recent_stats(limit=1)[0]
+    assert (stats["status"], stats["processed_logs"], stats["successful_logs"]) == ("stopped", 1, 1)
+
+
+def test_requeued_invalid_line_is_counted_once(sqlite_store, monkeypatch):
+    monkeypatch.setattr(xam, "VERDICT_REQUEUE_INVALID", True)
+    monkeypatch.setattr(xam, "VERDICT_REQUEUE_ATTEMPTS", 1)
+    # Оба ответа не по схеме: нет обязательного поля classification
+    session = FakeSession(['{"confidence": 0.5}', '{"confidence": 0.6}'])
+    processor = make_processor(sqlite_store, session, ["line"], prompt_key="log_prompt_1")
+
+    processor.process_logs()
+
+    stats = sqlite_store.get_recent_stats(limit=1)[0]
+    assert (stats["status"], stats["processed_logs"], stats["invalid_logs"]) == ("completed", 1, 1)
+
+
+def test_requeued_line_valid_on_retry_is_not_invalid(sqlite_store, monkeypatch):
+    monkeypatch.setattr(xam, "VERDICT_REQUEUE_INVALID", True)
+    session = FakeSession(['{"confidence": 0.5}', '{"classification": "ERROR", "confidence": 0.9}'])
+    processor = make_processor(sqlite_store, session, ["line"], prompt_key="log_prompt_1")
+
+    processor.process_logs()
+
+    stats = sqlite_store.get_recent_stats(limit=1)[0]
+    assert (stats["processed_logs"], stats["successful_logs"], stats["invalid_logs"]) == (1, 1, 0)
+
+
+def test_identical_lines_have_separate_retry_budgets(sqlite_store, monkeypatch):
+    monkeypatch.setattr(xam, "VERDICT_REQUEUE_INVALID", True)
+    monkeypatch.setattr(xam, "VERDICT_REQUEUE_ATTEMPTS", 1)
+    invalid, valid = '{"confidence": 0.5}', '{"classification": "INFO"}'
+    session = FakeSession([invalid, invalid, valid, valid])
+    processor = make_processor(sqlite_store, session, ["disk full", "disk full"], prompt_key="log_prompt_1")
+
+    processor.process_logs()
+
+    assert session.answers == []  # Каждая из одинаковых строк запрошена повторно
+    stats = sqlite_store.get_recent_stats(limit=1)[0]
+    assert (stats["processed_logs"], stats["successful_logs"], stats["invalid_logs"]) == (2, 2, 0)
+    assert processor.requeue_attempts == {}
+
+
+def test_log_file_lines_are_numbered(sqlite_store, tmp_path):
+    path = tmp_path / "app.log"
+    path.write_text("first\n\nsame\nsame\n", encoding="utf-8")
+    processor = make_processor(sqlite_store, FakeSession([]), [])
+
+    assert processor.load_logs_from_file(str(path)) == 4
+    assert list(processor.log_queue.queue) == [(1, "first"), (3, "same"), (4, "same")]
@@ -0,0 +1,195 @@
+"""Тесты миграций схемы: обновление баз, созданных до появления миграций, и повторный запуск"""
+
+import datetime
+import sqlite3
+
+import pytest
+
+import xrmd_agent_manager as xam
+
+LATEST_VERSION = xam.Database.MIGRATIONS[-1][0]
+
+
+def utc_text(value):
+    """Время так, как его записывал CURRENT_TIMESTAMP (UTC, с точностью до секунды)"""
+    return value.astimezone(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def create_legacy_db(path, with_json_answer=True):
+    """База в том виде, в котором ее создавала версия без миграций (user_version = 0)"""
+    conn = sqlite3.connect(path)
+    conn.execute(f'''
+        CREATE TABLE log_analysis (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            agent_name TEXT NOT NULL,
+            log_text TEXT NOT NULL,
+            response TEXT NOT NULL,
+            {"json_answer TEXT," if with_json_answer else ""}
+            processing_time REAL NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE log_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            start_time DATETIME NOT NULL,
+            end_time DATETIME,
+            total_logs INTEGER NOT NULL,
+            processed_logs INTEGER NOT NULL,
+            successful_logs INTEGER NOT NULL,
+            failed_logs INTEGER NOT NULL,
+            average_time REAL,
+            status TEXT NOT NULL
+        )
+    ''')
+    conn.commit()
+    return conn
+
+
+def add_legacy_run(conn, start, end=None, status="completed"):
+    """Сессия обработки; время - локальное, как его записывал адаптер datetime модуля sqlite3"""
+    cursor = conn.execute(
+        "INSERT INTO log_stats (start_time, end_time, total_logs, processed_logs, successful_logs, failed_logs, status) "
+        "VALUES (?, ?, 1, 1, 1, 0, ?)",
+        (start.isoformat(" "), end.isoformat(" ") if end else None, status)
+    )
+    conn.commit()
+    return cursor.lastrowid
+
+
+def add_legacy_result(conn, log_text, response, json_answer, timestamp):
+    cursor = conn.execute(
+        "INSERT INTO log_analysis (agent_name, log_text, response, json_answer, processing_time, timestamp) "
+        "VALUES ('analyzer', ?, ?, ?, 1.5, ?)",
+        (log_text, response, json_answer, utc_text(timestamp))
+    )
+    conn.commit()
+    return cursor.lastrowid
+
+
+def test_new_database_gets_latest_version(sqlite_store):
+    assert sqlite_store.get_schema_version() == LATEST_VERSION
+    assert [version for version, _, _ in xam.Database.MIGRATIONS] == list(range(1, LATEST_VERSION + 1))
+
+
+def test_legacy_database_is_upgraded_with_data(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = create_legacy_db(path)
+    start = datetime.datetime.now().replace(microsecond=0) - datetime.timedelta(hours=2)
+    first_run = add_legacy_run(conn, start, start + datetime.timedelta(minutes=30))
+    second_run = add_legacy_run(conn, start + datetime.timedelta(hours=1), status="running")
+    inside_first = add_legacy_result(
+        conn, "connection refused", 'Итог {"classification": "error", "confidence": 0.75}',
+        '{"classification": "error", "confidence": 0.75}', start + datetime.timedelta(minutes=10)
+    )
+    between_runs = add_legacy_result(conn, "between runs", "без JSON", None, start + datetime.timedelta(minutes=45))
+    inside_second = add_legacy_result(
+        conn, "disk full", '{"class": "warn"}', '{"class": "warn"}', start + datetime.timedelta(minutes=70)
+    )
+    conn.close()
+
+    db = xam.Database(path)
+    try:
+        assert db.get_schema_version() == LATEST_VERSION
+
+        row = db.get_log_analysis(inside_first)
+        assert (row["log_text"], row["response"]) == ("connection refused", 'Итог {"classification": "error", "confidence": 0.75}')
+        assert row["verdict_class"] == "ERROR"
+        assert row["verdict_confidence"] == pytest.approx(0.75)
+        assert row["run_id"] == first_run
+        assert db.get_log_analysis(between_runs)["run_id"] is None
+        assert db.get_log_analysis(inside_second)["run_id"] == second_run
+        assert db.get_log_analysis(inside_second)["verdict_class"] == "WARN"
+
+        # Старые строки попадают в полнотекстовый индекс и почасовые сводки
+        assert [found["id"] for found in db.search_log_analysis("refused")] == [inside_first]
+        rollup = {item["run_id"]: item["count"] for item in db.get_rollup_stats(group_by=("run_id",))}
+        assert rollup == {first_run: 1, None: 1, second_run: 1}
+
+        # Новые записи после обновления пишутся в компактном формате и читаются так же
+        new_id = db.save_log_analysis("analyzer", "connection refused", "повтор", 0.1, second_run)
+        assert db.get_log_analysis(new_id)["log_text"] == "connection refused"
+        assert db.get_recent_stats(limit=1)[0]["invalid_logs"] == 0
+    finally:
+        db.close()
+
+
+def test_database_without_json_answer_is_upgraded(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    create_legacy_db(path, with_json_answer=False).close()
+
+    db = xam.Database(path)
+    try:
+        assert db.get_schema_version() == LATEST_VERSION
+        analysis_id = db.save_log_analysis("analyzer", "line", '{"classification": "info"}', 0.1)
+        assert db.get_log_analysis(analysis_id)["json_answer"] == '{"classification":"info"}'
+    finally:
+        db.close()
+
+
+def test_migrations_are_idempotent(sqlite_store):
+    run_id = sqlite_store.create_log_stats_session(1)
+    sqlite_store.save_log_analysis("analyzer", "line", '{"classification": "info"}', 0.1, run_id)
+    # Базы до появления миграций имеют user_version = 0 при уже созданных таблицах
+    sqlite_store.connect().execute("PRAGMA user_version = 0")
+    sqlite_store.close()
+
+    db = xam.Database(sqlite_store.db_path)
+    try:
+        assert db.get_schema_version() == LATEST_VERSION
+        assert [item["count"] for item in db.get_rollup_stats(group_by=())] == [1]
+        assert len(db.search_log_analysis("line")) == 1
+    finally:
+        db.close()
+
+
+def test_failed_migration_is_rolled_back(sqlite_store):
+    class BrokenDatabase(xam.Database):
+        MIGRATIONS = xam.Database.MIGRATIONS + [(LATEST_VERSION + 1, "сломанная миграция", "_migrate_broken")]
+
+        def _migrate_broken(self):
+            self.cursor.execute("CREATE TABLE half_done (x INTEGER)")
+            raise RuntimeError("ошибка посередине миграции")
+
+    path = sqlite_store.db_path
+    sqlite_store.close()
+    with pytest.raises(RuntimeError):
+        BrokenDatabase(path)
+
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == LATEST_VERSION
+        assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'half_done'").fetchone() is None
+    finally:
+        conn.close()
+
+
+def test_mysql_migrations_are_idempotent(mysql_store):
+    mysql_store.save_log_analysis("analyzer", "line", '{"classification": "info"}', 0.1)
+    with mysql_store.pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM schema_version")
+        conn.commit()
+
+    again = xam.MySQLResultStore({"name": mysql_store.config["name"]})
+    try:
+        assert again.get_schema_version() == xam.MySQLResultStore.MIGRATIONS[-1][0]
+        assert [item["count"] for item in again.get_rollup_stats(group_by=())] == [1]
+    finally:
+        again.close()
+
+
+def test_backfill_links_rows_from_first_second_of_run(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = create_legacy_db(path)
+    # start_time хранит микросекунды, а CURRENT_TIMESTAMP усекает время результата до секунды
+    start = datetime.datetime.now().replace(microsecond=600000) - datetime.timedelta(hours=1)
+    run_id = add_legacy_run(conn, start, start + datetime.timedelta(minutes=5))
+    first_second = add_legacy_result(conn, "line in first second", "ответ", None, start + datetime.timedelta(milliseconds=200))
+    conn.close()
+
+    db = xam.Database(path)
+    try:
+        assert db.get_log_analysis(first_second)["run_id"] == run_id
+    finally:
+        db.close()
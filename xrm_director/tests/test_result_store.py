@@ -0,0 +1,201 @@
+"""Общие тесты хранилищ результатов: SQLite (Database) и MySQL (MySQLResultStore)"""
+
+import json
+
+import pytest
+
+import xrmd_agent_manager as xam
+
+
+def reopen(store):
+    """Еще один экземпляр хранилища той же базы"""
+    if isinstance(store, xam.MySQLResultStore):
+        return xam.MySQLResultStore({"name": store.config["name"]})
+    return xam.Database(store.db_path)
+
+
+def save_result(store, log_text, verdict=None, confidence=None, agent_name="analyzer", run_id=None,
+                processing_time=0.5):
+    """Сохранение результата анализа; вердикт передается агентом в JSON внутри ответа"""
+    answer = {}
+    if verdict is not None:
+        answer["classification"] = verdict
+    if confidence is not None:
+        answer["confidence"] = confidence
+    response = f"Анализ строки.\n{json.dumps(answer)}" if answer else "Анализ строки без вердикта"
+    return store.save_log_analysis(agent_name, log_text, response, processing_time, run_id)
+
+
+def test_migrations_reach_latest_version(store):
+    assert store.get_schema_version() == store.MIGRATIONS[-1][0]
+
+
+def test_reopen_does_not_reapply_migrations(store):
+    run_id = store.create_log_stats_session(1)
+    save_result(store, "line", "info", 0.5, run_id=run_id)
+
+    again = reopen(store)
+    try:
+        assert again.get_schema_version() == store.MIGRATIONS[-1][0]
+        # Повторная миграция сводок пересчитала бы их заново, а не удвоила
+        stats = again.get_rollup_stats(group_by=("agent_name",))
+        assert [item["count"] for item in stats] == [1]
+    finally:
+        again.close()
+
+
+def test_save_and_read_result(store):
+    run_id = store.create_log_stats_session(1)
+    analysis_id = save_result(store, "disk /var is full", "error", 0.8, run_id=run_id)
+
+    row = store.get_log_analysis(analysis_id)
+    assert row["log_text"] == "disk /var is full"
+    assert row["response"].startswith("Анализ строки.")
+    assert json.loads(row["json_answer"]) == {"classification": "error", "confidence": 0.8}
+    assert row["verdict_class"] == "ERROR"
+    assert row["verdict_confidence"] == pytest.approx(0.8)
+    assert row["run_id"] == run_id
+
+
+def test_result_without_json_has_no_verdict(store):
+    row = store.get_log_analysis(save_result(store, "plain line"))
+    assert row["json_answer"] is None
+    assert row["verdict_class"] is None
+    assert row["verdict_confidence"] is None
+
+
+def test_batch_insert_and_chunked_read(store):
+    run_id = store.create_log_stats_session(5)
+    rows = [
+        store.prepare_log_analysis_row("analyzer", f"line {i}", f'{{"classification": "info", "confidence": {i / 10}}}', 0.1, run_id)
+        for i in range(5)
+    ]
+    assert store.save_log_analysis_batch(rows) == 5
+
+    chunks = list(store.iter_log_analysis_chunks(run_id=run_id, chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert [row["log_text"] for chunk in chunks for row in chunk] == [f"line {i}" for i in range(5)]
+
+
+def test_log_stats_counters(store):
+    run_id = store.create_log_stats_session(10, agent_session_id="session-1")
+    assert store.update_log_stats(run_id, processed=3, successful=2, failed=1, invalid=1)
+    assert store.update_log_stats(run_id, processed=2, successful=2)
+    save_result(store, "line", "info", run_id=run_id, processing_time=2.0)
+    assert store.update_log_stats(run_id, status="completed")
+
+    recent = store.get_recent_stats(limit=1)[0]
+    assert recent["id"] == run_id
+    assert (recent["processed_logs"], recent["successful_logs"], recent["failed_logs"]) == (5, 4, 1)
+    assert recent["invalid_logs"] == 1
+    assert recent["status"] == "completed"
+    assert recent["average_time"] == pytest.approx(2.0)
+    assert store.get_agent_session_ids() == {"session-1"}
+    assert store.get_stats_summary()["processed_logs"] == 5
+
+
+def test_search_finds_matching_rows(store):
+    expected = save_result(store, "connection refused by pg_hba.conf", "error")
+    save_result(store, "disk usage normal", "info")
+
+    results = store.search_log_analysis("pg_hba.conf refused")
+    assert [row["id"] for row in results] == [expected]
+    assert store.search_log_analysis("nothing like this") == []
+
+
+def test_verdict_counts_and_filter(store):
+    save_result(store, "a", "error", 0.9)
+    save_result(store, "b", "error", 0.7)
+    save_result(store, "c", "info", 0.5, agent_name="other")
+
+    counts = {item["verdict"]: item["count"] for item in store.get_verdict_counts()}
+    assert counts == {"ERROR": 2, "INFO": 1}
+    found = store.find_by_verdict("error", min_confidence=0.8)
+    assert [row["log_text"] for row in found] == ["a"]
+
+
+def test_rollup_follows_inserts_and_deletes(store):
+    first = store.create_log_stats_session(3)
+    second = store.create_log_stats_session(1)
+    save_result(store, "a", "error", 0.9, run_id=first, processing_time=1.0)
+    save_result(store, "b", "error", 0.5, run_id=first, processing_time=3.0)
+    save_result(store, "c", None, run_id=first)
+    save_result(store, "d", "info", 0.2, run_id=second, agent_name="other")
+
+    stats = {item["verdict_class"]: item for item in store.get_rollup_stats(group_by=("verdict_class",))}
+    assert stats["ERROR"]["count"] == 2
+    assert stats["ERROR"]["avg_time"] == pytest.approx(2.0)
+    assert stats["ERROR"]["avg_confidence"] == pytest.approx(0.7)
+    assert stats[None]["count"] == 1
+    assert stats[None]["avg_confidence"] is None
+    assert stats["INFO"]["count"] == 1
+
+    store.update_log_stats(first, status="completed")
+    assert store.purge_run(first) == 3
+    stats = store.get_rollup_stats(group_by=("agent_name", "run_id"))
+    assert [(item["agent_name"], item["run_id"], item["count"]) for item in stats] == [("other", second, 1)]
+
+
+def test_purge_run_keeps_running_and_other_runs(store):
+    running = store.create_log_stats_session(1)
+    done = store.create_log_stats_session(2)
+    save_result(store, "running line", "info", run_id=running)
+    kept = save_result(store, "kept line", "info")
+    save_result(store, "done 1", "info", run_id=done)
+    save_result(store, "done 2", "info", run_id=done)
+    store.update_log_stats(done, status="completed")
+
+    assert store.purge_run(running) is None
+    assert store.purge_run(done, batch_size=1) == 2
+    assert store.purge_run(done) is None
+    assert [row["id"] for row in store.get_recent_stats(limit=10)] == [running]
+    assert store.get_log_analysis(kept) is not None
+    assert store.search_log_analysis("done") == []
+
+
+def test_retention_keeps_latest_runs(store):
+    runs = [store.create_log_stats_session(1) for _ in range(3)]
+    for run_id in runs:
+        save_result(store, f"line of run {run_id}", "info", run_id=run_id)
+        store.update_log_stats(run_id, status="completed")
+
+    result = store.apply_retention(max_age_days=0, max_runs=1, max_size_mb=0)
+    assert result == {"deleted_rows": 2, "deleted_runs": 2}
+    assert [row["id"] for row in store.get_recent_stats(limit=10)] == [runs[-1]]
+
+
+def save_at(store, log_text, timestamp, agent_name="analyzer", run_id=None, verdict="info", confidence=0.5):
+    """Запись результата с заданным временем обработки (UTC-строка, как хранит БД)"""
+    row = store.prepare_log_analysis_row(
+        agent_name, log_text, json.dumps({"classification": verdict, "confidence": confidence}), 1.0, run_id
+    )
+    row["timestamp"] = timestamp
+    assert store.save_log_analysis_batch([row]) == 1
+
+
+def test_rollup_buckets_and_filters(store):
+    run_id = store.create_log_stats_session(3)
+    save_at(store, "a", "2026-01-01 10:05:00", run_id=run_id, confidence=0.2)
+    save_at(store, "b", "2026-01-01 10:55:00", run_id=run_id, confidence=0.4)
+    save_at(store, "c", "2026-01-01 12:30:00", run_id=run_id, verdict="error", confidence=1.0)
+    save_at(store, "d", "2026-01-01 12:40:00", agent_name="other")
+
+    hours = store.get_rollup_stats(group_by=("bucket",))
+    assert [(item["bucket"][:19], item["count"]) for item in hours] == [
+        ("2026-01-01 10:00:00", 2), ("2026-01-01 12:00:00", 2)
+    ]
+    assert hours[0]["avg_confidence"] == pytest.approx(0.3)
+
+    # since включает свой час целиком, until - граница без включения
+    in_window = store.get_rollup_stats(group_by=(), since="2026-01-01 10:30:00", until="2026-01-01 12:00:00")
+    assert [item["count"] for item in in_window] == [2]
+
+    by_agent = store.get_rollup_stats(group_by=("agent_name",), run_id=run_id)
+    assert [(item["agent_name"], item["count"]) for item in by_agent] == [("analyzer", 3)]
+    by_verdict = store.get_rollup_stats(group_by=("verdict_class",), agent_name="analyzer")
+    assert [(item["verdict_class"], item["count"]) for item in by_verdict] == [("INFO", 2), ("ERROR", 1)]
+
+
+def test_rollup_rejects_unknown_dimension(store):
+    with pytest.raises(ValueError):
+        store.get_rollup_stats(group_by=("log_text",))
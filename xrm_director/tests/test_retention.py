@@ -0,0 +1,105 @@
+"""Тесты удаления результатов: purge_run, политика хранения и инкрементальная очистка"""
+
+import datetime
+
+import xrmd_agent_manager as xam
+
+
+def save_rows(store, texts, run_id=None, days_ago=0):
+    """Пакетная запись результатов с временем обработки days_ago дней назад"""
+    timestamp = store.to_db_timestamp(datetime.datetime.now() - datetime.timedelta(days=days_ago))
+    rows = []
+    for text in texts:
+        row = store.prepare_log_analysis_row("analyzer", text, f'{{"classification": "info", "text": "{text}"}}', 0.1, run_id)
+        row["timestamp"] = timestamp
+        rows.append(row)
+    assert store.save_log_analysis_batch(rows) == len(rows)
+
+
+def log_texts(store):
+    return sorted(row["log_text"] for chunk in store.iter_log_analysis_chunks() for row in chunk)
+
+
+def rollup_count(store):
+    return sum(item["count"] for item in store.get_rollup_stats(group_by=()))
+
+
+def test_age_policy_keeps_running_run(store):
+    running = store.create_log_stats_session(2)
+    finished = store.create_log_stats_session(1)
+    store.update_log_stats(finished, status="completed")
+    save_rows(store, ["running old"], run_id=running, days_ago=10)
+    save_rows(store, ["finished old"], run_id=finished, days_ago=10)
+    save_rows(store, ["orphan old"], days_ago=10)
+    save_rows(store, ["fresh"], days_ago=0)
+
+    result = store.apply_retention(max_age_days=5, max_runs=0, max_size_mb=0)
+
+    assert result["deleted_rows"] == 2
+    assert log_texts(store) == ["fresh", "running old"]
+    assert rollup_count(store) == 2
+
+
+def test_run_limit_never_purges_running_run(store):
+    running = store.create_log_stats_session(1)
+    save_rows(store, ["running"], run_id=running)
+    for _ in range(2):
+        run_id = store.create_log_stats_session(1)
+        save_rows(store, [f"run {run_id}"], run_id=run_id)
+        store.update_log_stats(run_id, status="completed")
+
+    result = store.apply_retention(max_age_days=0, max_runs=1, max_size_mb=0)
+
+    assert result == {"deleted_rows": 1, "deleted_runs": 1}
+    assert "running" in log_texts(store)
+
+
+def test_size_policy_keeps_running_run(sqlite_store):
+    running = sqlite_store.create_log_stats_session(100)
+    save_rows(sqlite_store, [f"running {i}" for i in range(100)], run_id=running)
+    save_rows(sqlite_store, [f"old {i}" for i in range(100)])
+
+    result = sqlite_store.apply_retention(max_age_days=0, max_runs=0, max_size_mb=0.001)
+
+    assert result["deleted_rows"] == 100
+    assert log_texts(sqlite_store) == sorted(f"running {i}" for i in range(100))
+    assert rollup_count(sqlite_store) == 100
+
+
+def test_purge_removes_unreferenced_log_lines_and_index(sqlite_store):
+    first = sqlite_store.create_log_stats_session(2)
+    second = sqlite_store.create_log_stats_session(1)
+    save_rows(sqlite_store, ["shared line", "only first"], run_id=first)
+    save_rows(sqlite_store, ["shared line"], run_id=second)
+    sqlite_store.update_log_stats(first, status="completed")
+
+    assert sqlite_store.purge_run(first) == 2
+
+    lines = [row[0] for row in sqlite_store._fetchall("SELECT text FROM log_lines ORDER BY text")]
+    assert lines == ["shared line"]
+    assert sqlite_store.search_log_analysis("only first") == []
+    assert [row["run_id"] for row in sqlite_store.search_log_analysis("shared line")] == [second]
+
+
+def test_incremental_vacuum_returns_free_pages(sqlite_store):
+    run_id = sqlite_store.create_log_stats_session(500)
+    save_rows(sqlite_store, [f"line {i} " + "x" * 2000 for i in range(500)], run_id=run_id)
+    sqlite_store.update_log_stats(run_id, status="completed")
+    assert sqlite_store.get_database_size()["auto_vacuum"] == "INCREMENTAL"
+
+    sqlite_store.purge_run(run_id)
+    assert sqlite_store.get_database_size()["free_bytes"] > 0
+    assert sqlite_store.incremental_vacuum(pages=16) > 0
+    assert sqlite_store.get_database_size()["free_bytes"] == 0
+
+
+def test_maintenance_pass_applies_settings(sqlite_store, monkeypatch):
+    monkeypatch.setattr(xam, "LOG_RETENTION_DAYS", 1)
+    monkeypatch.setattr(xam, "LOG_RETENTION_MAX_RUNS", 0)
+    monkeypatch.setattr(xam, "LOG_RETENTION_MAX_SIZE_MB", 0)
+    save_rows(sqlite_store, ["old"], days_ago=3)
+    save_rows(sqlite_store, ["new"])
+
+    xam.LogDatabaseMaintenance(sqlite_store).run_once()
+
+    assert log_texts(sqlite_store) == ["new"]
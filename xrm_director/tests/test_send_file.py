@@ -0,0 +1,81 @@
+"""Тесты пакетной отправки сообщений из файла (cli_send_file)"""
+
+import io
+import json
+import threading
+import types
+
+import pytest
+
+import xrmd_agent_manager as xam
+
+POOL_STATS = {"requests": 0, "errors": 0, "connections_opened": 0, "connections_reused": 0,
+              "peak_in_flight": 0, "pool_size": 1}
+
+
+class FakeMessenger:
+    """AgentMessenger без сервера: каждый ответ повторяет сообщение"""
+
+    def __init__(self, directory):
+        agent = types.SimpleNamespace(id="a", create_session=lambda: types.SimpleNamespace(id="s"))
+        self.directory = types.SimpleNamespace(find=lambda agent_id, agent_title: agent)
+        self.asked = 0
+
+    def remember_session(self, session):
+        return session
+
+    def ask_with_recovery(self, agent, session, message, on_chunk=None):
+        self.asked += 1
+        return session, f"ответ: {message}", None
+
+
+class ClosedPipe(io.StringIO):
+    """stdout, читатель которого завершился (например, "| head -1")"""
+
+    def __init__(self, lines_before_close):
+        super().__init__()
+        self.lines_left = lines_before_close
+
+    def write(self, text):
+        if self.lines_left == 0:
+            raise BrokenPipeError(32, "Broken pipe")
+        self.lines_left -= 1
+        return super().write(text)
+
+
+@pytest.fixture
+def messages(tmp_path, monkeypatch):
+    client = types.SimpleNamespace(http_pool=types.SimpleNamespace(stats=lambda: POOL_STATS))
+    monkeypatch.setattr(xam, "get_ragflow_client", lambda pool_size=None: client)
+    monkeypatch.setattr(xam, "AgentDirectory", lambda client: None)
+    monkeypatch.setattr(xam, "AgentMessenger", FakeMessenger)
+    path = tmp_path / "messages.txt"
+    path.write_text("".join(f"сообщение {i}\n" for i in range(200)), encoding="utf-8")
+    return str(path)
+
+
+def send_file(path, concurrency):
+    """cli_send_file в отдельном потоке: зависание не должно останавливать тесты"""
+    result = []
+    thread = threading.Thread(target=lambda: result.append(xam.cli_send_file(path, concurrency=concurrency)), daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive(), "cli_send_file не завершился"
+    return result[0]
+
+
+def test_results_are_written_as_jsonl(messages, monkeypatch):
+    stdout = io.StringIO()
+    monkeypatch.setattr(xam.sys, "stdout", stdout)
+
+    assert send_file(messages, concurrency=3)
+
+    results = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    assert sorted(result["index"] for result in results) == list(range(200))
+    assert all(result["ok"] for result in results)
+
+
+def test_closed_stdout_stops_sending(messages, monkeypatch):
+    monkeypatch.setattr(xam.sys, "stdout", ClosedPipe(lines_before_close=1))
+
+    assert send_file(messages, concurrency=2) is False
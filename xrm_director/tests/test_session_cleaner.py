@@ -0,0 +1,151 @@
+"""Тесты массового удаления сеансов (SessionCleaner) и удаления сеансов из меню"""
+
+import datetime
+import threading
+import time
+import types
+
+import pytest
+
+import xrmd_agent_manager as xam
+
+NOW_MS = int(time.time() * 1000)
+HOUR_MS = 3600 * 1000
+
+
+class FakeAgent:
+    """Агент с сеансами в памяти; запоминает страницы списка и пакеты удаления"""
+
+    def __init__(self, agent_id, count=0, ages_hours=None, delete_error=None):
+        self.id = agent_id
+        self.title = f"agent {agent_id}"
+        ages_hours = ages_hours or [0] * count
+        self.sessions = [
+            types.SimpleNamespace(id=f"{agent_id}-{i}", update_time=NOW_MS - int(age * HOUR_MS))
+            for i, age in enumerate(ages_hours)
+        ]
+        self.pages = []
+        self.batches = []
+        self.delete_error = delete_error
+        self._lock = threading.Lock()
+
+    def list_sessions(self, page=1, page_size=30):
+        self.pages.append(page)
+        return self.sessions[(page - 1) * page_size:page * page_size]
+
+    def delete_sessions(self, ids=None):
+        assert ids, "delete_sessions(ids=None) удалил бы все сеансы агента"
+        with self._lock:
+            self.batches.append(list(ids))
+        if self.delete_error is not None:
+            raise self.delete_error
+        with self._lock:
+            self.sessions = [session for session in self.sessions if session.id not in ids]
+
+
+@pytest.fixture(autouse=True)
+def small_pages(monkeypatch):
+    monkeypatch.setattr(xam, "SESSION_COUNT_PAGE_SIZE", 3)
+
+
+def make_cleaner(**kwargs):
+    kwargs.setdefault("rate_limit", 0)
+    return xam.SessionCleaner(directory=None, **kwargs)
+
+
+def remaining(agent):
+    return [session.id for session in agent.sessions]
+
+
+def test_all_pages_are_deleted_in_batches():
+    agent = FakeAgent("a", count=7)
+
+    report = make_cleaner(batch_size=3).run([agent])
+
+    assert agent.pages == [1, 2, 3]
+    assert sorted(len(batch) for batch in agent.batches) == [1, 3, 3]
+    assert (report["listed"], report["matched"], report["deleted"], report["failed"]) == (7, 7, 7, 0)
+    assert agent.sessions == []
+
+
+def test_filters_select_sessions():
+    agent = FakeAgent("a", ages_hours=[0, 5, 30, 48, 72])
+    keep = {"a-3"}
+    only = {"a-1", "a-3", "a-4"}
+
+    report = make_cleaner().run([agent], older_than=datetime.timedelta(hours=24), only_ids=only, keep_ids=keep)
+
+    # a-1 свежий, a-2 не из only_ids, a-3 используется - удаляется только a-4
+    assert report["matched"] == 1
+    assert remaining(agent) == ["a-0", "a-1", "a-2", "a-3"]
+
+
+def test_sessions_without_time_are_kept_by_age_filter():
+    agent = FakeAgent("a", ages_hours=[2, 2])
+    agent.sessions[0].update_time = None
+
+    make_cleaner().run([agent], older_than=datetime.timedelta(hours=1))
+
+    assert remaining(agent) == ["a-0"]
+
+
+def test_dry_run_deletes_nothing():
+    agent = FakeAgent("a", count=4)
+
+    report = make_cleaner().run([agent], dry_run=True)
+
+    assert (report["matched"], report["deleted"]) == (4, 0)
+    assert agent.batches == []
+
+
+def test_errors_are_reported_per_agent():
+    broken = FakeAgent("b", count=2, delete_error=ConnectionError("reset"))
+    unlisted = FakeAgent("c", count=1)
+    unlisted.list_sessions = lambda page=1, page_size=30: (_ for _ in ()).throw(ConnectionError("timeout"))
+    healthy = FakeAgent("a", count=2)
+
+    report = make_cleaner().run([healthy, broken, unlisted])
+
+    assert (report["deleted"], report["failed"]) == (2, 2)
+    assert sorted(report["errors"]) == ["agent b: reset", "agent c: timeout"]
+    assert "Ошибка: agent b: reset" in xam.format_cleanup_report(report)
+
+
+def test_requests_are_rate_limited():
+    agent = FakeAgent("a", count=6)  # 3 страницы списка и 3 пакета удаления
+    started = time.monotonic()
+
+    make_cleaner(batch_size=2, rate_limit=50, workers=4).run([agent])
+
+    # 6 запросов с интервалом 1/50 секунды, первый - без ожидания
+    assert time.monotonic() - started >= 5 / 50
+
+
+def test_listed_sessions_are_not_requested_again():
+    agent = FakeAgent("a", count=4)
+
+    report = make_cleaner().run([agent], only_ids={"a-1"}, listed={"a": list(agent.sessions)})
+
+    assert agent.pages == []
+    assert report["deleted"] == 1
+    assert remaining(agent) == ["a-0", "a-2", "a-3"]
+
+
+def test_menu_deletes_chosen_sessions_from_any_page(monkeypatch, capsys):
+    agent = FakeAgent("a", count=7)
+    menu = xam.RAGFlowMenu.__new__(xam.RAGFlowMenu)
+    menu.messenger = types.SimpleNamespace(directory=None)
+    menu.log_processor = None
+    menu.session_prewarmer = types.SimpleNamespace(session_ids=lambda: {"a-0"})
+    monkeypatch.setattr(menu, "select_agent", lambda: agent)
+    monkeypatch.setattr(xam, "SESSION_DELETE_RATE_LIMIT", 0)
+    answers = iter(["1,6"])
+    monkeypatch.setattr("builtins.input", lambda prompt: next(answers))
+
+    menu.delete_sessions()
+
+    output = capsys.readouterr().out
+    assert "a-0" not in output  # Заранее созданный сеанс не предлагается к удалению
+    assert "6. ID: a-6" in output  # Сеанс с третьей страницы списка
+    assert remaining(agent) == ["a-0", "a-2", "a-3", "a-4", "a-5"]
+    assert agent.pages == [1, 2, 3]
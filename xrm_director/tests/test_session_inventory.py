@@ -0,0 +1,100 @@
+"""Тесты фонового подсчета сеансов агентов для меню (SessionInventory)"""
+
+import threading
+import types
+
+import pytest
+
+import xrmd_agent_manager as xam
+
+
+class FakeAgent:
+    """Агент с заданным числом сеансов; barrier задерживает ответ до запросов других агентов"""
+
+    def __init__(self, agent_id, sessions, barrier=None, error=None):
+        self.id = agent_id
+        self.title = f"agent {agent_id}"
+        self.sessions = [types.SimpleNamespace(id=f"{agent_id}-{i}") for i in range(sessions)]
+        self.barrier = barrier
+        self.error = error
+        self.pages = []
+
+    def list_sessions(self, page=1, page_size=30):
+        self.pages.append(page)
+        if self.barrier is not None and page == 1:
+            self.barrier.wait()
+        if self.error is not None:
+            raise self.error
+        return self.sessions[(page - 1) * page_size:page * page_size]
+
+
+class FakeDirectory:
+    def __init__(self, agents):
+        self.agents = {agent.id: agent for agent in agents}
+        self.list_calls = 0
+        self.error = None
+
+    def list(self):
+        self.list_calls += 1
+        if self.error is not None:
+            raise self.error
+        return [{"id": agent_id} for agent_id in self.agents]
+
+    def get_agent(self, entry):
+        return self.agents[entry["id"]]
+
+
+@pytest.fixture(autouse=True)
+def small_pages(monkeypatch):
+    monkeypatch.setattr(xam, "SESSION_COUNT_PAGE_SIZE", 2)
+
+
+def test_counts_all_pages_and_skips_empty_agents():
+    agents = [FakeAgent("a", 5), FakeAgent("b", 0), FakeAgent("c", 2), FakeAgent("d", 1, error=ConnectionError("reset"))]
+    inventory = xam.SessionInventory(FakeDirectory(agents), workers=2)
+
+    inventory.refresh()
+
+    assert inventory.counts == [("agent a", "a", 5), ("agent c", "c", 2)]
+    assert agents[0].pages == [1, 2, 3]
+    assert agents[2].pages == [1, 2]  # Полная последняя страница - нужен еще один запрос
+    assert inventory.error is None
+
+
+def test_agents_are_counted_in_parallel():
+    barrier = threading.Barrier(3, timeout=5)  # Последовательный подсчет не дождался бы остальных
+    agents = [FakeAgent(agent_id, 1, barrier=barrier) for agent_id in "abc"]
+    inventory = xam.SessionInventory(FakeDirectory(agents), workers=3)
+
+    inventory.refresh()
+
+    assert [count for _, _, count in inventory.counts] == [1, 1, 1]
+
+
+def test_snapshot_refreshes_in_background_after_ttl():
+    directory = FakeDirectory([FakeAgent("a", 1)])
+    inventory = xam.SessionInventory(directory, ttl=3600, workers=1)
+
+    assert inventory.snapshot()[0] is None  # Первое обращение не ждет сервер
+    inventory._refresh_thread.join(5)
+    counts, fetched_at, error = inventory.snapshot()
+    assert counts == [("agent a", "a", 1)] and error is None
+    assert directory.list_calls == 1  # Результат моложе ttl - без повторного запроса
+
+    directory.agents["a"].sessions.append(types.SimpleNamespace(id="new"))
+    inventory.invalidate()
+    inventory._refresh_thread.join(5)
+    assert inventory.snapshot()[0] == [("agent a", "a", 2)]
+    assert directory.list_calls == 2
+
+
+def test_error_is_reported_and_retried_after_ttl():
+    directory = FakeDirectory([])
+    directory.error = ConnectionError("Connection refused")
+    inventory = xam.SessionInventory(directory, ttl=3600, workers=1)
+
+    inventory.refresh()
+
+    counts, _, error = inventory.snapshot()
+    assert counts is None and "Connection refused" in error
+    assert inventory._refresh_thread is None  # Повтор - не раньше чем через ttl
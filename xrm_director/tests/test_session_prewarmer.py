@@ -0,0 +1,181 @@
+"""Тесты SessionPrewarmer: невыданные сеансы не должны оставаться на сервере"""
+
+import os
+import signal
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+import xrmd_agent_manager as xam
+
+
+class FakeSession:
+    def __init__(self, session_id):
+        self.id = session_id
+
+
+class FakeAgent:
+    """Агент, сеансы которого хранятся в памяти"""
+
+    def __init__(self, agent_id, gate=None):
+        self.id = agent_id
+        self.title = agent_id
+        self.sessions = {}
+        self.deleted = []
+        self.gate = gate
+        self.creating = threading.Event()
+        self._lock = threading.Lock()
+
+    def create_session(self):
+        self.creating.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        with self._lock:
+            session = FakeSession(f"{self.id}-{len(self.sessions) + len(self.deleted) + 1}")
+            self.sessions[session.id] = session
+        return session
+
+    def list_sessions(self, page=1, page_size=30, **kwargs):
+        with self._lock:
+            sessions = sorted(self.sessions.values(), key=lambda session: session.id, reverse=True)
+        return sessions[(page - 1) * page_size:page * page_size]
+
+    def delete_sessions(self, ids=None):
+        assert ids, "delete_sessions(ids=None) удалил бы все сеансы агента"
+        with self._lock:
+            for session_id in ids:
+                self.sessions.pop(session_id, None)
+                self.deleted.append(session_id)
+
+
+class FakeDirectory:
+    def __init__(self, agents):
+        self.agents = {agent.id: agent for agent in agents}
+
+    def get_agent(self, entry):
+        return self.agents[entry["id"]]
+
+    def most_used(self, limit):
+        return [{"id": agent_id} for agent_id in list(self.agents)[:limit]]
+
+    def record_use(self, agent_id):
+        pass
+
+
+def wait_for_fill(prewarmer):
+    thread = prewarmer._fill_thread
+    if thread is not None:
+        thread.join(5)
+
+
+def test_close_deletes_unused_sessions():
+    agent = FakeAgent("a")
+    prewarmer = xam.SessionPrewarmer(FakeDirectory([agent]), size=2, agents_limit=1)
+    prewarmer.fill_async()
+    wait_for_fill(prewarmer)
+    taken = prewarmer.take(agent)
+    wait_for_fill(prewarmer)
+
+    prewarmer.close()
+
+    assert list(agent.sessions) == [taken.id]
+
+
+def test_session_created_after_close_timeout_is_deleted():
+    gate = threading.Event()
+    agent = FakeAgent("a", gate=gate)
+    prewarmer = xam.SessionPrewarmer(FakeDirectory([agent]), size=1, agents_limit=1)
+    prewarmer.fill_async()
+    thread = prewarmer._fill_thread
+    assert agent.creating.wait(5)
+
+    prewarmer.close(timeout=0.01)  # Поток еще ждет сервер
+    gate.set()
+    thread.join(5)
+
+    assert agent.sessions == {}
+    assert len(agent.deleted) == 1
+
+
+def test_bulk_cleanup_keeps_pooled_sessions():
+    agent = FakeAgent("a")
+    agent.create_session()  # Сеанс пользователя
+    prewarmer = xam.SessionPrewarmer(FakeDirectory([agent]), size=1, agents_limit=1)
+    prewarmer.fill_async()
+    wait_for_fill(prewarmer)
+    pooled = prewarmer.session_ids()
+
+    report = xam.SessionCleaner(FakeDirectory([agent]), rate_limit=0).run([agent], keep_ids=pooled)
+
+    assert report["deleted"] == 1
+    assert set(agent.sessions) == pooled
+    prewarmer.close()
+    assert agent.sessions == {}
+
+
+
+def test_pooled_sessions_are_not_offered_for_selection(monkeypatch, capsys):
+    agent = FakeAgent("a")
+    own = agent.create_session()  # Сеанс, в котором пользователь уже общался
+    directory = FakeDirectory([agent])
+    prewarmer = xam.SessionPrewarmer(directory, size=2, agents_limit=1)
+    prewarmer.fill_async()
+    wait_for_fill(prewarmer)
+    menu = xam.RAGFlowMenu.__new__(xam.RAGFlowMenu)
+    menu.session_prewarmer = prewarmer
+    menu.messenger = types.SimpleNamespace(directory=directory)
+    answers = iter(["1"])
+    monkeypatch.setattr("builtins.input", lambda prompt: next(answers))
+
+    assert menu.select_session(agent) is own
+
+    output = capsys.readouterr().out
+    assert all(session_id not in output for session_id in prewarmer.session_ids())
+    prewarmer.close()
+    assert list(agent.sessions) == [own.id]
+
+
+posix_only = pytest.mark.skipif(sys.platform == "win32", reason="в Windows os.kill завершает процесс, SIGHUP нет")
+
+
+@pytest.fixture
+def termination_handlers():
+    """Восстановление обработчиков сигналов после теста"""
+    saved = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, getattr(signal, "SIGHUP", None)) if signum}
+    for signum in saved:
+        signal.signal(signum, signal.SIG_DFL)
+    yield
+    for signum, handler in saved.items():
+        signal.signal(signum, handler)
+
+
+@posix_only
+@pytest.mark.parametrize("signum", [getattr(signal, name, None) for name in ("SIGTERM", "SIGHUP")])
+def test_termination_signal_exits_through_atexit(termination_handlers, signum):
+    agent = FakeAgent("a")
+    prewarmer = xam.SessionPrewarmer(FakeDirectory([agent]), size=1, agents_limit=1)
+    prewarmer.fill_async()
+    wait_for_fill(prewarmer)
+
+    # Вместо немедленного завершения - SystemExit, после которого выполняется atexit (close)
+    with pytest.raises(SystemExit) as exit_info:
+        os.kill(os.getpid(), signum)
+        time.sleep(5)
+    assert exit_info.value.code == 128 + signum
+    prewarmer.close()
+    assert agent.sessions == {}
+
+
+@posix_only
+def test_custom_signal_handler_is_kept(termination_handlers):
+    def handler(signum, frame):
+        pass
+
+    signal.signal(signal.SIGTERM, handler)
+    xam.SessionPrewarmer(FakeDirectory([FakeAgent("a")]), size=1, agents_limit=1).fill_async()
+
+    assert signal.getsignal(signal.SIGTERM) is handler
+    assert signal.getsignal(signal.SIGHUP) is xam._exit_on_signal
@@ -0,0 +1,68 @@
+"""Тесты проверки вердикта агента по схеме промпта (VerdictSchema)"""
+
+import pytest
+
+import xrmd_agent_manager as xam
+
+FIELDS = {
+    "verdict_class": {"type": "string", "required": True, "enum": ["ERROR", "INFO"]},
+    "verdict_confidence": {"type": "number", "min": 0, "max": 1},
+    "verdict_match": {"type": "string"},
+}
+
+
+@pytest.fixture
+def schema():
+    return xam.VerdictSchema(FIELDS)
+
+
+def test_valid_verdict_is_normalized(schema):
+    record = schema.validate({"class": " error ", "score": "0.25", "kb_entry": "disk full"})
+    assert record.valid and record.errors == ()
+    assert (record.verdict_class, record.verdict_confidence, record.verdict_match) == ("ERROR", 0.25, "disk full")
+
+
+def test_optional_fields_may_be_missing(schema):
+    record = schema.validate({"classification": "INFO"})
+    assert record.valid
+    assert record.verdict_confidence is None
+
+
+@pytest.mark.parametrize("data, error", [
+    ({}, "нет поля classification"),
+    ({"classification": "WARN"}, "classification: недопустимое значение 'WARN'"),
+    ({"classification": ["ERROR"]}, "classification: ожидается строка"),
+    ({"classification": "INFO", "confidence": 1.5}, "confidence: значение 1.5 вне допустимого диапазона"),
+    ({"classification": "INFO", "confidence": "high"}, "confidence: ожидается число"),
+    ({"classification": "INFO", "confidence": True}, "confidence: ожидается число"),
+])
+def test_invalid_verdicts(schema, data, error):
+    record = schema.validate(data)
+    assert not record.valid
+    assert record.errors == (error,)
+
+
+def test_missing_json_is_invalid(schema):
+    assert schema.validate(None).errors == ("JSON не найден",)
+
+
+def test_all_errors_are_reported(schema):
+    record = schema.validate({"confidence": -1})
+    assert len(record.errors) == 2
+
+
+def test_unknown_field_is_rejected():
+    with pytest.raises(ValueError):
+        xam.VerdictSchema({"severity": {"type": "string"}})
+
+
+def test_schema_for_prompt():
+    assert xam.VerdictSchema.for_prompt("log_prompt_1") is xam.VerdictSchema.for_prompt("log_prompt_1")
+    assert xam.VerdictSchema.for_prompt("no_such_prompt") is None
+
+
+def test_store_records_validity(sqlite_store, schema):
+    row = sqlite_store.prepare_log_analysis_row("analyzer", "line", '{"classification": "WARN"}', 0.1, None, None, schema)
+    assert not row.pop("verdict").valid
+    sqlite_store.save_log_analysis_batch([row])
+    assert sqlite_store.get_log_analysis(1)["verdict_valid"] == 0
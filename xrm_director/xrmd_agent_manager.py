@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from ragflow_sdk import RAGFlow
+# ragflow_sdk (вместе с requests и beartype занимает большую часть времени запуска), csv,
+# socketserver, subprocess и необязательные зависимости импортируются в тех функциях, где нужны:
+# --help, --list-agents из кэша и --send через демон не загружают SDK вовсе
 from typing import List, Optional
 import sys
 import os
@@ -10,23 +12,28 @@ import sqlite3
 import threading
 import queue
 import datetime
-import random
 import logging
 import json
 import re
+import socket
 import argparse
-from pathlib import Path
+import atexit
+import contextlib
+import hashlib
+import zlib
+import tempfile
 
-# Регистрация адаптеров для работы с datetime в SQLite3 (для совместимости с Python 3.12+)
+# Адаптеры для работы с datetime в SQLite3 (для совместимости с Python 3.12+)
 def adapt_datetime(val):
     return val.isoformat()
 
 def convert_datetime(val):
     return datetime.datetime.fromisoformat(val.decode())
 
-# Регистрация адаптеров
-sqlite3.register_adapter(datetime.datetime, adapt_datetime)
-sqlite3.register_converter("DATETIME", convert_datetime)
+def register_sqlite_adapters():
+    """Регистрация адаптеров (выполняется при открытии соединения с базой SQLite)"""
+    sqlite3.register_adapter(datetime.datetime, adapt_datetime)
+    sqlite3.register_converter("DATETIME", convert_datetime)
 
 # =====================================================================
 # ПОЛЬЗОВАТЕЛЬСКИЕ НАСТРОЙКИ
@@ -52,6 +59,64 @@ LOG_DB_PATH = os.path.join(SCRIPT_DIR, "log_results.db")       # Путь к б
 LOG_BATCH_SIZE = 10                 # Количество логов для обработки за один вызов
 LOG_PROCESSING_DELAY = 0.5          # Задержка между обработкой логов (в секундах)
 
+# Кэш списка агентов для CLI-команд
+AGENT_CACHE_PATH = os.path.join(SCRIPT_DIR, "agents_cache.json")  # Файл локального индекса агентов
+AGENT_CACHE_TTL = 300               # Время жизни кэша агентов (в секундах)
+AGENT_CACHE_MIN_REFRESH = 10        # Обновлять кэш при ненайденном агенте не чаще (в секундах)
+AGENT_LIST_PAGE_SIZE = 100          # Размер страницы при загрузке полного списка агентов
+AGENT_DAEMON_SOCKET = os.path.join(SCRIPT_DIR, "xrmd_agent.sock")  # Unix-сокет демона (--daemon)
+SEND_FILE_CONCURRENCY = 4           # Одновременно отправляемых сообщений в режиме --send-file
+RAGFLOW_POOL_SIZE = 8               # Соединений keep-alive с RAGFlow (пул растет до числа рабочих потоков)
+RAGFLOW_CONNECT_TIMEOUT = 5.0       # Таймаут установки соединения с RAGFlow (в секундах)
+RAGFLOW_READ_TIMEOUT = 300.0        # Таймаут ожидания данных от RAGFlow (ответ агента генерируется долго)
+SESSION_VALIDITY_TTL = 60           # Сеанс, ответивший недавно (в секундах), при ошибке не перепроверяется
+SESSION_INVENTORY_TTL = 30          # Как долго показывать в меню число сеансов без обновления (в секундах)
+SESSION_INVENTORY_WORKERS = 8       # Потоков для параллельного подсчета сеансов агентов
+SESSION_COUNT_PAGE_SIZE = 100       # Размер страницы при подсчете сеансов агента
+SESSION_CLEANUP_WORKERS = 4         # Потоков массового удаления сеансов
+SESSION_DELETE_BATCH_SIZE = 100     # Количество сеансов, удаляемых одним запросом
+SESSION_DELETE_RATE_LIMIT = 20      # Не более запросов в секунду при массовом удалении (0 = без ограничения)
+SESSION_PREWARM_AGENTS = 3          # Для скольких самых используемых агентов заранее создавать сеансы
+SESSION_PREWARM_SIZE = 1            # Заранее созданных сеансов на агента (0 = не создавать)
+CHAT_TRANSCRIPTS_ENABLED = True     # Сохранять историю чатов с агентами в базе LOG_DB_PATH
+CHAT_HISTORY_PAGE_SIZE = 20         # Записей истории чатов на страницу при просмотре
+STARTUP_BENCHMARK_LOG = os.path.join(SCRIPT_DIR, "startup_benchmark.jsonl")  # История замеров --benchmark-startup
+
+# Настройки базы данных результатов (SQLite)
+LOG_DB_JOURNAL_MODE = "WAL"         # Режим журнала: WAL позволяет читать во время записи
+LOG_DB_SYNCHRONOUS = "NORMAL"       # Режим синхронизации (NORMAL достаточно надежен для WAL)
+LOG_DB_CACHE_SIZE_KB = 16384        # Размер кэша страниц на соединение (в КБ)
+LOG_DB_BUSY_TIMEOUT = 10.0          # Ожидание снятия блокировки другим соединением (в секундах)
+LOG_DB_STATEMENT_CACHE = 128        # Количество подготовленных запросов в кэше соединения
+LOG_DB_COMPRESSION_LEVEL = 6        # Уровень сжатия zlib для ответов агента (1-9)
+LOG_WRITER_BATCH_SIZE = 100         # Количество результатов, записываемых одной транзакцией
+LOG_WRITER_FLUSH_INTERVAL_MS = 200  # Максимальная задержка записи накопленных результатов (в мс)
+LOG_WRITER_MAX_PENDING = 10000      # Предел очереди на запись (при заполнении обработка ждет)
+LOG_STATS_FLUSH_INTERVAL = 5.0      # Интервал записи накопленных счетчиков статистики (в секундах)
+
+# Политика хранения результатов анализа (0 = без ограничения)
+LOG_RETENTION_DAYS = 0              # Удалять результаты старше указанного числа дней
+LOG_RETENTION_MAX_RUNS = 0          # Хранить только указанное число последних сессий обработки
+LOG_RETENTION_MAX_SIZE_MB = 0       # Удалять самые старые результаты, пока данные больше размера (МБ)
+LOG_PURGE_BATCH_SIZE = 1000         # Строк, удаляемых одной транзакцией (короткие блокировки записи)
+LOG_MAINTENANCE_INTERVAL = 300      # Интервал фонового обслуживания базы данных (в секундах)
+LOG_VACUUM_STEP_PAGES = 500         # Страниц, возвращаемых ОС за один шаг инкрементальной очистки
+LOG_EXPORT_CHUNK_SIZE = 5000        # Строк, читаемых из БД за один запрос при экспорте
+
+# Хранилище результатов анализа: "sqlite" - локальный файл LOG_DB_PATH,
+# "mysql" - сервер MySQL (например, из стека RAGFlow) для нескольких анализаторов
+LOG_DB_BACKEND = "sqlite"
+LOG_DB_MYSQL = {
+    "name": "xrm_director",         # База данных (создается при первом подключении)
+    "user": "root",
+    "password": "infini_rag_flow",
+    "host": "127.0.0.1",
+    "port": 5455,                   # MYSQL_PORT из docker/.env (проброшенный порт контейнера)
+    "max_connections": 10,          # Предел одновременно открытых соединений пула
+    "stale_timeout": 30,            # Простой соединения (в секундах), после которого оно проверяется
+    "connect_timeout": 10,
+}
+
 # Предустановленные промпты
 PREDEFINED_PROMPTS = {
     "log_prompt_1": "You are a log analyzer. Strictly compare the incoming log line for similarity with two knowledge bases: {{kb_uds_error}} - error examples (ERROR) and {{kb_uds_info}} - normal operation logs (INFO). Log line for analysis: '{}'. Respond ONLY with the required JSON.",
@@ -59,6 +124,19 @@ PREDEFINED_PROMPTS = {
     "log_analyzer": "'{}'",
 }
 
+# Схемы вердиктов, которые агент должен вернуть в ответ на промпт (ключ - имя промпта).
+# Поля: verdict_class, verdict_confidence, verdict_match (ключи ответа - ResultStore.VERDICT_FIELDS);
+# параметры поля: type ("string" или "number"), required, enum, min, max
+VERDICT_SCHEMAS = {
+    "log_prompt_1": {
+        "verdict_class": {"type": "string", "required": True, "enum": ["ERROR", "INFO"]},
+        "verdict_confidence": {"type": "number", "min": 0, "max": 1},
+        "verdict_match": {"type": "string"},
+    },
+}
+VERDICT_REQUEUE_INVALID = False     # Повторно запрашивать агента, если ответ не соответствует схеме
+VERDICT_REQUEUE_ATTEMPTS = 1        # Число повторных запросов для одной строки лога
+
 # Настройки внешнего вида
 MENU_SEPARATOR = "-" * 50
 EXIT_COMMANDS = ['exit', 'quit', 'выход']
@@ -119,27 +197,18 @@ CONFIG = {
 # CLI ФУНКЦИИ ДЛЯ РАБОТЫ ИЗ КОМАНДНОЙ СТРОКИ
 # =====================================================================
 
-def cli_list_agents():
+def cli_list_agents(directory=None):
     """CLI функция для отображения списка агентов"""
     try:
-        rag_object = RAGFlow(api_key=CONFIG['API_KEY'], base_url=CONFIG['BASE_URL'])
-        agents = rag_object.list_agents(
-            page=CONFIG['DEFAULT_PAGE'],
-            page_size=CONFIG['DEFAULT_PAGE_SIZE'],
-            orderby=CONFIG['DEFAULT_ORDER_BY'],
-            desc=CONFIG['DEFAULT_DESC']
-        )
+        directory = directory or AgentDirectory()
+        agents = directory.list()
         
         if not agents:
             print("Нет доступных агентов")
             return False
             
-        print("Доступные агенты:")
-        print(CONFIG['MENU_SEPARATOR'])
-        for idx, agent in enumerate(agents, 1):
-            print(f"{idx}. ID: {agent.id}")
-            print(f"   Название: {agent.title}")
-            print(CONFIG['MENU_SEPARATOR'])
+        for line in agent_list_lines(agents):
+            print(line)
         return True
     except Exception as e:
         print(f"Ошибка при получении списка агентов: {str(e)}")
@@ -148,30 +217,19 @@ def cli_list_agents():
 def cli_create_session(agent_id=None, agent_title=None):
     """CLI функция для создания сеанса с агентом"""
     try:
-        rag_object = RAGFlow(api_key=CONFIG['API_KEY'], base_url=CONFIG['BASE_URL'])
-        
-        # Получаем список агентов
-        agents = rag_object.list_agents(
-            page=CONFIG['DEFAULT_PAGE'],
-            page_size=CONFIG['DEFAULT_PAGE_SIZE'],
-            orderby=CONFIG['DEFAULT_ORDER_BY'],
-            desc=CONFIG['DEFAULT_DESC']
-        )
+        directory = AgentDirectory()
         
-        if not agents:
+        # Поиск агента по ID или названию в локальном индексе
+        target_agent = None
+        if agent_id or agent_title:
+            target_agent = directory.find(agent_id, agent_title)
+        elif not directory.list():
             print("Нет доступных агентов")
             return None, None
-            
-        # Поиск агента по ID или названию
-        target_agent = None
-        if agent_id:
-            target_agent = next((agent for agent in agents if agent.id == agent_id), None)
-        elif agent_title:
-            target_agent = next((agent for agent in agents if agent_title.lower() in agent.title.lower()), None)
         
         if not target_agent:
             print("Агент не найден. Доступные агенты:")
-            cli_list_agents()
+            cli_list_agents(directory=directory)
             return None, None
             
         # Создание сеанса
@@ -186,122 +244,592 @@ def cli_create_session(agent_id=None, agent_title=None):
         print(f"Ошибка при создании сеанса: {str(e)}")
         return None, None
 
-def cli_send_message(message, agent_id=None, agent_title=None, session_id=None, create_new_session=False):
-    """CLI функция для отправки сообщения агенту"""
+def agent_list_lines(agents):
+    """Строки списка агентов для вывода"""
+    lines = ["Доступные агенты:", CONFIG['MENU_SEPARATOR']]
+    for idx, agent in enumerate(agents, 1):
+        lines.append(f"{idx}. ID: {agent['id']}")
+        lines.append(f"   Название: {agent['title']}")
+        lines.append(CONFIG['MENU_SEPARATOR'])
+    return lines
+
+def print_message_event(event, data):
+    """Вывод события отправки сообщения (AgentMessenger) в консоль"""
+    if event == "chunk":
+        print(data, end='', flush=True)
+    elif event == "references":
+        # Вывод источников информации
+        print("\n\nИсточники информации:")
+        for idx, ref in enumerate(data, 1):
+            print(f"\n{idx}. {ref['document_name']}")
+            if ref['content']:
+                print(f"   {ref['content'][:100]}...")
+            if ref['similarity'] is not None:
+                print(f"   Релевантность: {ref['similarity']:.2f}")
+    else:
+        print(data)
+
+def daemon_request(request, on_event, socket_path=None):
+    """Запрос к демону агентов; None, если демон не запущен"""
+    socket_path = socket_path or AGENT_DAEMON_SOCKET
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
     try:
-        rag_object = RAGFlow(api_key=CONFIG['API_KEY'], base_url=CONFIG['BASE_URL'])
-        
-        # Получаем список агентов
-        agents = rag_object.list_agents(
-            page=CONFIG['DEFAULT_PAGE'],
-            page_size=CONFIG['DEFAULT_PAGE_SIZE'],
-            orderby=CONFIG['DEFAULT_ORDER_BY'],
-            desc=CONFIG['DEFAULT_DESC']
-        )
-        
-        if not agents:
-            print("Нет доступных агентов")
-            return False
-            
-        # Поиск агента
-        target_agent = None
-        if agent_id:
-            target_agent = next((agent for agent in agents if agent.id == agent_id), None)
-        elif agent_title:
-            target_agent = next((agent for agent in agents if agent_title.lower() in agent.title.lower()), None)
+        client.connect(socket_path)
+    except OSError:
+        client.close()
+        return None
+
+    with client, client.makefile("rb") as reader:
+        client.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+        for line in reader:
+            message = json.loads(line.decode("utf-8"))
+            if message["event"] == "result":
+                return bool(message["data"])
+            on_event(message["event"], message["data"])
+    # Демон закрыл соединение, не завершив ответ
+    return False
+
+def cli_send_message(message, agent_id=None, agent_title=None, session_id=None, create_new_session=False,
+                     use_daemon=True):
+    """CLI функция для отправки сообщения агенту (через демон, если он запущен)"""
+    if use_daemon:
+        request = {
+            "command": "send",
+            "message": message,
+            "agent_id": agent_id,
+            "agent_title": agent_title,
+            "session_id": session_id,
+            "new_session": create_new_session,
+            "stream": CONFIG['ENABLE_STREAMING'],
+            "show_references": CONFIG['SHOW_REFERENCES'],
+        }
+        try:
+            result = daemon_request(request, print_message_event)
+        except OSError as e:
+            logging.warning(f"Демон агентов недоступен, сообщение отправляется напрямую: {e}")
+            result = None
+        if result is not None:
+            return result
+    return AgentMessenger().send(message, agent_id, agent_title, session_id, create_new_session)
+
+def iter_send_file_messages(stream, agent_id=None, agent_title=None):
+    """Сообщения из файла: по одному на строку, текстом или объектом JSON {"message": ...}"""
+    for line in stream:
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            continue
+        item = None
+        if line.lstrip().startswith("{"):
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                item = None  # Обычный текст, начинающийся с фигурной скобки
+        if not isinstance(item, dict) or "message" not in item:
+            item = {"message": line}
+        item.setdefault("agent_id", agent_id)
+        item.setdefault("agent_title", agent_title)
+        yield item
+
+def cli_send_file(path, agent_id=None, agent_title=None, concurrency=None):
+    """CLI функция для пакетной отправки сообщений из файла ('-' - stdin) с выводом JSONL"""
+    concurrency = max(1, concurrency or SEND_FILE_CONCURRENCY)
+    client = get_ragflow_client(pool_size=concurrency)  # Соединение на каждый рабочий поток
+    messenger = AgentMessenger(AgentDirectory(client))
+    # Ограниченная очередь: файл читается по мере отправки, а не целиком в память
+    tasks = queue.Queue(maxsize=concurrency * 2)
+    output_lock = threading.Lock()
+    totals = {"ok": 0, "failed": 0}
+    stop = threading.Event()  # Вывод закрыт (например, "| head") - отправка прекращается
+
+    def write_result(result):
+        with output_lock:
+            totals["ok" if result["ok"] else "failed"] += 1
+            if stop.is_set():
+                return
+            try:
+                sys.stdout.write(json.dumps(result, ensure_ascii=False) + "\n")
+                sys.stdout.flush()
+            except BrokenPipeError:
+                stop.set()
+                logging.warning("Вывод результатов закрыт, отправка сообщений из файла прекращена")
+                # При завершении Python снова сбросит буфер stdout - направляем его в /dev/null
+                try:
+                    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+                except (OSError, ValueError):
+                    pass
+
+    def put_task(task):
+        """Постановка задачи в очередь; False, если отправка прекращена"""
+        while not stop.is_set():
+            try:
+                tasks.put(task, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def worker():
+        sessions = {}  # ID агента -> собственный сеанс потока, переиспользуемый для всех сообщений
+        while not stop.is_set():
+            try:
+                task = tasks.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if task is None:
+                break
+            index, item = task
+            result = {"index": index, "ok": False}
+            if "id" in item:
+                result["id"] = item["id"]
+            started = time.perf_counter()
+            first_chunk = []
+            try:
+                agent = messenger.directory.find(item.get("agent_id"), item.get("agent_title"))
+                if not agent:
+                    raise LookupError("агент не найден")
+                result["agent_id"] = agent.id
+                def on_chunk(text):
+                    if not first_chunk:
+                        first_chunk.append(time.perf_counter() - started)
+
+                if item.get("session_id"):
+                    session = messenger.find_session(agent, item["session_id"])
+                    result["session_id"] = session.id
+                    answer, references = messenger.ask(session, item["message"], on_chunk)
+                else:
+                    session = sessions.get(agent.id)
+                    if session is None:
+                        session = sessions[agent.id] = messenger.remember_session(agent.create_session())
+                    session, answer, references = messenger.ask_with_recovery(agent, session, item["message"], on_chunk)
+                    sessions[agent.id] = session
+                    result["session_id"] = session.id
+                if answer is None:
+                    raise RuntimeError("ответ агента не получен")
+                result["ok"] = True
+                result["answer"] = answer
+                if references:
+                    result["references"] = references
+            except Exception as e:
+                result["error"] = str(e)
+            result["first_chunk_time"] = round(first_chunk[0], 4) if first_chunk else None
+            result["elapsed"] = round(time.perf_counter() - started, 4)
+            write_result(result)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, name=f"send-file-{idx}", daemon=True) for idx in range(concurrency)]
+    for thread in workers:
+        thread.start()
+
+    try:
+        stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    except OSError as e:
+        print(f"Не удалось открыть файл сообщений: {e}", file=sys.stderr)
+        stream = None
+    try:
+        if stream is not None:
+            for index, item in enumerate(iter_send_file_messages(stream, agent_id, agent_title)):
+                if not put_task((index, item)):
+                    break
+    finally:
+        for _ in workers:
+            put_task(None)
+        for thread in workers:
+            thread.join()
+        if stream is not None and stream is not sys.stdin:
+            stream.close()
+
+    elapsed = time.perf_counter() - started
+    total = totals["ok"] + totals["failed"]
+    print(
+        f"Отправлено сообщений: {total}, успешно: {totals['ok']}, ошибок: {totals['failed']}, "
+        f"время: {elapsed:.2f} сек. ({total / elapsed if elapsed else 0:.2f} сообщ./сек.)",
+        file=sys.stderr
+    )
+    print(format_pool_stats(client.http_pool.stats()), file=sys.stderr)
+    return stream is not None and totals["failed"] == 0 and not stop.is_set()
+
+def cli_cleanup_sessions(agent_id=None, agent_title=None, older_than_hours=None, analyzer_only=False, dry_run=False):
+    """CLI функция для массового удаления сеансов (всех агентов или одного) с фильтрами"""
+    try:
+        directory = AgentDirectory(get_ragflow_client(pool_size=SESSION_CLEANUP_WORKERS))
+        if agent_id or agent_title:
+            agent = directory.find(agent_id, agent_title)
+            if not agent:
+                print("Агент не найден")
+                return False
+            agents = [agent]
         else:
-            # Если не указан агент, берем первого доступного
-            target_agent = agents[0]
-            print(f"Агент не указан, используется первый доступный: '{target_agent.title}'")
-        
-        if not target_agent:
-            print("Агент не найден. Доступные агенты:")
-            cli_list_agents()
-            return False
-            
-        # Поиск или создание сеанса
-        target_session = None
-        
-        if session_id:
-            # Поиск конкретного сеанса
-            sessions = target_agent.list_sessions()
-            target_session = next((session for session in sessions if session.id == session_id), None)
-            if not target_session:
-                print(f"Сеанс с ID {session_id} не найден")
+            agents = [directory.get_agent(entry) for entry in directory.list()]
+
+        only_ids = None
+        if analyzer_only:
+            only_ids = create_result_store().get_agent_session_ids()
+            if only_ids is None:
+                print("Не удалось получить список сеансов анализатора логов")
                 return False
-        elif create_new_session:
-            # Создание нового сеанса
-            target_session = target_agent.create_session()
-            print(f"Создан новый сеанс с ID: {target_session.id}")
+
+        older_than = datetime.timedelta(hours=older_than_hours) if older_than_hours else None
+        report = SessionCleaner(directory).run(
+            agents, older_than=older_than, only_ids=only_ids, dry_run=dry_run, on_progress=print
+        )
+        print(format_cleanup_report(report, dry_run))
+        return not report["errors"]
+    except Exception as e:
+        print(f"Ошибка при удалении сеансов: {str(e)}")
+        return False
+
+def cli_run_daemon():
+    """CLI функция для запуска демона агентов"""
+    if not hasattr(socket, "AF_UNIX"):
+        print("Демон агентов требует поддержки Unix-сокетов (Linux, macOS)")
+        return False
+    try:
+        print(f"Демон агентов слушает {AGENT_DAEMON_SOCKET} (Ctrl+C для остановки)")
+        AgentDaemon().serve_forever()
+        return True
+    except KeyboardInterrupt:
+        return True
+    except Exception as e:
+        print(f"Ошибка демона агентов: {str(e)}")
+        return False
+
+def cli_stop_daemon():
+    """CLI функция для остановки демона агентов"""
+    result = daemon_request({"command": "stop"}, print_message_event)
+    if result is None:
+        print("Демон агентов не запущен")
+        return False
+    print("Демон агентов остановлен")
+    return result
+
+def print_log_search_results(results):
+    """Вывод результатов поиска по базе анализа логов"""
+    if not results:
+        print("Ничего не найдено")
+        return
+
+    print(f"Найдено результатов: {len(results)}")
+    print(CONFIG['MENU_SEPARATOR'])
+    for result in results:
+        header = f"#{result['id']} | {result['timestamp']} | {result['agent_name']}"
+        if result['run_id'] is not None:
+            header += f" | сессия #{result['run_id']}"
+        if result['verdict_class']:
+            header += f" | {result['verdict_class']}"
+        print(header)
+        print(f"   Лог: {result['log_text'][:200]}")
+        print(f"   Ответ: {(result['response'] or '')[:200]}")
+        print(CONFIG['MENU_SEPARATOR'])
+
+# Поля выгрузки результатов анализа и их типы для колоночных форматов
+LOG_EXPORT_FIELDS = [
+    ("id", "int64"),
+    ("run_id", "int64"),
+    ("timestamp", "string"),
+    ("agent_name", "string"),
+    ("log_text", "string"),
+    ("response", "string"),
+    ("json_answer", "string"),
+    ("verdict_class", "string"),
+    ("verdict_confidence", "float64"),
+    ("verdict_match", "string"),
+    ("verdict_valid", "int8"),
+    ("processing_time", "float64"),
+]
+
+LOG_EXPORT_FORMATS = ["jsonl", "csv", "parquet", "arrow"]
+
+def export_log_analysis(db, output_path, export_format=None, run_id=None, agent_name=None,
+                        since=None, until=None, chunk_size=None):
+    """Потоковая выгрузка результатов анализа в JSONL, CSV, Parquet или Arrow (output_path '-' - stdout)"""
+    if not export_format:
+        extension = os.path.splitext(output_path)[1].lstrip('.').lower()
+        export_format = extension if extension in LOG_EXPORT_FORMATS else "jsonl"
+    if export_format not in LOG_EXPORT_FORMATS:
+        raise ValueError(f"Неподдерживаемый формат выгрузки: {export_format}")
+
+    field_names = [name for name, _ in LOG_EXPORT_FIELDS]
+    chunks = db.iter_log_analysis_chunks(run_id, agent_name, since, until, chunk_size)
+    exported = 0
+
+    if export_format in ("jsonl", "csv"):
+        if output_path == "-":
+            # Поверх байтового stdout без преобразования "\n": csv сам завершает строки "\r\n",
+            # а текстовый stdout в Windows превратил бы их в "\r\r\n"
+            import io
+            sys.stdout.flush()
+            output = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", newline="")
         else:
-            # Поиск существующего сеанса или создание нового
-            sessions = target_agent.list_sessions()
-            if sessions:
-                target_session = sessions[0]  # Берем первый доступный сеанс
-                print(f"Используется существующий сеанс с ID: {target_session.id}")
+            output = open(output_path, "w", encoding="utf-8", newline="")
+        try:
+            if export_format == "csv":
+                import csv
+                writer = csv.DictWriter(output, fieldnames=field_names, extrasaction="ignore")
+                writer.writeheader()
+            for chunk in chunks:
+                for row in chunk:
+                    if export_format == "csv":
+                        writer.writerow(row)
+                    else:
+                        record = {name: row[name] for name in field_names}
+                        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                exported += len(chunk)
+        finally:
+            if output_path == "-":
+                output.flush()
+                output.detach()  # sys.stdout остается открытым
             else:
-                target_session = target_agent.create_session()
-                print(f"Создан новый сеанс с ID: {target_session.id}")
-        
-        # Отправка сообщения
-        print(f"\nОтправка сообщения агенту '{target_agent.title}':")
-        print(f"Сообщение: {message}")
+                output.close()
+        return exported
+
+    # Колоночные форматы: каждая порция записывается отдельной группой строк
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Для выгрузки в Parquet/Arrow установите пакет pyarrow: pip install pyarrow")
+
+    schema = pyarrow.schema([(name, getattr(pyarrow, type_name)()) for name, type_name in LOG_EXPORT_FIELDS])
+    sink = sys.stdout.buffer if output_path == "-" else output_path
+    if export_format == "parquet":
+        writer = pyarrow.parquet.ParquetWriter(sink, schema, compression="zstd")
+    else:
+        writer = pyarrow.ipc.new_file(sink, schema)
+    try:
+        for chunk in chunks:
+            columns = {name: [row[name] for row in chunk] for name in field_names}
+            writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+            exported += len(chunk)
+    finally:
+        writer.close()
+    return exported
+
+def cli_export_logs(output_path, export_format=None, run_id=None, agent_name=None, since=None, until=None):
+    """CLI функция для выгрузки результатов анализа логов"""
+    try:
+        db = create_result_store()
+        start_time = time.time()
+        exported = export_log_analysis(
+            db,
+            output_path,
+            export_format,
+            run_id=run_id,
+            agent_name=agent_name,
+            since=since,
+            until=until
+        )
+        db.close()
+        # При выгрузке в stdout сообщения идут в stderr, чтобы не смешиваться с данными
+        report = sys.stderr if output_path == "-" else sys.stdout
+        print(f"Выгружено результатов: {exported} за {time.time() - start_time:.1f} сек.", file=report)
+        return True
+    except Exception as e:
+        print(f"Ошибка при выгрузке результатов анализа: {str(e)}", file=sys.stderr)
+        return False
+
+def print_chat_sessions(sessions, offset=0):
+    """Вывод списка сеансов из истории чатов"""
+    print(CONFIG['MENU_SEPARATOR'])
+    for idx, session in enumerate(sessions, offset + 1):
+        print(f"{idx}. Сеанс {session['session_id']} | {session['agent_name'] or 'агент не известен'} | "
+              f"ходов: {session['turns']} | {session['last_activity']}")
+        if session['first_question']:
+            print(f"   {session['first_question'][:100]}")
+    print(CONFIG['MENU_SEPARATOR'])
+
+def print_chat_turns(turns, show_session=False):
+    """Вывод ходов истории чата (вопросы и ответы с временем и источниками)"""
+    for turn in turns:
+        if turn['role'] == 'user':
+            header = f"[ход {turn['turn']} | {turn['created_at']}"
+            if show_session:
+                header += f" | сеанс {turn['session_id']}"
+            print(f"\n{header}]")
+            print(f"{CONFIG['USER_PROMPT_PREFIX']}{turn['content']}")
+            continue
+        if show_session:
+            print(f"\n[ход {turn['turn']} | {turn['created_at']} | сеанс {turn['session_id']}]")
         print(f"\n{CONFIG['ASSISTANT_PREFIX']}")
-        
-        content = ""
-        response_received = False
-        references = []
-        
-        # Получение ответа от агента
-        for response in target_session.ask(message, stream=CONFIG['ENABLE_STREAMING']):
-            if response and hasattr(response, 'content'):
-                response_received = True
-                
-                # Обработка ограничения длины ответа
-                if CONFIG['MAX_RESPONSE_LENGTH'] > 0 and len(response.content) > CONFIG['MAX_RESPONSE_LENGTH']:
-                    if len(content) < CONFIG['MAX_RESPONSE_LENGTH']:
-                        new_content = response.content[len(content):CONFIG['MAX_RESPONSE_LENGTH']]
-                        print(new_content + "... [Ответ обрезан из-за ограничения длины]", end='', flush=True)
-                        content = response.content[:CONFIG['MAX_RESPONSE_LENGTH']]
-                else:
-                    new_content = response.content[len(content):]
-                    print(new_content, end='', flush=True)
-                    content = response.content
-                    
-                # Сохраняем ссылки на источники
-                if CONFIG['SHOW_REFERENCES'] and hasattr(response, 'reference') and response.reference:
-                    references = response.reference
-        
-        if not response_received:
-            print("Извините, произошла ошибка при обработке ответа.")
-            return False
-            
-        # Вывод источников информации
-        if CONFIG['SHOW_REFERENCES'] and references:
-            print("\n\nИсточники информации:")
-            for idx, ref in enumerate(references, 1):
-                if isinstance(ref, dict):
-                    doc_name = ref.get('document_name', f'Источник {idx}')
-                    ref_content = ref.get('content', '')
-                    similarity = ref.get('similarity', None)
-                else:
-                    doc_name = getattr(ref, 'document_name', f'Источник {idx}')
-                    ref_content = getattr(ref, 'content', '')
-                    similarity = getattr(ref, 'similarity', None)
-                
-                print(f"\n{idx}. {doc_name}")
-                if ref_content:
-                    print(f"   {ref_content[:100]}...")
-                if similarity is not None:
-                    print(f"   Релевантность: {similarity:.2f}")
-        
-        print()
+        print(turn['content'])
+        if turn['total_time'] is not None:
+            first_chunk = f"первый фрагмент {turn['first_chunk_time']:.2f} сек., " if turn['first_chunk_time'] is not None else ""
+            print(f"({first_chunk}ответ {turn['total_time']:.2f} сек.)")
+        if turn['references']:
+            print_message_event("references", turn['references'])
+
+def cli_chat_history(session_id=None, search=None, limit=50):
+    """CLI функция для просмотра сохраненной истории чатов (без обращения к серверу)"""
+    try:
+        store = Database(LOG_DB_PATH)
+        if search:
+            results = store.search_chat_turns(search, limit=limit)
+            if results:
+                print_chat_turns(results, show_session=True)
+            else:
+                print("Ничего не найдено")
+        elif session_id:
+            found = False
+            for page in store.iter_chat_turns(session_id):
+                found = True
+                print_chat_turns(page)
+            if not found:
+                print(f"История сеанса {session_id} не найдена")
+        else:
+            sessions = store.get_chat_sessions(limit=limit)
+            if sessions:
+                print_chat_sessions(sessions)
+            else:
+                print("История чатов пуста")
+        store.close()
+        return True
+    except Exception as e:
+        print(f"Ошибка при чтении истории чатов: {str(e)}")
+        return False
+
+def cli_search_logs(query, run_id=None, agent_name=None, since=None, until=None, limit=50):
+    """CLI функция для полнотекстового поиска по результатам анализа логов"""
+    try:
+        db = create_result_store()
+        start_time = time.time()
+        results = db.search_log_analysis(
+            query,
+            run_id=run_id,
+            agent_name=agent_name,
+            since=since,
+            until=until,
+            limit=limit
+        )
+        elapsed = time.time() - start_time
+        print_log_search_results(results)
+        print(f"Время поиска: {elapsed * 1000:.1f} мс")
+        db.close()
         return True
-        
     except Exception as e:
-        print(f"Ошибка при отправке сообщения: {str(e)}")
+        print(f"Ошибка при поиске по результатам анализа: {str(e)}")
         return False
 
+def _extract_json_regex(response_text):
+    """Прежний поиск JSON регулярными выражениями (оставлен для сравнения в benchmark_json_extraction)"""
+    for pattern in (r'\{[^{}]*(?:"[^"]*"\s*:\s*[^,}]+[,}])+[^{}]*\}', r'\{[^{}]*\}'):
+        for match in re.findall(pattern, response_text):
+            try:
+                return json.dumps(json.loads(match), ensure_ascii=False, separators=(',', ':'))
+            except json.JSONDecodeError:
+                continue
+    return None
+
+def benchmark_json_extraction(repeats=5):
+    """Сравнение сканера JSONObjectScanner с прежним поиском JSON регулярными выражениями"""
+    verdict = '{"classification": "ERROR", "confidence": 0.92, "details": {"source": "pg_hba.conf", "hosts": ["10.1.97.70"]}}'
+    prose = "Строка лога относится к ошибкам аутентификации PostgreSQL (см. раздел {Подключения}). "
+    cases = [
+        ("короткий ответ", prose + verdict),
+        ("вложенный JSON", "Результат:\n```json\n" + verdict + "\n```"),
+        ("длинный ответ 200 КБ", prose * 2000 + verdict),
+        ("много скобок без JSON", '{ "a": 1 ' * 1500),
+    ]
+    scanner_extract = ResultStore().extract_json_from_response
+
+    print(f"{'Случай':<24}{'regex, мс':>12}{'сканер, мс':>12}   длина JSON: regex / сканер")
+    print(CONFIG['MENU_SEPARATOR'])
+    for title, text in cases:
+        timings = []
+        results = []
+        for extract in (_extract_json_regex, scanner_extract):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                result = extract(text)
+            timings.append((time.perf_counter() - start) / repeats * 1000)
+            results.append(str(len(result)) if result else "нет")
+        print(f"{title:<24}{timings[0]:>12.2f}{timings[1]:>12.2f}   {results[0]} / {results[1]}")
+
+def _import_times(module_name):
+    """Время импорта (в мс) модулей, импортируемых модулем module_name напрямую (python -X importtime)"""
+    import subprocess
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+        cwd=SCRIPT_DIR, capture_output=True, text=True
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue  # Строка заголовка
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((level, name.strip(), int(cumulative) / 1000))
+
+    # Вложенные импорты выводятся перед импортирующим модулем: прямые импорты модуля -
+    # записи первого уровня между ним и предыдущей записью нулевого уровня
+    imports = []
+    for idx, (level, name, cumulative) in enumerate(entries):
+        if level == 0 and name == module_name:
+            for child_level, child_name, child_cumulative in reversed(entries[:idx]):
+                if child_level == 0:
+                    break
+                if child_level == 1:
+                    imports.append((child_name, child_cumulative))
+            return cumulative, sorted(imports, key=lambda item: item[1], reverse=True)
+    return None, []
+
+def benchmark_startup(repeats=5):
+    """Замер времени запуска коротких CLI-команд с сохранением истории в STARTUP_BENCHMARK_LOG"""
+    import subprocess
+    module_name = os.path.splitext(os.path.basename(__file__))[0]
+    commands = [
+        ("импорт модуля", [sys.executable, "-c", f"import {module_name}"]),
+        ("--help", [sys.executable, os.path.abspath(__file__), "--help"]),
+    ]
+    record = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+    }
+
+    print(f"{'Команда':<24}{'мин., мс':>12}{'медиана, мс':>14}")
+    print(CONFIG['MENU_SEPARATOR'])
+    for title, command in commands:
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run(command, cwd=SCRIPT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        record[title] = round(timings[len(timings) // 2], 1)
+        print(f"{title:<24}{timings[0]:>12.1f}{timings[len(timings) // 2]:>14.1f}")
+
+    import_total, imports = _import_times(module_name)
+    if import_total is not None:
+        record["importtime_ms"] = round(import_total, 1)
+        record["imports"] = {name: round(cumulative, 1) for name, cumulative in imports[:10]}
+        print(f"\npython -X importtime: {import_total:.1f} мс, самые медленные импорты модуля:")
+        for name, cumulative in imports[:10]:
+            print(f"  {name:<30}{cumulative:>10.1f} мс")
+
+    # Сравнение с предыдущим замером и сохранение истории
+    previous = None
+    try:
+        with open(STARTUP_BENCHMARK_LOG, "r", encoding="utf-8") as history:
+            for line in history:
+                if line.strip():
+                    previous = json.loads(line)
+    except (OSError, json.JSONDecodeError):
+        pass
+    if previous:
+        print(f"\nПредыдущий замер ({previous.get('time')}):")
+        for key in [title for title, _ in commands] + ["importtime_ms"]:
+            if key in previous and key in record:
+                print(f"  {key:<22}{previous[key]:>10.1f} -> {record[key]:.1f} мс")
+    try:
+        with open(STARTUP_BENCHMARK_LOG, "a", encoding="utf-8") as history:
+            history.write(json.dumps(record, ensure_ascii=False) + "\n")
+        print(f"\nРезультат добавлен в {STARTUP_BENCHMARK_LOG}")
+    except OSError as e:
+        print(f"Не удалось сохранить результат замера: {e}")
+
 def parse_arguments():
     """Парсинг аргументов командной строки"""
     parser = argparse.ArgumentParser(
@@ -330,16 +858,72 @@ python xrmd_agent_manager.py --send "Что такое Python?" --agent-id "agen
 
 # Отправить сообщение с принудительным созданием нового сеанса
 python xrmd_agent_manager.py --send "Новый вопрос" --agent-title "GPT" --new-session
+
+# Запустить демон агентов: последующие --send передаются ему без повторной инициализации
+python xrmd_agent_manager.py --daemon &
+python xrmd_agent_manager.py --stop-daemon
+
+# Отправить сообщения из файла (строка - сообщение или {"message": ..., "agent_title": ..., "id": ...})
+python xrmd_agent_manager.py --send-file messages.jsonl --agent-title "api_llm_agent" --concurrency 8 > answers.jsonl
+
+# История чатов: последние сеансы, ходы одного сеанса, поиск
+python xrmd_agent_manager.py --history
+python xrmd_agent_manager.py --history --session-id "session456"
+python xrmd_agent_manager.py --history-search "pg_hba.conf"
+
+# Удалить сеансы анализатора логов старше суток у всех агентов (--dry-run - только подсчитать)
+python xrmd_agent_manager.py --cleanup-sessions --analyzer-only --older-than 24
+
+# Найти результаты анализа логов по тексту (за период, у конкретного агента)
+python xrmd_agent_manager.py --search "pg_hba.conf" --agent-title "api_llm_agent" --since 2025-04-01
+
+# Выгрузить результаты сессии обработки (формат по расширению: jsonl, csv, parquet, arrow)
+python xrmd_agent_manager.py --export results.parquet --run-id 12
+python xrmd_agent_manager.py --export - --format jsonl --since 2025-04-01 | gzip > results.jsonl.gz
         """
     )
     
     # Основные команды
     parser.add_argument('--list-agents', action='store_true', 
                        help='Показать список всех доступных агентов')
+    parser.add_argument('--daemon', action='store_true',
+                       help='Запустить демон агентов: --send передает ему сообщения без повторной инициализации')
+    parser.add_argument('--stop-daemon', action='store_true',
+                       help='Остановить запущенный демон агентов')
+    parser.add_argument('--no-daemon', action='store_true',
+                       help='Отправлять сообщение напрямую, даже если демон запущен')
+    parser.add_argument('--refresh-agents', action='store_true',
+                       help='Обновить локальный кэш списка агентов перед выполнением команды')
     parser.add_argument('--create-session', action='store_true',
                        help='Создать новый сеанс с агентом')
     parser.add_argument('--send', type=str, metavar='MESSAGE',
                        help='Отправить сообщение агенту')
+    parser.add_argument('--send-file', type=str, metavar='PATH',
+                       help="Отправить сообщения из файла ('-' - stdin), по одному на строку или JSONL; результаты - JSONL в stdout")
+    parser.add_argument('--concurrency', type=int, default=SEND_FILE_CONCURRENCY, metavar='N',
+                       help=f'Одновременно отправляемых сообщений для --send-file (по умолчанию {SEND_FILE_CONCURRENCY})')
+    parser.add_argument('--cleanup-sessions', action='store_true',
+                       help='Удалить сеансы всех агентов (или агента из --agent-id/--agent-title) с учетом фильтров')
+    parser.add_argument('--older-than', type=float, metavar='HOURS',
+                       help='Для --cleanup-sessions: только сеансы, не изменявшиеся дольше HOURS часов')
+    parser.add_argument('--analyzer-only', action='store_true',
+                       help='Для --cleanup-sessions: только сеансы, созданные анализатором логов')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Для --cleanup-sessions: только подсчитать сеансы, не удаляя их')
+    parser.add_argument('--history', action='store_true',
+                       help='Показать сохраненную историю чатов (с --session-id - ходы одного сеанса)')
+    parser.add_argument('--history-search', type=str, metavar='TEXT',
+                       help='Поиск по сохраненной истории чатов')
+    parser.add_argument('--search', type=str, metavar='TEXT',
+                       help='Полнотекстовый поиск по результатам анализа логов')
+    parser.add_argument('--export', type=str, metavar='PATH',
+                       help="Выгрузить результаты анализа логов в файл ('-' - в stdout)")
+    parser.add_argument('--format', type=str, choices=LOG_EXPORT_FORMATS, dest='export_format',
+                       help='Формат выгрузки (по умолчанию определяется по расширению файла)')
+    parser.add_argument('--benchmark-json', action='store_true',
+                       help='Сравнить скорость извлечения JSON из ответов агента')
+    parser.add_argument('--benchmark-startup', action='store_true',
+                       help='Замерить время запуска коротких команд и сравнить с предыдущим замером')
     
     # Параметры для выбора агента
     parser.add_argument('--agent-id', type=str, metavar='ID',
@@ -359,75 +943,1171 @@ python xrmd_agent_manager.py --send "Новый вопрос" --agent-title "GPT
     parser.add_argument('--no-streaming', action='store_true',
                        help='Отключить потоковую передачу ответов')
     
+    # Фильтры результатов анализа логов (для --search и --export --agent-title задает точное название)
+    parser.add_argument('--run-id', type=int, metavar='ID',
+                       help='ID сессии обработки логов')
+    parser.add_argument('--since', type=datetime.datetime.fromisoformat, metavar='DATETIME',
+                       help='Начало периода (YYYY-MM-DD[ HH:MM:SS], локальное время)')
+    parser.add_argument('--until', type=datetime.datetime.fromisoformat, metavar='DATETIME',
+                       help='Конец периода (не включая)')
+    parser.add_argument('--limit', type=int, default=50, metavar='N',
+                       help='Максимальное количество результатов (по умолчанию 50)')
+    
     return parser.parse_args()
 
-class RAGFlowMenu:
-    def __init__(self):
-        """Инициализация меню и подключения к серверу"""
+class RAGFlowHTTPPool:
+    """Пул keep-alive соединений с сервером RAGFlow.
+
+    SDK выполняет каждый запрос через requests.get/post без общего соединения, то есть
+    с новым TCP-подключением. Клиент из get_ragflow_client() направляет запросы SDK сюда:
+    общая requests.Session с пулом размером не меньше числа рабочих потоков и таймаутами
+    RAGFLOW_CONNECT_TIMEOUT / RAGFLOW_READ_TIMEOUT.
+    """
+
+    def __init__(self, api_url, headers, pool_size=None):
+        """Создание сессии requests и пула соединений"""
+        import requests
+        self.api_url = api_url
+        self.timeout = (RAGFLOW_CONNECT_TIMEOUT, RAGFLOW_READ_TIMEOUT)
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        self.pool_size = 0
+        self._adapters = []
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._open_streams = 0
+        self.resize(pool_size or RAGFLOW_POOL_SIZE)
+
+    def resize(self, pool_size):
+        """Увеличение пула до pool_size соединений (уменьшение не выполняется)"""
+        from requests.adapters import HTTPAdapter
+        with self._lock:
+            if pool_size <= self.pool_size:
+                return
+            # pool_block=False: при нехватке соединений открывается дополнительное,
+            # а не блокируется поток; рост connections_opened в stats() это покажет
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+            self._adapters.append(adapter)
+            self.pool_size = pool_size
+
+    def request(self, method, path, stream=False, **kwargs):
+        """Запрос к API через пул соединений"""
+        with self._lock:
+            self._requests += 1
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
         try:
-            self.rag_object = RAGFlow(api_key=CONFIG['API_KEY'], base_url=CONFIG['BASE_URL'])
-            self.current_agent = None
-            self.current_session = None
-            self.log_processor = LogProcessor(self)  # Инициализация процессора логов
-            
-            # Проверяем соединение при инициализации
-            self._test_connection()
-            
-        except Exception as e:
-            print(f"Ошибка при инициализации: {e}")
-            print("Проверьте настройки API_KEY и BASE_URL")
-            self.rag_object = None
-            self.current_agent = None
-            self.current_session = None
-            self.log_processor = None
-    
-    def _test_connection(self):
-        """Тестирование подключения к серверу API"""
+            response = self.session.request(
+                method, self.api_url + path, stream=stream, timeout=self.timeout, **kwargs
+            )
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        if stream:
+            self._track_stream(response)
+        return response
+
+    def _track_stream(self, response):
+        """Возврат соединения потокового ответа в пул после чтения.
+
+        Session.ask прекращает чтение на событии message_end, не закрывая ответ, и без
+        этого соединение не возвращается в пул. Остаток ответа дочитывается, если чтение
+        остановлено вызывающим кодом, и соединение закрывается при ошибке.
+        """
+        iter_lines = response.iter_lines
+        with self._lock:
+            self._open_streams += 1
+
+        def tracked_iter_lines(*args, **kwargs):
+            drain = True
+            try:
+                yield from iter_lines(*args, **kwargs)
+            except GeneratorExit:
+                raise
+            except BaseException:
+                drain = False
+                raise
+            finally:
+                self._release_stream(response, drain)
+
+        response.iter_lines = tracked_iter_lines
+
+    def _release_stream(self, response, drain):
+        """Освобождение соединения потокового ответа"""
         try:
-            # Пытаемся получить список агентов для проверки соединения
-            test_agents = self.rag_object.list_agents(page=1, page_size=1)
-            print("✓ Подключение к серверу API успешно установлено")
-            return True
-        except Exception as e:
-            error_msg = str(e)
-            if "Expecting value" in error_msg:
-                print("✗ Ошибка: Сервер вернул некорректный JSON. Проверьте BASE_URL.")
-            elif "Connection" in error_msg or "timeout" in error_msg.lower():
-                print("✗ Ошибка: Не удается подключиться к серверу.")
-            elif "401" in error_msg or "Unauthorized" in error_msg:
-                print("✗ Ошибка: Неверный API_KEY.")
+            if drain:
+                response.raw.drain_conn()
+                response.raw.release_conn()
             else:
-                print(f"✗ Ошибка подключения: {error_msg}")
-            return False
+                response.close()
+        except Exception:
+            response.close()
+        with self._lock:
+            self._open_streams -= 1
 
-    def clear_screen(self):
-        """Очистка экрана"""
-        os.system('cls' if os.name == 'nt' else 'clear')
+    # Методы с сигнатурами RAGFlow.post/get/delete/put
+    def post(self, path, json=None, stream=False, files=None):
+        return self.request("POST", path, json=json, stream=stream, files=files)
 
-    def select_agent(self) -> Optional[object]:
-        """Выбор агента из списка"""
-        if not self.rag_object:
-            print("Ошибка: нет подключения к серверу API")
-            return None
-            
+    def get(self, path, params=None, json=None):
+        return self.request("GET", path, params=params, json=json)
+
+    def delete(self, path, json):
+        return self.request("DELETE", path, json=json)
+
+    def put(self, path, json):
+        return self.request("PUT", path, json=json)
+
+    def stats(self):
+        """Статистика пула: запросы, параллельность и открытые TCP-соединения"""
+        connections = 0
+        for adapter in self._adapters:
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    connections += pool.num_connections
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "requests": self._requests,
+                "errors": self._errors,
+                "in_flight": self._in_flight,
+                "peak_in_flight": self._peak_in_flight,
+                "open_streams": self._open_streams,
+                "connections_opened": connections,
+                "connections_reused": max(0, self._requests - connections),
+            }
+
+    def close(self):
+        """Закрытие всех соединений пула"""
+        self.session.close()
+
+_ragflow_clients = {}
+_ragflow_clients_lock = threading.Lock()
+
+def get_ragflow_client(pool_size=None):
+    """Общий клиент RAGFlow (один на адрес сервера и ключ API) с пулом соединений.
+
+    pool_size - число потоков, одновременно работающих с сервером: пул увеличивается до него.
+    Статистика пула доступна через client.http_pool.stats().
+    """
+    from ragflow_sdk import RAGFlow
+    key = (CONFIG['BASE_URL'], CONFIG['API_KEY'])
+    with _ragflow_clients_lock:
+        client = _ragflow_clients.get(key)
+        if client is None:
+            client = RAGFlow(api_key=CONFIG['API_KEY'], base_url=CONFIG['BASE_URL'])
+            pool = RAGFlowHTTPPool(client.api_url, client.authorization_header)
+            # Все запросы SDK (в том числе от Agent и Session) идут через методы клиента
+            client.http_pool = pool
+            client.post = pool.post
+            client.get = pool.get
+            client.delete = pool.delete
+            client.put = pool.put
+            _ragflow_clients[key] = client
+    if pool_size:
+        client.http_pool.resize(pool_size)
+    return client
+
+def format_pool_stats(stats):
+    """Строка статистики пула соединений для вывода"""
+    return (
+        f"Соединения с RAGFlow: запросов {stats['requests']} (ошибок {stats['errors']}), "
+        f"открыто TCP {stats['connections_opened']}, переиспользовано {stats['connections_reused']}, "
+        f"пик параллельных {stats['peak_in_flight']} при размере пула {stats['pool_size']}"
+    )
+
+class AgentDirectory:
+    """Локальный индекс агентов (id, title, update_time) с кэшем на диске.
+
+    Список загружается со всеми страницами и хранится в AGENT_CACHE_PATH в течение
+    AGENT_CACHE_TTL секунд, поэтому CLI-команды находят агента без запроса к серверу.
+    При промахе поиска кэш обновляется (не чаще AGENT_CACHE_MIN_REFRESH секунд).
+    """
+
+    def __init__(self, rag_object=None, cache_path=None, ttl=None):
+        """Инициализация индекса и чтение кэша с диска"""
+        self._rag_object = rag_object
+        self.cache_path = cache_path or AGENT_CACHE_PATH
+        self.ttl = AGENT_CACHE_TTL if ttl is None else ttl
+        self.entries = []
+        self.fetched_at = 0.0
+        self.usage = {}  # ID агента -> количество выборов агента в меню
+        self._unsaved_usage = {}  # Выборы этого процесса, еще не записанные в кэш
+        self._by_id = {}
+        self._by_title = {}
+        # Кэш сохраняют и фоновое обновление списка, и record_use из потока меню
+        self._lock = threading.RLock()
+        self._load()
+
+    @property
+    def rag_object(self):
+        """Клиент RAGFlow (создается при первом обращении к серверу)"""
+        if self._rag_object is None:
+            self._rag_object = get_ragflow_client()
+        return self._rag_object
+
+    def _index(self, entries, fetched_at):
+        """Построение словарей поиска по ID и названию"""
+        self.entries = entries
+        self.fetched_at = fetched_at
+        self._by_id = {entry["id"]: entry for entry in entries}
+        self._by_title = {}
+        for entry in entries:
+            # При совпадении названий остается самый свежий агент (список отсортирован по update_time)
+            self._by_title.setdefault((entry["title"] or "").lower(), entry)
+
+    def _read_cache(self):
+        """Содержимое кэша на диске (None, если его нет или он от другого сервера)"""
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as cache_file:
+                data = json.load(cache_file)
+            if data.get("base_url") == CONFIG['BASE_URL']:
+                return data
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"Кэш агентов {self.cache_path} не прочитан: {e}")
+        return None
+
+    def _load(self):
+        """Чтение кэша с диска (кэш другого сервера не используется)"""
+        data = self._read_cache()
+        if data is not None:
+            self._index(data.get("agents", []), data.get("fetched_at", 0.0))
+            self.usage = data.get("usage", {})
+
+    def _merge_usage(self):
+        """Счетчики выбора агентов с диска (их увеличивают и другие процессы) плюс свои несохраненные"""
+        data = self._read_cache()
+        if data is not None:
+            usage = dict(data.get("usage", {}))
+        else:
+            usage = {agent_id: count - self._unsaved_usage.get(agent_id, 0) for agent_id, count in self.usage.items()}
+        for agent_id, count in self._unsaved_usage.items():
+            usage[agent_id] = usage.get(agent_id, 0) + count
+        self.usage = usage
+
+    def _save(self):
+        """Запись кэша на диск через временный файл (без частично записанного кэша).
+
+        Имя временного файла уникально: кэш может одновременно сохранять другой процесс
+        (демон и CLI-команда). Счетчики выбора агентов, записанные другими процессами,
+        объединяются со своими, а не перезаписываются.
+        """
+        tmp_path = None
         try:
+            with self._lock:
+                self._merge_usage()
+                cache_dir = os.path.dirname(os.path.abspath(self.cache_path))
+                with tempfile.NamedTemporaryFile(
+                    "w", encoding="utf-8", dir=cache_dir, prefix=os.path.basename(self.cache_path) + ".",
+                    suffix=".tmp", delete=False
+                ) as cache_file:
+                    tmp_path = cache_file.name
+                    json.dump({
+                        "base_url": CONFIG['BASE_URL'],
+                        "fetched_at": self.fetched_at,
+                        "agents": self.entries,
+                        "usage": self.usage,
+                    }, cache_file, ensure_ascii=False)
+                os.replace(tmp_path, self.cache_path)
+                self._unsaved_usage = {}
+        except Exception as e:
+            logging.warning(f"Кэш агентов {self.cache_path} не сохранен: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def refresh(self):
+        """Загрузка полного списка агентов со всех страниц"""
+        entries = []
+        page = 1
+        while True:
             agents = self.rag_object.list_agents(
-                page=CONFIG['DEFAULT_PAGE'],
-                page_size=CONFIG['DEFAULT_PAGE_SIZE'],
+                page=page,
+                page_size=AGENT_LIST_PAGE_SIZE,
                 orderby=CONFIG['DEFAULT_ORDER_BY'],
                 desc=CONFIG['DEFAULT_DESC']
             )
-            if not agents:
-                print(f"\n{CONFIG['MESSAGES']['no_agents']}")
-                return None
+            entries.extend(
+                {"id": agent.id, "title": agent.title, "update_time": getattr(agent, "update_time", None)}
+                for agent in agents
+            )
+            if len(agents) < AGENT_LIST_PAGE_SIZE:
+                break
+            page += 1
+        with self._lock:
+            self._index(entries, time.time())
+            self._save()
+        return entries
 
-            print("\nДоступные агенты:")
-            print(CONFIG['MENU_SEPARATOR'])
-            for idx, agent in enumerate(agents, 1):
-                print(f"{idx}. ID: {agent.id}")
-                print(f"   Название: {agent.title}")
-                # Строка с временем создания удалена
-                print(CONFIG['MENU_SEPARATOR'])
+    def _ensure_fresh(self, force=False):
+        """Обновление устаревшего кэша; при недоступном сервере используется старый"""
+        if not force and self.entries and time.time() - self.fetched_at < self.ttl:
+            return
+        try:
+            self.refresh()
+        except Exception:
+            if not self.entries:
+                raise
+            logging.warning("Не удалось обновить список агентов, используется сохраненный кэш")
+
+    def list(self, refresh=False):
+        """Все агенты в порядке CONFIG['DEFAULT_ORDER_BY']"""
+        self._ensure_fresh(force=refresh)
+        return self.entries
+
+    def _lookup(self, agent_id=None, agent_title=None):
+        """Поиск в индексе: ID и точное название - по словарю, иначе по части названия"""
+        if agent_id:
+            return self._by_id.get(agent_id)
+        if agent_title:
+            title = agent_title.lower()
+            entry = self._by_title.get(title)
+            if entry is None:
+                entry = next((item for item in self.entries if title in (item["title"] or "").lower()), None)
+            return entry
+        return self.entries[0] if self.entries else None
+
+    def find(self, agent_id=None, agent_title=None):
+        """Агент по ID или названию (без ID и названия - первый в списке); None, если не найден"""
+        self._ensure_fresh()
+        entry = self._lookup(agent_id, agent_title)
+        if entry is None and time.time() - self.fetched_at >= AGENT_CACHE_MIN_REFRESH:
+            # Агент мог появиться после загрузки кэша
+            self._ensure_fresh(force=True)
+            entry = self._lookup(agent_id, agent_title)
+        return self.get_agent(entry) if entry else None
+
+    def title(self, agent_id):
+        """Название агента по ID из индекса (None, если агента нет в кэше)"""
+        entry = self._by_id.get(agent_id)
+        return entry["title"] if entry else None
+
+    def record_use(self, agent_id):
+        """Учет выбора агента (для SessionPrewarmer)"""
+        with self._lock:
+            self.usage[agent_id] = self.usage.get(agent_id, 0) + 1
+            self._unsaved_usage[agent_id] = self._unsaved_usage.get(agent_id, 0) + 1
+            self._save()
+
+    def most_used(self, limit):
+        """Самые часто выбираемые агенты (записи индекса)"""
+        used = [entry for entry in self.entries if self.usage.get(entry["id"])]
+        used.sort(key=lambda entry: self.usage[entry["id"]], reverse=True)
+        return used[:limit]
+
+    def get_agent(self, entry):
+        """Объект агента SDK по записи индекса (без запроса к серверу)"""
+        from ragflow_sdk import Agent
+        return Agent(self.rag_object, dict(entry))
+
+
+class SessionInventory:
+    """Количество сеансов по агентам для главного меню.
+
+    Сеансы агентов запрашиваются параллельно (SESSION_INVENTORY_WORKERS потоков) в фоновом
+    потоке; меню выводит последний результат и никогда не ждет сервер. Результат старше
+    SESSION_INVENTORY_TTL секунд обновляется в фоне при следующем обращении.
+    """
+
+    def __init__(self, directory, ttl=None, workers=None):
+        """Инициализация (загрузка не начинается до первого обращения или refresh_async)"""
+        self.directory = directory
+        self.ttl = SESSION_INVENTORY_TTL if ttl is None else ttl
+        self.workers = workers or SESSION_INVENTORY_WORKERS
+        self.counts = None       # Список (название агента, ID агента, количество сеансов)
+        self.fetched_at = 0.0
+        self.error = None
+        self._refresh_thread = None
+        self._lock = threading.Lock()
+
+    def _count_sessions(self, agent):
+        """Количество сеансов агента (со всех страниц)"""
+        count = 0
+        page = 1
+        while True:
+            sessions = agent.list_sessions(page=page, page_size=SESSION_COUNT_PAGE_SIZE)
+            count += len(sessions)
+            if len(sessions) < SESSION_COUNT_PAGE_SIZE:
+                return count
+            page += 1
+
+    def refresh(self):
+        """Подсчет сеансов всех агентов (запросы по агентам выполняются параллельно)"""
+        from concurrent.futures import ThreadPoolExecutor
+        try:
+            entries = self.directory.list()
+            agents = [self.directory.get_agent(entry) for entry in entries]
+
+            def count(agent):
+                try:
+                    return self._count_sessions(agent)
+                except Exception as e:
+                    logging.warning(f"Не удалось получить сеансы для агента {agent.title}: {e}")
+                    return None
+
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="session-inventory") as executor:
+                session_counts = list(executor.map(count, agents))
+
+            counts = [
+                (agent.title, agent.id, session_count)
+                for agent, session_count in zip(agents, session_counts)
+                if session_count
+            ]
+            with self._lock:
+                self.counts = counts
+                self.fetched_at = time.time()
+                self.error = None
+        except Exception as e:
+            with self._lock:
+                self.error = str(e)
+                self.fetched_at = time.time()  # Повтор после ошибки - также не чаще раза в ttl
+
+    def refresh_async(self):
+        """Запуск обновления в фоновом потоке (если оно еще не выполняется)"""
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self.refresh, name="session-inventory", daemon=True)
+            self._refresh_thread.start()
+
+    def invalidate(self):
+        """Пометка результата устаревшим (после создания или удаления сеансов)"""
+        with self._lock:
+            self.fetched_at = 0.0
+        self.refresh_async()
+
+    def snapshot(self):
+        """Последний результат без ожидания сервера: (counts или None, время загрузки, ошибка)"""
+        with self._lock:
+            counts, fetched_at, error = self.counts, self.fetched_at, self.error
+        if time.time() - fetched_at >= self.ttl:
+            self.refresh_async()
+        return counts, fetched_at, error
+
+
+def _exit_on_signal(signum, frame):
+    """Обработчик SIGTERM/SIGHUP: обычное завершение программы с вызовом функций atexit"""
+    sys.exit(128 + signum)
+
+def exit_on_termination_signals():
+    """Завершение по SIGTERM и SIGHUP (закрытие терминала) через sys.exit, а не сразу.
+
+    Без этого процесс завершается без atexit, и очистка (например, удаление заранее
+    созданных сеансов на сервере) не выполняется. Обработчики ставятся только из главного
+    потока и только вместо стандартных; SIGKILL перехватить нельзя.
+    """
+    import signal
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for name in ("SIGTERM", "SIGHUP"):
+        signum = getattr(signal, name, None)  # SIGHUP в Windows нет
+        if signum is not None and signal.getsignal(signum) is signal.SIG_DFL:
+            signal.signal(signum, _exit_on_signal)
+
+
+class SessionPrewarmer:
+    """Заранее созданные сеансы для часто используемых агентов.
+
+    При открытии меню для SESSION_PREWARM_AGENTS самых используемых агентов (по учету
+    AgentDirectory.record_use) в фоне создается по SESSION_PREWARM_SIZE сеансов; take()
+    выдает готовый сеанс без ожидания сервера и пополняет пул. Невыданные сеансы
+    удаляются на сервере при завершении программы (в том числе по SIGTERM и SIGHUP).
+    """
+
+    def __init__(self, directory, size=None, agents_limit=None):
+        """Инициализация пула (сеансы создаются после fill_async)"""
+        self.directory = directory
+        self.size = SESSION_PREWARM_SIZE if size is None else size
+        self.agents_limit = SESSION_PREWARM_AGENTS if agents_limit is None else agents_limit
+        self._pools = {}     # ID агента -> готовые сеансы
+        self._pending = {}   # ID агента -> агент, для которого нужно пополнить пул
+        self._fill_thread = None
+        self._closed = False
+        self._atexit_registered = False
+        self._lock = threading.Lock()
+
+    def fill_async(self, agent=None):
+        """Пополнение пула в фоне: для агента или (без агента) для всех часто используемых"""
+        if self.size <= 0:
+            return
+        agents = [agent] if agent is not None else [
+            self.directory.get_agent(entry) for entry in self.directory.most_used(self.agents_limit)
+        ]
+        with self._lock:
+            if self._closed:
+                return
+            for item in agents:
+                self._pending[item.id] = item
+            if not self._atexit_registered:
+                atexit.register(self.close)
+                exit_on_termination_signals()
+                self._atexit_registered = True
+            if self._fill_thread is None and self._pending:
+                self._fill_thread = threading.Thread(target=self._run, name="session-prewarm", daemon=True)
+                self._fill_thread.start()
+
+    def _run(self):
+        """Создание недостающих сеансов (фоновый поток)"""
+        while True:
+            with self._lock:
+                if self._closed or not self._pending:
+                    self._fill_thread = None
+                    return
+                agent_id, agent = self._pending.popitem()
+                missing = self.size - len(self._pools.get(agent_id, []))
+            for _ in range(missing):
+                if self._closed:
+                    break
+                try:
+                    session = agent.create_session()
+                except Exception as e:
+                    logging.warning(f"Не удалось заранее создать сеанс агента {agent.title}: {e}")
+                    break
+                with self._lock:
+                    closed = self._closed
+                    if not closed:
+                        self._pools.setdefault(agent_id, []).append(session)
+                if closed:
+                    # close() уже собрал пул (например, истекло ожидание потока) - сеанс удаляем сами
+                    self._delete(agent_id, [session])
+                    return
+
+    def take(self, agent):
+        """Сеанс для агента: готовый из пула или (если пул пуст) созданный сейчас"""
+        self.directory.record_use(agent.id)
+        with self._lock:
+            pool = self._pools.get(agent.id)
+            session = pool.pop(0) if pool else None
+        if session is None:
+            session = agent.create_session()
+        if any(entry["id"] == agent.id for entry in self.directory.most_used(self.agents_limit)):
+            self.fill_async(agent)
+        return session
+
+    def session_ids(self):
+        """ID невыданных сеансов (их нельзя удалять массовой очисткой)"""
+        with self._lock:
+            return {session.id for sessions in self._pools.values() for session in sessions}
+
+    def _delete(self, agent_id, sessions):
+        """Удаление сеансов агента на сервере"""
+        # Пустой список не передается: delete_sessions(ids=None) удаляет все сеансы агента
+        if not sessions:
+            return
+        try:
+            self.directory.get_agent({"id": agent_id}).delete_sessions(ids=[session.id for session in sessions])
+        except Exception as e:
+            logging.warning(f"Не удалось удалить заранее созданные сеансы агента {agent_id}: {e}")
+
+    def close(self, timeout=10):
+        """Остановка пополнения и удаление невыданных сеансов на сервере"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._fill_thread
+        if thread is not None:
+            thread.join(timeout=timeout)
+        # Сеанс, созданный потоком после этой точки, поток удалит сам (см. _run)
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for agent_id, sessions in pools.items():
+            self._delete(agent_id, sessions)
+
+
+class SessionCleaner:
+    """Массовое удаление сеансов агентов.
+
+    Сеансы каждого агента загружаются со всех страниц, отбираются фильтрами и удаляются
+    пакетами по SESSION_DELETE_BATCH_SIZE ID в SESSION_CLEANUP_WORKERS потоков; запросы
+    к серверу ограничены частотой SESSION_DELETE_RATE_LIMIT в секунду.
+    """
+
+    def __init__(self, directory, workers=None, batch_size=None, rate_limit=None):
+        """Инициализация параметров очистки"""
+        self.directory = directory
+        self.workers = workers or SESSION_CLEANUP_WORKERS
+        self.batch_size = batch_size or SESSION_DELETE_BATCH_SIZE
+        self.rate_limit = SESSION_DELETE_RATE_LIMIT if rate_limit is None else rate_limit
+        self._rate_lock = threading.Lock()
+        self._next_request = 0.0
+
+    def _throttle(self):
+        """Ожидание очереди запроса (равномерно не более rate_limit запросов в секунду)"""
+        if not self.rate_limit or self.rate_limit <= 0:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_request - now
+            self._next_request = max(now, self._next_request) + 1.0 / self.rate_limit
+        if wait > 0:
+            time.sleep(wait)
+
+    @staticmethod
+    def _session_time(session):
+        """Время последнего изменения сеанса (Unix-время в секундах; None, если неизвестно)"""
+        value = getattr(session, "update_time", None) or getattr(session, "create_time", None)
+        if not isinstance(value, (int, float)):
+            return None
+        return value / 1000 if value > 1e11 else value  # RAGFlow хранит время в миллисекундах
+
+    def _list_sessions(self, agent):
+        """Все сеансы агента (со всех страниц)"""
+        sessions = []
+        page = 1
+        while True:
+            self._throttle()
+            batch = agent.list_sessions(page=page, page_size=SESSION_COUNT_PAGE_SIZE)
+            sessions.extend(batch)
+            if len(batch) < SESSION_COUNT_PAGE_SIZE:
+                return sessions
+            page += 1
+
+    def run(self, agents, older_than=None, only_ids=None, keep_ids=(), dry_run=False, on_progress=None,
+            listed=None):
+        """Удаление сеансов агентов с фильтрами; возвращает отчет с количеством и временем.
+
+        older_than - timedelta: удалять сеансы, не изменявшиеся дольше этого времени;
+        only_ids - удалять только сеансы из этого множества (например, созданные анализатором);
+        keep_ids - сеансы, которые не удаляются никогда (используемые сейчас);
+        on_progress(строка) - вывод хода очистки;
+        listed - уже загруженные сеансы (ID агента -> список), чтобы не запрашивать их повторно.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        report = {
+            "agents": len(agents), "listed": 0, "matched": 0, "deleted": 0, "failed": 0,
+            "errors": [], "list_time": 0.0, "delete_time": 0.0, "elapsed": 0.0,
+        }
+        report_lock = threading.Lock()
+        started = time.perf_counter()
+        cutoff = time.time() - older_than.total_seconds() if older_than else None
+        keep_ids = set(keep_ids)
+
+        def select(agent):
+            """Загрузка и отбор сеансов одного агента"""
+            try:
+                if listed is not None and agent.id in listed:
+                    sessions = listed[agent.id]
+                else:
+                    sessions = self._list_sessions(agent)
+            except Exception as e:
+                with report_lock:
+                    report["errors"].append(f"{agent.title}: {e}")
+                return agent, []
+            selected = []
+            for session in sessions:
+                if session.id in keep_ids:
+                    continue
+                if only_ids is not None and session.id not in only_ids:
+                    continue
+                if cutoff is not None:
+                    session_time = self._session_time(session)
+                    if session_time is None or session_time >= cutoff:
+                        continue
+                selected.append(session.id)
+            with report_lock:
+                report["listed"] += len(sessions)
+                report["matched"] += len(selected)
+            return agent, selected
+
+        def delete(task):
+            """Удаление одного пакета сеансов"""
+            agent, ids = task
+            self._throttle()
+            try:
+                agent.delete_sessions(ids=ids)
+                with report_lock:
+                    report["deleted"] += len(ids)
+            except Exception as e:
+                with report_lock:
+                    report["failed"] += len(ids)
+                    report["errors"].append(f"{agent.title}: {e}")
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="session-cleanup") as executor:
+            selected = list(executor.map(select, agents))
+            report["list_time"] = time.perf_counter() - started
+            if on_progress:
+                on_progress(f"Найдено сеансов: {report['listed']}, к удалению: {report['matched']}")
+
+            # Пустой список ID не передается: delete_sessions(ids=None) удаляет все сеансы агента
+            tasks = [
+                (agent, ids[offset:offset + self.batch_size])
+                for agent, ids in selected
+                for offset in range(0, len(ids), self.batch_size)
+            ]
+            if not dry_run and tasks:
+                delete_started = time.perf_counter()
+                list(executor.map(delete, tasks))
+                report["delete_time"] = time.perf_counter() - delete_started
+
+        report["elapsed"] = time.perf_counter() - started
+        return report
+
+
+def format_cleanup_report(report, dry_run=False):
+    """Текст отчета SessionCleaner.run"""
+    lines = [
+        f"Агентов: {report['agents']}, сеансов найдено: {report['listed']}, подходит под фильтры: {report['matched']}",
+    ]
+    if dry_run:
+        lines.append("Пробный запуск: сеансы не удалялись")
+    else:
+        lines.append(f"Удалено сеансов: {report['deleted']}, не удалось удалить: {report['failed']}")
+    lines.append(
+        f"Время: загрузка списков {report['list_time']:.2f} сек., удаление {report['delete_time']:.2f} сек., "
+        f"всего {report['elapsed']:.2f} сек."
+    )
+    for error in report["errors"][:10]:
+        lines.append(f"Ошибка: {error}")
+    if len(report["errors"]) > 10:
+        lines.append(f"... и еще ошибок: {len(report['errors']) - 10}")
+    return "\n".join(lines)
+
+
+class SessionNotFoundError(LookupError):
+    """Сеанс не существует на сервере (удален или указан неверный ID)"""
+
+
+class AgentMessenger:
+    """Отправка сообщений агентам с переиспользованием клиента, индекса агентов и сеансов.
+
+    Ход отправки передается функции emit(событие, данные): "info" - строка текста,
+    "chunk" - часть ответа, "references" - источники. Одна реализация служит и для
+    вывода в консоль, и для передачи клиенту демона.
+    """
+
+    def __init__(self, directory=None, transcripts=None):
+        """Инициализация отправителя"""
+        self.directory = directory or AgentDirectory()
+        self._transcripts = transcripts  # История чатов (Database), открывается при первой записи
+        self._default_sessions = {}  # ID агента -> сеанс, используемый по умолчанию
+        self._sessions = {}          # ID сеанса -> сеанс (локальный индекс, без запросов к серверу)
+        self._validated = {}         # ID сеанса -> время последнего подтверждения его существования
+        self._session_locks = {}     # ID сеанса -> блокировка (вопросы в один сеанс - по очереди)
+        self._lock = threading.Lock()
+
+    @property
+    def transcripts(self):
+        """Хранилище истории чатов (None, если CHAT_TRANSCRIPTS_ENABLED выключен)"""
+        if self._transcripts is None and CHAT_TRANSCRIPTS_ENABLED:
+            with self._lock:
+                if self._transcripts is None:
+                    self._transcripts = Database(LOG_DB_PATH)
+        return self._transcripts
+
+    def release_thread(self):
+        """Закрытие соединения текущего потока с историей чатов (для короткоживущих потоков)"""
+        if self._transcripts is not None:
+            self._transcripts.disconnect()
+
+    def _record_turn(self, session, message, answer, references, first_chunk_time, total_time):
+        """Запись вопроса и ответа в историю чатов (ошибка записи не мешает ответу)"""
+        store = self.transcripts
+        if store is None:
+            return
+        agent_id = getattr(session, "agent_id", None)
+        store.add_chat_turn(
+            session.id, agent_id, self.directory.title(agent_id), message, answer,
+            first_chunk_time=round(first_chunk_time, 4) if first_chunk_time is not None else None,
+            total_time=round(total_time, 4),
+            references=references
+        )
+
+    def _session_lock(self, session_id):
+        """Блокировка сеанса"""
+        with self._lock:
+            return self._session_locks.setdefault(session_id, threading.Lock())
+
+    def remember_session(self, session, validated=True):
+        """Добавление сеанса в локальный индекс (validated - сеанс только что получен от сервера)"""
+        with self._lock:
+            self._sessions[session.id] = session
+            if validated:
+                self._validated[session.id] = time.monotonic()
+        return session
+
+    def find_session(self, agent, session_id):
+        """Сеанс агента по ID без запроса к серверу.
+
+        Объект сеанса строится локально; существование сеанса проверяется при первом
+        вопросе в него (ask), и только если сервер вернул ошибку.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is not None and session.agent_id == agent.id:
+            return session
+        from ragflow_sdk import Session
+        return self.remember_session(Session(agent.rag, {"id": session_id, "agent_id": agent.id}), validated=False)
+
+    def session_exists(self, session):
+        """Проверка существования сеанса прямым запросом по ID (без просмотра всего списка)"""
+        from ragflow_sdk import Agent
+        agent = Agent(session.rag, {"id": session.agent_id})
+        return bool(agent.list_sessions(page=1, page_size=1, id=session.id))
+
+    def is_session_valid(self, session):
+        """Существует ли сеанс: подтвержденный в последние SESSION_VALIDITY_TTL секунд считается
+        существующим без запроса, иначе выполняется прямой запрос по ID"""
+        with self._lock:
+            checked_at = self._validated.get(session.id)
+        if checked_at is not None and time.monotonic() - checked_at < SESSION_VALIDITY_TTL:
+            return True
+        if not self.session_exists(session):
+            with self._lock:
+                self._sessions.pop(session.id, None)
+                self._validated.pop(session.id, None)
+            return False
+        with self._lock:
+            self._validated[session.id] = time.monotonic()
+        return True
+
+    def ask(self, session, message, on_chunk=None, stream=None, show_references=None):
+        """Вопрос в сеанс: (ответ, источники); ответ None, если агент не ответил.
+
+        stream и show_references заменяют для этого вопроса ENABLE_STREAMING и SHOW_REFERENCES.
+        """
+        stream = CONFIG['ENABLE_STREAMING'] if stream is None else stream
+        show_references = CONFIG['SHOW_REFERENCES'] if show_references is None else show_references
+        content = ""
+        response_received = False
+        references = []
+        started = time.perf_counter()
+        first_chunk_time = None
+
+        try:
+            with self._session_lock(session.id):
+                for response in session.ask(message, stream=stream):
+                    if response and hasattr(response, 'content'):
+                        if not response_received:
+                            first_chunk_time = time.perf_counter() - started
+                        response_received = True
+
+                        # Обработка ограничения длины ответа
+                        if CONFIG['MAX_RESPONSE_LENGTH'] > 0 and len(response.content) > CONFIG['MAX_RESPONSE_LENGTH']:
+                            if len(content) < CONFIG['MAX_RESPONSE_LENGTH']:
+                                new_content = response.content[len(content):CONFIG['MAX_RESPONSE_LENGTH']]
+                                if on_chunk:
+                                    on_chunk(new_content + "... [Ответ обрезан из-за ограничения длины]")
+                                content = response.content[:CONFIG['MAX_RESPONSE_LENGTH']]
+                        else:
+                            new_content = response.content[len(content):]
+                            if on_chunk:
+                                on_chunk(new_content)
+                            content = response.content
+
+                        # Сохраняем ссылки на источники
+                        if show_references and hasattr(response, 'reference') and response.reference:
+                            references = response.reference
+        except Exception:
+            # Ответ сервера на неизвестный сеанс SDK не распознает, поэтому сеанс заранее
+            # не проверяется, а после ошибки проверяется, существует ли он еще
+            if not response_received and not self.is_session_valid(session):
+                raise SessionNotFoundError(f"Сеанс с ID {session.id} не найден")
+            raise
+
+        if not response_received:
+            return None, []
+        with self._lock:
+            self._validated[session.id] = time.monotonic()
+        references = [self._reference_to_dict(ref, idx) for idx, ref in enumerate(references, 1)]
+        self._record_turn(session, message, content, references, first_chunk_time, time.perf_counter() - started)
+        return content, references
+
+    def ask_with_recovery(self, agent, session, message, on_chunk=None, on_recreate=None,
+                          stream=None, show_references=None):
+        """ask() с заменой удаленного на сервере сеанса новым: (сеанс, ответ, источники).
+
+        on_recreate(старый сеанс, новый сеанс) вызывается перед повтором вопроса в новом сеансе.
+        """
+        try:
+            return (session,) + self.ask(session, message, on_chunk, stream, show_references)
+        except SessionNotFoundError:
+            new_session = self.remember_session(agent.create_session())
+            if on_recreate:
+                on_recreate(session, new_session)
+            return (new_session,) + self.ask(new_session, message, on_chunk, stream, show_references)
+
+    def _resolve_session(self, agent, session_id, create_new_session, emit):
+        """Поиск или создание сеанса по правилам CLI (None, если указанный сеанс не найден)"""
+        if session_id:
+            return self.find_session(agent, session_id)
+
+        if create_new_session:
+            session = self.remember_session(agent.create_session())
+            emit("info", f"Создан новый сеанс с ID: {session.id}")
+            return session
+
+        with self._lock:
+            session = self._default_sessions.get(agent.id)
+        if session is not None:
+            emit("info", f"Используется существующий сеанс с ID: {session.id}")
+            return session
+
+        # Поиск существующего сеанса или создание нового
+        sessions = agent.list_sessions()
+        if sessions:
+            session = self.remember_session(sessions[0])  # Берем первый доступный сеанс
+            emit("info", f"Используется существующий сеанс с ID: {session.id}")
+        else:
+            session = self.remember_session(agent.create_session())
+            emit("info", f"Создан новый сеанс с ID: {session.id}")
+        with self._lock:
+            self._default_sessions[agent.id] = session
+        return session
+
+    def send(self, message, agent_id=None, agent_title=None, session_id=None, create_new_session=False,
+             emit=None, stream=None, show_references=None):
+        """Отправка сообщения агенту; True, если ответ получен.
+
+        stream и show_references (None - из CONFIG) передает клиент демона: его флаги
+        --no-streaming и --no-references не должны зависеть от настроек демона.
+        """
+        emit = emit or print_message_event
+        target_agent = None
+        try:
+            # Поиск агента в локальном индексе (без ID и названия - первый доступный)
+            target_agent = self.directory.find(agent_id, agent_title)
+            if not agent_id and not agent_title:
+                if not target_agent:
+                    emit("info", "Нет доступных агентов")
+                    return False
+                emit("info", f"Агент не указан, используется первый доступный: '{target_agent.title}'")
+
+            if not target_agent:
+                emit("info", "Агент не найден. Доступные агенты:")
+                for line in agent_list_lines(self.directory.list()):
+                    emit("info", line)
+                return False
+
+            target_session = self._resolve_session(target_agent, session_id, create_new_session, emit)
+            if not target_session:
+                return False
+
+            # Отправка сообщения
+            emit("info", f"\nОтправка сообщения агенту '{target_agent.title}':")
+            emit("info", f"Сообщение: {message}")
+            emit("info", f"\n{CONFIG['ASSISTANT_PREFIX']}")
+
+            # Получение ответа от агента (явно указанный сеанс не подменяется новым)
+            on_chunk = lambda text: emit("chunk", text)
+            if session_id:
+                content, references = self.ask(target_session, message, on_chunk, stream, show_references)
+            else:
+                def on_recreate(old_session, new_session):
+                    emit("info", f"Сеанс {old_session.id} больше не существует, создан новый сеанс с ID: {new_session.id}")
+                    with self._lock:
+                        if self._default_sessions.get(target_agent.id) is old_session:
+                            self._default_sessions[target_agent.id] = new_session
+
+                target_session, content, references = self.ask_with_recovery(
+                    target_agent, target_session, message, on_chunk, on_recreate, stream, show_references
+                )
+            if content is None:
+                emit("info", "Извините, произошла ошибка при обработке ответа.")
+                return False
+
+            if references:
+                emit("references", references)
+
+            emit("info", "")
+            return True
+
+        except Exception as e:
+            # Сохраненный сеанс мог быть удален на сервере - при следующем вызове ищем заново
+            if target_agent is not None:
+                with self._lock:
+                    self._default_sessions.pop(target_agent.id, None)
+            emit("info", f"Ошибка при отправке сообщения: {str(e)}")
+            return False
+
+    @staticmethod
+    def _reference_to_dict(ref, idx):
+        """Источник ответа в виде словаря (для вывода и передачи клиенту демона)"""
+        if isinstance(ref, dict):
+            doc_name = ref.get('document_name', f'Источник {idx}')
+            ref_content = ref.get('content', '')
+            similarity = ref.get('similarity', None)
+        else:
+            doc_name = getattr(ref, 'document_name', f'Источник {idx}')
+            ref_content = getattr(ref, 'content', '')
+            similarity = getattr(ref, 'similarity', None)
+        return {"document_name": doc_name, "content": ref_content, "similarity": similarity}
+
+
+class AgentDaemon:
+    """Локальный демон на Unix-сокете: клиент RAGFlow, индекс агентов и сеансы остаются в памяти.
+
+    Протокол - строки JSON: клиент отправляет запрос {"command": ...}, демон отвечает
+    событиями {"event": ..., "data": ...} и завершает ответ событием "result".
+    """
+
+    def __init__(self, socket_path=None):
+        """Инициализация демона"""
+        self.socket_path = socket_path or AGENT_DAEMON_SOCKET
+        self.messenger = AgentMessenger()
+        self.server = None
+
+    def serve_forever(self):
+        """Запуск демона (до остановки командой stop или Ctrl+C)"""
+        if daemon_request({"command": "ping"}, lambda event, data: None, self.socket_path) is not None:
+            raise RuntimeError(f"Демон уже запущен: {self.socket_path}")
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)  # Сокет от завершившегося демона
+
+        import socketserver
+        daemon = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                daemon.handle(self.rfile, self.wfile)
+
+        # Демон работает с ключом API - сокет доступен только владельцу с момента создания
+        previous_umask = os.umask(0o177)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, RequestHandler)
+        finally:
+            os.umask(previous_umask)
+        self.server.daemon_threads = True
+        self.messenger.directory.list()
+        logging.info(f"Демон агентов запущен: {self.socket_path}")
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def handle(self, rfile, wfile):
+        """Обработка одного запроса клиента"""
+        connected = True
+
+        def emit(event, data=None):
+            nonlocal connected
+            if not connected:
+                return
+            try:
+                wfile.write((json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n").encode("utf-8"))
+                if event in ("chunk", "result"):
+                    wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # Клиент отключился (например, Ctrl+C) - запрос дорабатывается без вывода
+                connected = False
+                logging.info("Клиент демона отключился до завершения ответа")
+
+        ok = False
+        try:
+            request = json.loads(rfile.readline().decode("utf-8"))
+            command = request.get("command")
+            if command == "send":
+                ok = self.messenger.send(
+                    request["message"],
+                    agent_id=request.get("agent_id"),
+                    agent_title=request.get("agent_title"),
+                    session_id=request.get("session_id"),
+                    create_new_session=request.get("new_session", False),
+                    emit=emit,
+                    stream=request.get("stream"),
+                    show_references=request.get("show_references")
+                )
+            elif command == "ping":
+                emit("pool", self.messenger.directory.rag_object.http_pool.stats())
+                ok = True
+            elif command == "stop":
+                emit("info", format_pool_stats(self.messenger.directory.rag_object.http_pool.stats()))
+                ok = True
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            else:
+                emit("info", f"Неизвестная команда демона: {command}")
+        except Exception as e:
+            logging.error(f"Ошибка обработки запроса к демону: {e}")
+            emit("info", f"Ошибка демона: {e}")
+        finally:
+            # Каждый запрос обслуживается новым потоком - его соединение с базой больше не понадобится
+            self.messenger.release_thread()
+        emit("result", ok)
+
+
+class RAGFlowMenu:
+    def __init__(self):
+        """Инициализация меню и подключения к серверу"""
+        try:
+            self.rag_object = get_ragflow_client()
+            self.messenger = AgentMessenger(AgentDirectory(self.rag_object))  # Вопросы и проверка сеансов
+            self.session_inventory = SessionInventory(self.messenger.directory)  # Сеансы агентов для меню
+            self.session_prewarmer = SessionPrewarmer(self.messenger.directory)  # Заранее созданные сеансы
+            get_ragflow_client(pool_size=self.session_inventory.workers + 2)  # И еще чат и анализатор логов
+            self.current_agent = None
+            self.current_session = None
+            self.log_processor = LogProcessor(self)  # Инициализация процессора логов
+            
+            # Проверяем соединение при инициализации
+            self._test_connection()
+            self.session_inventory.refresh_async()  # К первому выводу меню данные будут готовы
+            self.session_prewarmer.fill_async()
+            
+        except Exception as e:
+            print(f"Ошибка при инициализации: {e}")
+            print("Проверьте настройки API_KEY и BASE_URL")
+            self.rag_object = None
+            self.messenger = None
+            self.session_inventory = None
+            self.session_prewarmer = None
+            self.current_agent = None
+            self.current_session = None
+            self.log_processor = None
+    
+    def _test_connection(self):
+        """Тестирование подключения к серверу API"""
+        try:
+            # Пытаемся получить список агентов для проверки соединения
+            test_agents = self.rag_object.list_agents(page=1, page_size=1)
+            print("✓ Подключение к серверу API успешно установлено")
+            return True
+        except Exception as e:
+            error_msg = str(e)
+            if "Expecting value" in error_msg:
+                print("✗ Ошибка: Сервер вернул некорректный JSON. Проверьте BASE_URL.")
+            elif "Connection" in error_msg or "timeout" in error_msg.lower():
+                print("✗ Ошибка: Не удается подключиться к серверу.")
+            elif "401" in error_msg or "Unauthorized" in error_msg:
+                print("✗ Ошибка: Неверный API_KEY.")
+            else:
+                print(f"✗ Ошибка подключения: {error_msg}")
+            return False
+
+    def clear_screen(self):
+        """Очистка экрана"""
+        os.system('cls' if os.name == 'nt' else 'clear')
+
+    def select_agent(self) -> Optional[object]:
+        """Выбор агента из списка"""
+        if not self.rag_object:
+            print("Ошибка: нет подключения к серверу API")
+            return None
+            
+        try:
+            # Полный список из индекса агентов (все страницы, без запроса при свежем кэше)
+            directory = self.messenger.directory
+            agents = directory.list()
+            if not agents:
+                print(f"\n{CONFIG['MESSAGES']['no_agents']}")
+                return None
+
+            print()
+            for line in agent_list_lines(agents):
+                print(line)
 
             while True:
                 try:
@@ -435,7 +2115,7 @@ class RAGFlowMenu:
                     if choice == 0:
                         return None
                     if 1 <= choice <= len(agents):
-                        return agents[choice - 1]
+                        return directory.get_agent(agents[choice - 1])
                     print(CONFIG['MESSAGES']['invalid_choice'])
                 except ValueError:
                     print("Пожалуйста, введите число.")
@@ -454,24 +2134,19 @@ class RAGFlowMenu:
             return
 
         try:
-            session = agent.create_session()
+            session = self.session_prewarmer.take(agent)
             print(f"\nСоздан новый сеанс с агентом '{agent.title}'")
             print(f"ID сеанса: {session.id}")
             self.current_agent = agent
-            self.current_session = session
+            self.current_session = self.messenger.remember_session(session)
         except Exception as e:
             print(f"Ошибка при создании сеанса: {str(e)}")
 
     def chat_with_agent(self):
         """Общение с агентом"""
-        # Проверяем валидность текущего сеанса
-        if self.current_session and not self.check_session_valid():
-            print("\nТекущий сеанс больше не действителен (возможно, был удален).")
-            print(CONFIG['MESSAGES']['no_session'])
-            # Сбрасываем значения current_agent и current_session
-            self.current_agent = None
-            self.current_session = None
-            
+        # Текущий сеанс заранее не проверяется: если он удален на сервере,
+        # при первом вопросе будет создан новый сеанс (AgentMessenger.ask_with_recovery)
+
         # Проверяем наличие текущего сеанса
         if not self.current_session:
             # Если нет текущего сеанса, предлагаем выбрать агента
@@ -487,7 +2162,7 @@ class RAGFlowMenu:
                 return
                 
             self.current_agent = agent
-            self.current_session = session
+            self.current_session = self.messenger.remember_session(session)
         
         print(f"\nЧат с агентом '{self.current_agent.title}' - сеанс {self.current_session.id}")
         print(CONFIG['MESSAGES']['chat_exit_help'])
@@ -536,54 +2211,21 @@ class RAGFlowMenu:
 
             print(f"\n{CONFIG['ASSISTANT_PREFIX']}")
             try:
-                content = ""
-                response_received = False
-                references = []
-                
+                def on_recreate(old_session, new_session):
+                    print(f"(Сеанс {old_session.id} больше не существует, создан новый сеанс {new_session.id})")
+
                 # Получение ответа от агента с использованием пользовательских настроек
-                for response in self.current_session.ask(final_prompt, stream=CONFIG['ENABLE_STREAMING']):
-                    if response and hasattr(response, 'content'):
-                        response_received = True
-                        
-                        # Обработка ограничения длины ответа
-                        if CONFIG['MAX_RESPONSE_LENGTH'] > 0 and len(response.content) > CONFIG['MAX_RESPONSE_LENGTH']:
-                            # Если длина превышает максимальную, обрезаем контент
-                            if len(content) < CONFIG['MAX_RESPONSE_LENGTH']:
-                                new_content = response.content[len(content):CONFIG['MAX_RESPONSE_LENGTH']]
-                                print(new_content + "... [Ответ обрезан из-за ограничения длины]", end='', flush=True)
-                                content = response.content[:CONFIG['MAX_RESPONSE_LENGTH']]
-                        else:
-                            new_content = response.content[len(content):]
-                            print(new_content, end='', flush=True)
-                            content = response.content
-                            
-                        # Сохраняем ссылки на источники, если они есть
-                        if CONFIG['SHOW_REFERENCES'] and hasattr(response, 'reference') and response.reference:
-                            references = response.reference
+                self.current_session, content, references = self.messenger.ask_with_recovery(
+                    self.current_agent, self.current_session, final_prompt,
+                    on_chunk=lambda text: print(text, end='', flush=True),
+                    on_recreate=on_recreate
+                )
                     
-                if not response_received:
+                if content is None:
                     print("Извините, произошла ошибка при обработке ответа. Попробуйте переформулировать вопрос.")
-                  # Вывод источников информации, если они есть и настройка включена
-                if CONFIG['SHOW_REFERENCES'] and references:
-                    print("\n\nИсточники информации:")
-                    for idx, ref in enumerate(references, 1):
-                        # Проверяем, является ли ref словарем или объектом
-                        if isinstance(ref, dict):
-                            doc_name = ref.get('document_name', f'Источник {idx}')
-                            content = ref.get('content', '')
-                            similarity = ref.get('similarity', None)
-                        else:
-                            # Это объект с атрибутами
-                            doc_name = getattr(ref, 'document_name', f'Источник {idx}')
-                            content = getattr(ref, 'content', '')
-                            similarity = getattr(ref, 'similarity', None)
-                        
-                        print(f"\n{idx}. {doc_name}")
-                        if content:
-                            print(f"   {content[:100]}...")
-                        if similarity is not None:
-                            print(f"   Релевантность: {similarity:.2f}")
-                
+                # Вывод источников информации, если они есть и настройка включена
+                if references:
+                    print_message_event("references", references)
                 print()
                 
             except Exception as e:
@@ -626,7 +2268,10 @@ class RAGFlowMenu:
             return
 
         try:
-            sessions = agent.list_sessions()
+            cleaner = SessionCleaner(self.messenger.directory)
+            # Сеансы со всех страниц, кроме используемых (обработка логов, заранее созданные)
+            in_use = self._sessions_in_use()
+            sessions = [session for session in cleaner._list_sessions(agent) if session.id not in in_use]
             if not sessions:
                 print(f"\nНет доступных сеансов для удаления у агента '{agent.title}'")
                 return
@@ -641,16 +2286,20 @@ class RAGFlowMenu:
                 try:
                     choice = input("\nВведите номера сеансов для удаления через запятую (0 для удаления всех): ")
                     if choice == "0":
-                        agent.delete_sessions()
-                        print("\nВсе сеансы удалены")
+                        report = cleaner.run([agent], keep_ids=self._sessions_in_use(), on_progress=print)
+                        print(format_cleanup_report(report))
                         break
                     
                     indices = [int(x.strip()) for x in choice.split(",")]
-                    session_ids = [sessions[i-1].id for i in indices if 1 <= i <= len(sessions)]
+                    session_ids = {sessions[i-1].id for i in indices if 1 <= i <= len(sessions)}
                     
                     if session_ids:
-                        agent.delete_sessions(ids=session_ids)
-                        print("\nВыбранные сеансы удалены")
+                        # Пакетами, с ограничением частоты и без используемых сейчас сеансов
+                        report = cleaner.run(
+                            [agent], only_ids=session_ids, keep_ids=self._sessions_in_use(),
+                            listed={agent.id: sessions}
+                        )
+                        print(format_cleanup_report(report))
                         break
                     else:
                         print(CONFIG['MESSAGES']['invalid_choice'])
@@ -662,44 +2311,120 @@ class RAGFlowMenu:
         except Exception as e:
             print(f"Ошибка при получении списка сеансов: {str(e)}")
 
+    def _sessions_in_use(self):
+        """Сеансы, которые нельзя удалять при массовой очистке (идет обработка логов, заранее созданные)"""
+        in_use = self.session_prewarmer.session_ids()
+        if self.log_processor and self.log_processor.processing_flag and self.log_processor.current_session:
+            in_use.add(self.log_processor.current_session.id)
+        return in_use
+
+    def _ask_cleanup_filters(self):
+        """Запрос фильтров массового удаления сеансов (None - операция отменена)"""
+        hours = input("\nУдалять только сеансы старше N часов (Enter - независимо от возраста): ").strip()
+        try:
+            older_than = datetime.timedelta(hours=float(hours)) if hours else None
+        except ValueError:
+            print("Пожалуйста, введите число.")
+            return None
+
+        only_ids = None
+        if input("Удалять только сеансы анализатора логов? (y/n): ").lower() == 'y':
+            only_ids = self.log_processor.db.get_agent_session_ids() if self.log_processor else None
+            if only_ids is None:
+                print("Не удалось получить список сеансов анализатора логов")
+                return None
+        return {"older_than": older_than, "only_ids": only_ids}
+
     def delete_all_sessions(self):
-        """Удаление всех сеансов у всех агентов"""
+        """Удаление всех сеансов у всех агентов (все страницы, параллельно, с фильтрами)"""
         try:
-            agents = self.rag_object.list_agents(
-                page=CONFIG['DEFAULT_PAGE'],
-                page_size=CONFIG['DEFAULT_PAGE_SIZE'],
-                orderby=CONFIG['DEFAULT_ORDER_BY'],
-                desc=CONFIG['DEFAULT_DESC']
-            )
+            directory = self.messenger.directory
+            agents = [directory.get_agent(entry) for entry in directory.list()]
             
             if not agents:
                 print(f"\n{CONFIG['MESSAGES']['no_agents']}")
                 return
+
+            filters = self._ask_cleanup_filters()
+            if filters is None:
+                return
                 
             # Подтверждение операции
-            confirm = input("\nВы уверены, что хотите удалить ВСЕ сеансы у ВСЕХ агентов? (y/n): ")
+            if filters["older_than"] is None and filters["only_ids"] is None:
+                confirm = input("\nВы уверены, что хотите удалить ВСЕ сеансы у ВСЕХ агентов? (y/n): ")
+            else:
+                confirm = input("\nУдалить выбранные сеансы у ВСЕХ агентов? (y/n): ")
             if confirm.lower() != 'y':
                 print("\nОперация отменена.")
                 return
                 
-            # Удаление сеансов у каждого агента
-            deleted_count = 0
-            for agent in agents:
-                try:
-                    sessions = agent.list_sessions()
-                    if sessions:
-                        agent.delete_sessions()
-                        deleted_count += len(sessions)
-                        print(f"Удалены все сеансы у агента '{agent.title}'")
-                except Exception as e:
-                    print(f"Ошибка при удалении сеансов агента '{agent.title}': {str(e)}")
-                    
-            print(f"\nУдалено всего сеансов: {deleted_count}")
-            print(CONFIG['MESSAGES']['all_sessions_deleted'])
+            # Удаление сеансов всех агентов
+            report = SessionCleaner(directory).run(
+                agents, keep_ids=self._sessions_in_use(), on_progress=print, **filters
+            )
+            print(f"\n{format_cleanup_report(report)}")
+            if not report["errors"]:
+                print(CONFIG['MESSAGES']['all_sessions_deleted'])
             
         except Exception as e:
             print(f"Ошибка при получении списка агентов: {str(e)}")
 
+    def chat_history_menu(self):
+        """Просмотр сохраненной истории чатов (без обращения к серверу)"""
+        store = (self.messenger and self.messenger.transcripts) or Database(LOG_DB_PATH)
+        page_size = CHAT_HISTORY_PAGE_SIZE
+        offset = 0
+        while True:
+            sessions = store.get_chat_sessions(limit=page_size, offset=offset)
+            if not sessions:
+                if offset == 0:
+                    print("\nИстория чатов пуста")
+                    return
+                offset = max(0, offset - page_size)
+                continue
+
+            print("\nИстория чатов:")
+            print_chat_sessions(sessions, offset)
+            choice = input("\nНомер сеанса, '/текст' - поиск, 'n'/'p' - следующая/предыдущая страница (0 для возврата): ").strip()
+            if choice == "0":
+                return
+            elif choice.lower() == "n":
+                if len(sessions) < page_size:
+                    print("Это последняя страница")
+                else:
+                    offset += page_size
+            elif choice.lower() == "p":
+                offset = max(0, offset - page_size)
+            elif choice.startswith("/"):
+                results = store.search_chat_turns(choice[1:].strip())
+                if results:
+                    print_chat_turns(results, show_session=True)
+                else:
+                    print("Ничего не найдено")
+                input(f"\n{CONFIG['MESSAGES']['press_enter']}")
+            else:
+                try:
+                    idx = int(choice)
+                except ValueError:
+                    print("Пожалуйста, введите число.")
+                    continue
+                if offset < idx <= offset + len(sessions):
+                    self.show_chat_transcript(store, sessions[idx - offset - 1]["session_id"])
+                else:
+                    print(CONFIG['MESSAGES']['invalid_choice'])
+
+    def show_chat_transcript(self, store, session_id):
+        """Вывод истории сеанса порциями: следующая загружается только по запросу"""
+        print(f"\nИстория сеанса {session_id}")
+        print(CONFIG['MENU_SEPARATOR'])
+        for page in store.iter_chat_turns(session_id):
+            print_chat_turns(page)
+            if len(page) == CHAT_HISTORY_PAGE_SIZE:
+                if input("\nEnter - показать дальше (0 для возврата): ").strip() == "0":
+                    return
+        print(CONFIG['MENU_SEPARATOR'])
+        input(f"\n{CONFIG['MESSAGES']['press_enter']}")
+
     def select_session(self, agent) -> Optional[object]:
         """Выбор существующей сессии агента"""
         try:
@@ -709,6 +2434,10 @@ class RAGFlowMenu:
                 orderby=CONFIG['DEFAULT_ORDER_BY'],
                 desc=CONFIG['DEFAULT_DESC']
             )
+            # Заранее созданные сеансы выдает только take(): выбранный здесь сеанс из пула
+            # достался бы еще и следующему take(), а при выходе был бы удален
+            pooled = self.session_prewarmer.session_ids()
+            sessions = [session for session in sessions if session.id not in pooled]
             
             if not sessions:
                 print(f"\n{CONFIG['MESSAGES']['no_sessions_available']}")
@@ -729,11 +2458,12 @@ class RAGFlowMenu:
                     if choice == 0:
                         return None
                     if 1 <= choice <= len(sessions):
+                        self.messenger.directory.record_use(agent.id)
                         return sessions[choice - 1]
                     if choice == len(sessions) + 1:
                         # Создание нового сеанса
                         try:
-                            session = agent.create_session()
+                            session = self.session_prewarmer.take(agent)
                             print(f"\nСоздан новый сеанс с агентом '{agent.title}'")
                             print(f"ID сеанса: {session.id}")
                             return session
@@ -750,12 +2480,7 @@ class RAGFlowMenu:
     def view_all_agents(self):
         """Просмотр списка всех агентов"""
         try:
-            agents = self.rag_object.list_agents(
-                page=CONFIG['DEFAULT_PAGE'],
-                page_size=CONFIG['DEFAULT_PAGE_SIZE'],
-                orderby=CONFIG['DEFAULT_ORDER_BY'],
-                desc=CONFIG['DEFAULT_DESC']
-            )
+            agents = self.messenger.directory.list()
             
             if not agents:
                 print(f"\n{CONFIG['MESSAGES']['no_agents']}")
@@ -764,102 +2489,41 @@ class RAGFlowMenu:
             print("\nСписок всех агентов:")
             print(CONFIG['MENU_SEPARATOR'])
             for agent in agents:
-                print(f"ID: {agent.id}")
-                print(f"Название: {agent.title}")
+                print(f"ID: {agent['id']}")
+                print(f"Название: {agent['title']}")
                 print(CONFIG['MENU_SEPARATOR'])
             
         except Exception as e:
             print(f"Ошибка при получении списка агентов: {str(e)}")
 
     def get_active_sessions_info(self):
-        """Получение информации об активных сеансах для всех агентов"""
-        try:
-            # Проверяем соединение с API перед запросом
-            try:
-                agents = self.rag_object.list_agents(
-                    page=CONFIG['DEFAULT_PAGE'],
-                    page_size=CONFIG['DEFAULT_PAGE_SIZE'],
-                    orderby=CONFIG['DEFAULT_ORDER_BY'],
-                    desc=CONFIG['DEFAULT_DESC']
-                )
-            except Exception as api_error:
-                # Обрабатываем ошибки API соединения
-                error_msg = str(api_error)
-                if "Expecting value" in error_msg:
-                    return "Ошибка подключения к API. Проверьте:\n1. Правильность BASE_URL\n2. Доступность сервера\n3. Корректность API_KEY"
-                elif "Connection" in error_msg or "timeout" in error_msg.lower():
-                    return "Сервер API недоступен. Проверьте сетевое подключение."
-                else:
-                    return f"Ошибка API: {error_msg}"
-            
-            if not agents:
-                return "Нет доступных агентов"
-            
-            active_sessions = []
-            total_sessions = 0
-            
-            for agent in agents:
-                try:
-                    sessions = agent.list_sessions()
-                    session_count = len(sessions) if sessions else 0
-                    total_sessions += session_count
-                    
-                    if session_count > 0:
-                        active_sessions.append({
-                            "agent_name": agent.title,
-                            "agent_id": agent.id,
-                            "sessions_count": session_count
-                        })
-                except Exception as session_error:
-                    # Логируем ошибку получения сеансов для конкретного агента
-                    print(f"Предупреждение: не удалось получить сеансы для агента {agent.title}: {str(session_error)}")
-                    continue
-            
-            if active_sessions:
-                result = f"Всего активных сеансов: {total_sessions}\n"
-                result += "Детализация по агентам:\n"
-                for agent_info in active_sessions:
-                    result += f"• {agent_info['agent_name']}: {agent_info['sessions_count']} сеансов\n"
-                return result
-            else:
-                return "Нет активных сеансов у агентов"
-                
-        except Exception as e:
-            error_msg = str(e)
-            if "Expecting value" in error_msg:
-                return "Ошибка парсинга JSON ответа от сервера"
+        """Получение информации об активных сеансах для всех агентов (из фонового подсчета)"""
+        counts, fetched_at, error = self.session_inventory.snapshot()
+        if counts is None:
+            if error is None:
+                return "Загрузка информации о сеансах..."
+            # Обрабатываем ошибки API соединения
+            if "Expecting value" in error:
+                return "Ошибка подключения к API. Проверьте:\n1. Правильность BASE_URL\n2. Доступность сервера\n3. Корректность API_KEY"
+            elif "Connection" in error or "timeout" in error.lower():
+                return "Сервер API недоступен. Проверьте сетевое подключение."
             else:
-                return f"Ошибка при проверке активных сеансов: {error_msg}"
+                return f"Ошибка API: {error}"
 
-    def check_session_valid(self):
-        """Проверка валидности текущего сеанса"""
-        if not self.current_agent or not self.current_session:
-            return False
-            
-        try:
-            # Проверяем, существует ли еще этот агент
-            agents = self.rag_object.list_agents()
-            agent_exists = any(agent.id == self.current_agent.id for agent in agents)
-            
-            if not agent_exists:
-                self.current_agent = None
-                self.current_session = None
-                return False
-                
-            # Проверяем, существует ли еще сеанс у этого агента
-            sessions = self.current_agent.list_sessions()
-            session_exists = any(session.id == self.current_session.id for session in sessions)
-            
-            if not session_exists:
-                self.current_session = None
-                return False
-                
-            return True
-        except Exception:
-            # При возникновении любой ошибки считаем сеанс недействительным
-            self.current_agent = None
-            self.current_session = None
-            return False
+        if not self.messenger.directory.entries:
+            return "Нет доступных агентов"
+        if not counts:
+            return "Нет активных сеансов у агентов"
+
+        total_sessions = sum(session_count for _, _, session_count in counts)
+        updated = datetime.datetime.fromtimestamp(fetched_at).strftime("%H:%M:%S")
+        result = f"Всего активных сеансов: {total_sessions} (обновлено в {updated})\n"
+        if error is not None:
+            result += f"Обновление не удалось: {error}\n"
+        result += "Детализация по агентам:\n"
+        for agent_name, _, session_count in counts:
+            result += f"• {agent_name}: {session_count} сеансов\n"
+        return result
 
     def show_menu(self):
         """Отображение главного меню"""
@@ -886,6 +2550,7 @@ class RAGFlowMenu:
             print("5. Удалить сеансы агента")
             print("6. Удалить все сеансы у всех агентов")
             print("7. Анализатор логов")  # Новая опция для меню анализа логов
+            print("8. История чатов")
             print("0. Выход")
             print(CONFIG['MENU_SEPARATOR'])
 
@@ -912,11 +2577,18 @@ class RAGFlowMenu:
                     self.delete_all_sessions()
                 elif choice == "7":
                     self.log_analyzer_menu()  # Переход в меню анализа логов
+                elif choice == "8":
+                    self.chat_history_menu()  # Сохраненная история, без обращения к серверу
                 elif choice == "0":
                     print(f"\n{CONFIG['MESSAGES']['goodbye']}")
+                    if self.log_processor:
+                        self.log_processor.shutdown()
                     sys.exit(0)
                 else:
                     print(f"\n{CONFIG['MESSAGES']['invalid_choice']}")
+
+                if choice in ["2", "3", "5", "6"]:
+                    self.session_inventory.invalidate()  # Число сеансов могло измениться
                 
                 input(f"\n{CONFIG['MESSAGES']['press_enter']}")
             except KeyboardInterrupt:
@@ -944,6 +2616,8 @@ class RAGFlowMenu:
             print("4. Возобновить обработку")
             print("5. Показать статистику обработки")
             print("6. Настройки анализатора")
+            print("7. Поиск по результатам анализа")
+            print("8. Обслуживание базы данных")
             print("0. Вернуться в главное меню")
             print(CONFIG['MENU_SEPARATOR'])
             
@@ -961,6 +2635,10 @@ class RAGFlowMenu:
                     self.log_processor.show_statistics()
                 elif choice == "6":
                     self.log_analyzer_settings()
+                elif choice == "7":
+                    self.log_processor.search_results()
+                elif choice == "8":
+                    self.log_processor.database_maintenance()
                 elif choice == "0":
                     return
                 else:
@@ -1081,341 +2759,2530 @@ class RAGFlowMenu:
                 input(f"\n{CONFIG['MESSAGES']['press_enter']}")
     
 
-class Database:
+def _close_json_prefix(text):
+    """Дополнение обрезанного JSON закрывающими кавычкой и скобками"""
+    closers = []
+    in_string = False
+    skip_to = -1
+    for match in re.finditer(r'[\[\]{}"\\]', text):
+        index = match.start()
+        if index < skip_to:
+            continue
+        char = match.group()
+        if in_string:
+            if char == '"':
+                in_string = False
+            elif char == '\\':
+                skip_to = index + 2
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            closers.append('}' if char == '{' else ']')
+        elif closers:
+            closers.pop()
+    return text + ('"' if in_string else '') + "".join(reversed(closers))
+
+def repair_json_object(text):
+    """Разбор поврежденного JSON-объекта (json_repair, если установлен); None, если не удалось"""
+    try:
+        import json_repair
+    except ImportError:
+        json_repair = None
+
+    if json_repair is not None:
+        try:
+            value = json_repair.loads(text)
+        except Exception:
+            value = None
+        return value if isinstance(value, dict) and value else None
+
+    # Без json_repair исправляем самые частые ошибки: висячие запятые и ответ,
+    # обрезанный посередине (отбрасываем до трех последних неполных элементов)
+    variants = [text]
+    cut = len(text)
+    for _ in range(3):
+        cut = text.rfind(',', 0, cut)
+        if cut < 0:
+            break
+        variants.append(text[:cut])
+    for variant in variants:
+        try:
+            value = json.loads(re.sub(r',\s*([}\]])', r'\1', _close_json_prefix(variant)))
+        except json.JSONDecodeError:
+            continue
+        if isinstance(value, dict) and value:
+            return value
+    return None
+
+
+class JSONObjectScanner:
+    """Однопроходный поиск JSON-объектов верхнего уровня в тексте ответа агента.
+
+    Скобки внутри строковых литералов не учитываются, поэтому вложенные объекты
+    и массивы извлекаются целиком, а время поиска линейно от длины текста.
+    Текст можно подавать частями по мере получения потокового ответа (feed).
+    """
+
+    # Символы, влияющие на разбор; остальной текст пропускается без обработки в Python
+    _TOKENS = re.compile(r'[{}"\\]')
+
+    def __init__(self):
+        """Инициализация сканера"""
+        self.candidates = []  # Завершенные объекты {...} в порядке появления
+        self._parts = []      # Части незавершенного объекта из предыдущих порций текста
+        self._depth = 0
+        self._in_string = False
+        self._escape = False  # Порция закончилась обратной косой чертой внутри строки
+
+    def feed(self, chunk):
+        """Обработка очередной порции текста, возвращает объекты, завершенные в ней"""
+        completed = []
+        pos = 0
+        segment_start = 0
+        if self._escape:
+            self._escape = False
+            pos = 1
+
+        while True:
+            if not self._depth:
+                pos = chunk.find('{', pos)
+                if pos < 0:
+                    break
+                self._depth = 1
+                self._in_string = False
+                segment_start = pos
+                pos += 1
+
+            closed = False
+            skip_to = -1
+            for match in self._TOKENS.finditer(chunk, pos):
+                index = match.start()
+                if index < skip_to:
+                    continue  # Экранированный символ строки
+                char = match.group()
+                if self._in_string:
+                    if char == '"':
+                        self._in_string = False
+                    elif char == '\\':
+                        skip_to = index + 2
+                        if skip_to > len(chunk):
+                            self._escape = True
+                elif char == '"':
+                    self._in_string = True
+                elif char == '{':
+                    self._depth += 1
+                elif char == '}':
+                    self._depth -= 1
+                    if not self._depth:
+                        self._parts.append(chunk[segment_start:index + 1])
+                        completed.append("".join(self._parts))
+                        self._parts = []
+                        pos = index + 1
+                        closed = True
+                        break
+
+            if not closed:
+                self._parts.append(chunk[segment_start:])
+                break
+
+        self.candidates.extend(completed)
+        return completed
+
+    def unclosed(self):
+        """Незакрытый объект в конце текста (например, обрезанный ответ)"""
+        return "".join(self._parts) if self._depth else None
+
+    @classmethod
+    def _first_valid(cls, candidates):
+        """Первый кандидат, который разбирается как JSON; у неразобранных проверяются вложенные объекты"""
+        for candidate in candidates:
+            try:
+                return json.loads(candidate)
+            except json.JSONDecodeError:
+                pass
+            if candidate.count('{') > 1:
+                # Например, "{см. {"class": "ok"}}": объект находится внутри текста в скобках
+                inner = cls()
+                inner.feed(candidate[1:-1])
+                value = cls._first_valid(inner.candidates)
+                if value is not None:
+                    return value
+        return None
+
+    def parse(self):
+        """Первый JSON-объект ответа; при его отсутствии - восстановленный поврежденный объект"""
+        value = self._first_valid(self.candidates)
+        if value is not None:
+            return value
+
+        # Восстанавливаем только похожее на JSON ("ключ": ...), чтобы не принять
+        # за ответ обычный текст в фигурных скобках
+        suspects = [self.unclosed()] if self._depth else []
+        suspects += self.candidates
+        for candidate in suspects:
+            if '":' in candidate or '" :' in candidate:
+                value = repair_json_object(candidate)
+                if value is not None:
+                    return value
+        return None
+
+
+class VerdictRecord:
+    """Типизированный вердикт агента, проверенный по схеме промпта"""
+
+    __slots__ = ("verdict_class", "verdict_confidence", "verdict_match", "valid", "errors")
+
+    def __init__(self, verdict_class=None, verdict_confidence=None, verdict_match=None, valid=True, errors=()):
+        """Создание записи вердикта"""
+        self.verdict_class = verdict_class
+        self.verdict_confidence = verdict_confidence
+        self.verdict_match = verdict_match
+        self.valid = valid
+        self.errors = errors
+
+    def __repr__(self):
+        return (f"VerdictRecord({self.verdict_class!r}, {self.verdict_confidence!r}, "
+                f"{self.verdict_match!r}, valid={self.valid})")
+
+
+class VerdictSchema:
+    """Схема вердикта из VERDICT_SCHEMAS, скомпилированная в список проверок полей"""
+
+    _compiled = {}  # Скомпилированные схемы по ключу промпта
+
+    def __init__(self, fields):
+        """Компиляция описания полей в функции проверки"""
+        self._checks = [self._compile_field(name, spec) for name, spec in fields.items()]
+
+    @classmethod
+    def for_prompt(cls, prompt_key):
+        """Схема предустановленного промпта (None, если для промпта схема не задана)"""
+        fields = VERDICT_SCHEMAS.get(prompt_key)
+        if not fields:
+            return None
+        schema = cls._compiled.get(prompt_key)
+        if schema is None:
+            schema = cls._compiled[prompt_key] = cls(fields)
+        return schema
+
+    @staticmethod
+    def _compile_field(name, spec):
+        """Функция проверки одного поля: (значение, текст ошибки или None)"""
+        if name not in ResultStore.VERDICT_FIELDS:
+            raise ValueError(f"Неизвестное поле вердикта в схеме: {name}")
+        # Ключи ответа те же, из которых СУБД заполняет столбцы вердикта
+        keys = tuple(path[2:] for path in ResultStore.VERDICT_FIELDS[name])
+        label = keys[0]
+        is_number = spec.get("type", "string") == "number"
+        required = spec.get("required", False)
+        minimum = spec.get("min")
+        maximum = spec.get("max")
+        normalize = (lambda text: text.strip().upper()) if name == "verdict_class" else (lambda text: text)
+        allowed = frozenset(normalize(item) for item in spec["enum"]) if spec.get("enum") else None
+
+        def check(data):
+            value = next((data[key] for key in keys if data.get(key) is not None), None)
+            if value is None:
+                return None, (f"нет поля {label}" if required else None)
+            if is_number:
+                if isinstance(value, bool):
+                    return None, f"{label}: ожидается число"
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    return None, f"{label}: ожидается число"
+                if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+                    return value, f"{label}: значение {value} вне допустимого диапазона"
+                return value, None
+            if isinstance(value, (dict, list)):
+                return None, f"{label}: ожидается строка"
+            value = normalize(str(value))
+            if allowed is not None and value not in allowed:
+                return value, f"{label}: недопустимое значение {value!r}"
+            return value, None
+
+        return name, check
+
+    def validate(self, data):
+        """Проверка разобранного JSON-ответа агента, возвращает VerdictRecord"""
+        if not isinstance(data, dict):
+            return VerdictRecord(valid=False, errors=("JSON не найден",))
+        values = {}
+        errors = []
+        for name, check in self._checks:
+            values[name], error = check(data)
+            if error:
+                errors.append(error)
+        return VerdictRecord(valid=not errors, errors=tuple(errors), **values)
+
+
+class ResultStore:
+    """Общая часть хранилищ результатов анализа (SQLite - Database, MySQL - MySQLResultStore).
+
+    Хранилище предоставляет методы, которые используют анализатор, меню и CLI:
+    save_log_analysis, save_log_analysis_batch, create_log_stats_session, update_log_stats,
+    get_stats_summary, get_recent_stats, get_log_analysis, get_verdict_counts, find_by_verdict,
+    search_log_analysis, iter_log_analysis_chunks, purge_run, apply_retention,
+    incremental_vacuum, get_database_size, convert_to_incremental_vacuum, close.
+    """
+
+    PARAM = "?"  # Маркер параметра в SQL-запросах драйвера
+    COMPRESS_RESPONSES = True  # Сжимать ответы агента перед записью
+    search_enabled = False
+
+    # Поля вердикта, извлекаемые из json_answer (JSON-функциями СУБД) в генерируемые столбцы.
+    # Агенты называют поля по-разному, поэтому берется первый непустой ключ из списка.
+    # Изменение списков требует новой миграции: выражения фиксируются в схеме.
+    VERDICT_FIELDS = {
+        'verdict_class': ['$.classification', '$.class', '$.level', '$.type', '$.status'],
+        'verdict_confidence': ['$.confidence', '$.similarity', '$.score'],
+        'verdict_match': ['$.matched_entry', '$.match', '$.kb_entry', '$.example'],
+    }
+
+    def parse_json_from_response(self, response_text, scanner=None):
+        """Первый JSON-объект ответа агента (dict) или None.
+
+        scanner - JSONObjectScanner, которому уже передан весь ответ по частям
+        при потоковом получении; иначе ответ сканируется здесь.
+        """
+        try:
+            if scanner is None:
+                scanner = JSONObjectScanner()
+                scanner.feed(response_text)
+            return scanner.parse()
+        except Exception as e:
+            logging.error(f"Ошибка при извлечении JSON из ответа: {e}")
+            return None
+
+    def extract_json_from_response(self, response_text, scanner=None):
+        """Извлечение первого JSON-объекта из ответа агента в виде компактной строки"""
+        parsed_json = self.parse_json_from_response(response_text, scanner)
+        if parsed_json is None:
+            return None
+        return json.dumps(parsed_json, ensure_ascii=False, separators=(',', ':'))
+
+    @staticmethod
+    def hash_log_text(log_text):
+        """Ключ строки лога в таблице log_lines"""
+        return hashlib.blake2b(log_text.encode('utf-8'), digest_size=16).digest()
+
+    @staticmethod
+    def compress_text(text):
+        """Сжатие текста ответа для хранения в response_z"""
+        return zlib.compress(text.encode('utf-8'), LOG_DB_COMPRESSION_LEVEL)
+
+    @staticmethod
+    def decompress_text(data):
+        """Распаковка текста, сжатого compress_text"""
+        if data is None:
+            return None
+        return zlib.decompress(data).decode('utf-8')
+
+    def prepare_log_analysis_row(self, agent_name, log_text, response, processing_time, run_id=None,
+                                 json_scanner=None, verdict_schema=None):
+        """Подготовка строки для пакетной записи (JSON, проверка вердикта, хэш и сжатие - в потоке обработки)"""
+        parsed_json = self.parse_json_from_response(response, json_scanner)
+        json_answer = None
+        if parsed_json is not None:
+            json_answer = json.dumps(parsed_json, ensure_ascii=False, separators=(',', ':'))
+        verdict = verdict_schema.validate(parsed_json) if verdict_schema else None
+        # Фиксируем время обработки сразу, а не в момент записи пакета
+        timestamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        return {
+            "agent_name": agent_name,
+            "log_hash": self.hash_log_text(log_text),
+            "log_text": log_text,
+            "response": response,
+            "response_z": self.compress_text(response) if self.COMPRESS_RESPONSES else None,
+            "json_answer": json_answer,
+            "processing_time": processing_time,
+            "timestamp": timestamp,
+            "run_id": run_id,
+            "verdict_valid": None if verdict is None else int(verdict.valid),
+            "verdict": verdict,
+        }
+
+    def _decode_log_analysis_row(self, row):
+        """Преобразование строки LOG_ANALYSIS_SELECT в словарь с исходными текстами"""
+        (analysis_id, agent_name, log_text, response, response_z, json_answer, processing_time,
+         timestamp, run_id, verdict_class, verdict_confidence, verdict_match, verdict_valid) = row[:13]
+        return {
+            "id": analysis_id,
+            "agent_name": agent_name,
+            "log_text": log_text,
+            "response": self.decompress_text(response_z) if response_z is not None else response,
+            "json_answer": json_answer,
+            "processing_time": processing_time,
+            "timestamp": timestamp,
+            "run_id": run_id,
+            "verdict_class": verdict_class,
+            "verdict_confidence": verdict_confidence,
+            "verdict_match": verdict_match,
+            "verdict_valid": verdict_valid,
+        }
+
+    @staticmethod
+    def to_db_timestamp(value):
+        """Приведение времени к формату столбца timestamp (UTC, 'YYYY-MM-DD HH:MM:SS')"""
+        if value is None or isinstance(value, str):
+            return value
+        if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+            value = datetime.datetime.combine(value, datetime.time())
+        # Время без часового пояса считается локальным
+        return value.astimezone(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+    @staticmethod
+    def _format_time(value):
+        """Время из драйвера (datetime) в строку того же вида, что хранит SQLite"""
+        if isinstance(value, datetime.datetime):
+            return value.isoformat(sep=" ")
+        return value
+
+    def _build_analysis_filters(self, run_id=None, agent_name=None, since=None, until=None,
+                                verdict=None, min_confidence=None):
+        """Условие WHERE и параметры для фильтрации log_analysis (псевдоним таблицы a)"""
+        conditions = []
+        params = []
+        if run_id is not None:
+            conditions.append(f"a.run_id = {self.PARAM}")
+            params.append(run_id)
+        if agent_name is not None:
+            conditions.append(f"a.agent_name = {self.PARAM}")
+            params.append(agent_name)
+        if since is not None:
+            conditions.append(f"a.timestamp >= {self.PARAM}")
+            params.append(self.to_db_timestamp(since))
+        if until is not None:
+            conditions.append(f"a.timestamp < {self.PARAM}")
+            params.append(self.to_db_timestamp(until))
+        if verdict is not None:
+            conditions.append(f"a.verdict_class = {self.PARAM}")
+            params.append(verdict.strip().upper())
+        if min_confidence is not None:
+            conditions.append(f"a.verdict_confidence >= {self.PARAM}")
+            params.append(min_confidence)
+        where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+        return where, params
+
+    # Результаты, которые может удалять политика хранения: строки выполняющейся
+    # сессии обработки еще пишет анализатор (purge_run не удаляет такую сессию целиком)
+    RETENTION_DELETABLE = "(a.run_id IS NULL OR a.run_id NOT IN (SELECT id FROM log_stats WHERE status = 'running'))"
+
+    # Измерения почасовой сводки log_rollup_hourly
+    ROLLUP_DIMENSIONS = ("bucket", "agent_name", "verdict_class", "run_id")
+
+    def get_rollup_stats(self, group_by=("agent_name",), since=None, until=None, agent_name=None, run_id=None):
+        """Число результатов, среднее время и уверенность из почасовых сводок (без просмотра log_analysis)"""
+        for column in group_by:
+            if column not in self.ROLLUP_DIMENSIONS:
+                raise ValueError(f"Неизвестное измерение сводки: {column}")
+        try:
+            conditions = []
+            params = []
+            if since is not None:
+                # Сводка почасовая: час, в который попадает since, включается целиком
+                conditions.append(f"bucket >= {self.PARAM}")
+                params.append(self.to_db_timestamp(since)[:13] + ":00:00")
+            if until is not None:
+                conditions.append(f"bucket < {self.PARAM}")
+                params.append(self.to_db_timestamp(until))
+            if agent_name is not None:
+                conditions.append(f"agent_name = {self.PARAM}")
+                params.append(agent_name)
+            if run_id is not None:
+                conditions.append(f"run_id = {self.PARAM}")
+                params.append(run_id)
+            where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+            columns = "".join(f"{column}, " for column in group_by)
+            group = (" GROUP BY " + ", ".join(group_by)) if group_by else ""
+            order = " ORDER BY bucket" if "bucket" in group_by else " ORDER BY SUM(result_count) DESC"
+
+            rows = self._fetchall(f"""
+                SELECT {columns}SUM(result_count), SUM(total_time), SUM(confidence_sum), SUM(confidence_count)
+                FROM log_rollup_hourly{where}{group}
+                HAVING SUM(result_count) > 0{order}
+            """, params)
+
+            result = []
+            for row in rows:
+                item = dict(zip(group_by, row))
+                if "bucket" in item:
+                    item["bucket"] = self._format_time(item["bucket"])
+                # В ключе сводки отсутствующие значения хранятся как '' и 0
+                if "verdict_class" in item:
+                    item["verdict_class"] = item["verdict_class"] or None
+                if "run_id" in item:
+                    item["run_id"] = item["run_id"] or None
+                count, total_time, confidence_sum, confidence_count = row[len(group_by):]
+                item["count"] = int(count)
+                item["avg_time"] = float(total_time or 0) / int(count)
+                item["avg_confidence"] = float(confidence_sum) / int(confidence_count) if confidence_count else None
+                result.append(item)
+            return result
+        except Exception as e:
+            logging.error(f"Ошибка при получении сводной статистики результатов: {e}")
+            return []
+
+    def get_agent_session_ids(self):
+        """ID сеансов агентов, созданных анализатором логов (None при ошибке)"""
+        try:
+            rows = self._fetchall("SELECT DISTINCT agent_session_id FROM log_stats WHERE agent_session_id IS NOT NULL")
+            return {row[0] for row in rows}
+        except Exception as e:
+            logging.error(f"Ошибка при получении сеансов анализатора логов: {e}")
+            return None
+
+
+class Database(ResultStore):
     """Класс для работы с базой данных SQLite"""
     
     def __init__(self, db_path=LOG_DB_PATH):
         """Инициализация подключения к базе данных"""
         self.db_path = db_path
-        self.conn = None
-        self.cursor = None
+        # Долгоживущие соединения: по одному на поток, открываются при первом обращении.
+        # Хранятся парами (поток, соединение), чтобы закрывать соединения завершившихся потоков
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
         self.init_database()
+
+    @property
+    def conn(self):
+        """Соединение текущего потока (None, если еще не открыто)"""
+        return getattr(self._local, 'conn', None)
+
+    @property
+    def cursor(self):
+        """Курсор соединения текущего потока"""
+        return getattr(self._local, 'cursor', None)
         
+    # Упорядоченный список миграций схемы: (версия, описание, метод).
+    # Номер последней примененной миграции хранится в PRAGMA user_version.
+    # Каждый шаг выполняется в своей транзакции и должен быть идемпотентным,
+    # т.к. базы, созданные до появления миграций, имеют user_version = 0.
+    # Новые шаги добавляются только в конец списка.
+    MIGRATIONS = [
+        (1, "базовые таблицы log_analysis и log_stats", "_migrate_base_tables"),
+        (2, "столбец json_answer", "_migrate_json_answer"),
+        (3, "столбец run_id, индексы и привязка старых результатов", "_migrate_run_id"),
+        (4, "дедупликация строк логов и сжатие ответов", "_migrate_compact_storage"),
+        (5, "индексируемые столбцы вердикта из json_answer", "_migrate_verdict_columns"),
+        (6, "полнотекстовый индекс FTS5 по строкам логов и ответам", "_migrate_search_index"),
+        (7, "индекс для удаления неиспользуемых строк логов", "_migrate_log_hash_index"),
+        (8, "почасовые сводки по агентам, вердиктам и сессиям", "_migrate_rollup_tables"),
+        (9, "признак соответствия ответа схеме вердикта", "_migrate_verdict_validation"),
+        (10, "ID сеанса агента в статистике обработки", "_migrate_agent_session_id"),
+        (11, "история чатов с агентами", "_migrate_chat_turns"),
+    ]
+
+
+    # Чтение результатов анализа независимо от формата хранения: новые записи хранят
+    # текст лога в log_lines, а ответ - сжатым в response_z; старые - в log_text/response
+    LOG_ANALYSIS_COLUMNS = '''
+        a.id, a.agent_name, COALESCE(l.text, a.log_text) AS log_text,
+        a.response, a.response_z, a.json_answer, a.processing_time, a.timestamp, a.run_id,
+        a.verdict_class, a.verdict_confidence, a.verdict_match, a.verdict_valid
+    '''
+    LOG_ANALYSIS_SELECT = f'''
+        SELECT {LOG_ANALYSIS_COLUMNS}
+        FROM log_analysis a
+        LEFT JOIN log_lines l ON l.hash = a.log_hash
+    '''
+
     def init_database(self):
-        """Создание таблиц базы данных, если они не существуют"""
+        """Создание базы данных и применение недостающих миграций схемы.
+
+        Сообщения выводятся в stderr: база открывается и командами, пишущими данные в stdout
+        (--send-file, --export -).
+        """
+        db_exists = os.path.exists(self.db_path)
+        self.search_enabled = False
+        self.chat_search_enabled = False
         try:
-            # Проверка существования файла базы данных
-            db_exists = os.path.exists(self.db_path)
-            
-            # Подключение к базе данных (будет создана, если не существует)
-            self.connect()
-            
-            # Включение внешних ключей для обеспечения целостности данных
-            self.cursor.execute("PRAGMA foreign_keys = ON;")
-            
-            # Создаем таблицу для хранения результатов анализа логов
+            self.migrate()
+            self.search_enabled = self._table_exists('log_analysis_fts')
+            self.chat_search_enabled = self._table_exists('chat_turns_fts')
+        except sqlite3.DatabaseError as e:
+            logging.error(f"Критическая ошибка при инициализации базы данных: {e}")
+            print(f"Критическая ошибка при инициализации базы данных: {e}", file=sys.stderr)
+
+            # Блокировки и нехватка места не означают повреждения файла - данные не трогаем
+            if isinstance(e, sqlite3.OperationalError) or not db_exists:
+                return
+
+            # Поврежденный файл сохраняем рядом и создаем базу заново
+            try:
+                self.close()
+                backup_path = f"{self.db_path}.corrupted-{datetime.datetime.now():%Y%m%d%H%M%S}"
+                print(f"Пытаемся пересоздать базу данных {self.db_path} (старый файл: {backup_path})...", file=sys.stderr)
+                os.replace(self.db_path, backup_path)
+                # Удаляем служебные файлы WAL, чтобы они не применились к новой базе
+                for suffix in ("-wal", "-shm"):
+                    if os.path.exists(self.db_path + suffix):
+                        os.remove(self.db_path + suffix)
+                self.migrate()
+                self.search_enabled = self._table_exists('log_analysis_fts')
+                self.chat_search_enabled = self._table_exists('chat_turns_fts')
+                logging.info("База данных успешно пересоздана.")
+                print("База данных успешно пересоздана.", file=sys.stderr)
+            except Exception as e2:
+                logging.error(f"Не удалось пересоздать базу данных: {e2}")
+                print(f"Не удалось пересоздать базу данных: {e2}", file=sys.stderr)
+            return
+
+        if not db_exists:
+            logging.info(f"База данных {self.db_path} создана и инициализирована.")
+            print(f"База данных {self.db_path} успешно создана.", file=sys.stderr)
+
+    def get_schema_version(self):
+        """Текущая версия схемы базы данных (PRAGMA user_version)"""
+        self.connect()
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self):
+        """Последовательное применение миграций, версия которых выше текущей"""
+        conn = self.connect()
+        for version, description, method_name in self.MIGRATIONS:
+            if self.get_schema_version() >= version:
+                continue
+
+            # BEGIN IMMEDIATE сразу берет блокировку записи, поэтому два процесса
+            # не применят одну миграцию одновременно; версию перепроверяем под блокировкой
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self.get_schema_version() >= version:
+                    conn.rollback()
+                    continue
+                logging.info(f"Применение миграции базы данных {version}: {description}")
+                getattr(self, method_name)()
+                # user_version меняется в той же транзакции, что и схема
+                conn.execute(f"PRAGMA user_version = {int(version)}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _get_columns(self, table):
+        """Список столбцов таблицы"""
+        self.cursor.execute(f"PRAGMA table_info({table})")
+        return [column[1] for column in self.cursor.fetchall()]
+
+    def _table_exists(self, name):
+        """Проверка наличия таблицы (в том числе виртуальной)"""
+        self.connect()
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+        return self.cursor.fetchone() is not None
+
+    def _get_columns_xinfo(self, table):
+        """Список столбцов таблицы, включая генерируемые"""
+        self.cursor.execute(f"PRAGMA table_xinfo({table})")
+        return [column[1] for column in self.cursor.fetchall()]
+
+    def _migrate_base_tables(self):
+        """Миграция 1: таблицы результатов анализа и статистики обработки"""
+        # Создаем таблицу для хранения результатов анализа логов
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS log_analysis (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                agent_name TEXT NOT NULL,
+                log_text TEXT NOT NULL,
+                response TEXT NOT NULL,
+                processing_time REAL NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Создаем таблицу для хранения статистики обработки
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS log_stats (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                start_time DATETIME NOT NULL,
+                end_time DATETIME,
+                total_logs INTEGER NOT NULL,
+                processed_logs INTEGER NOT NULL,
+                successful_logs INTEGER NOT NULL,
+                failed_logs INTEGER NOT NULL,
+                average_time REAL,
+                status TEXT NOT NULL
+            )
+        ''')
+
+    def _migrate_json_answer(self):
+        """Миграция 2: JSON, извлеченный из ответа агента"""
+        if 'json_answer' not in self._get_columns('log_analysis'):
+            self.cursor.execute("ALTER TABLE log_analysis ADD COLUMN json_answer TEXT")
+
+    def _migrate_run_id(self):
+        """Миграция 3: связь результатов с сессией обработки (log_stats) и индексы"""
+        if 'run_id' not in self._get_columns('log_analysis'):
+            self.cursor.execute("ALTER TABLE log_analysis ADD COLUMN run_id INTEGER REFERENCES log_stats(id)")
+            # Привязка старых результатов без run_id к сессиям обработки по времени записи.
+            # start_time/end_time хранятся в локальном времени (isoformat), timestamp - в UTC
+            # (CURRENT_TIMESTAMP), поэтому сравниваем через julianday с переводом в UTC.
+            # timestamp усечен до секунды, поэтому и start_time сравнивается без долей секунды:
+            # иначе результаты первой секунды сессии остались бы без нее.
+            # Результат относится к последней сессии, начавшейся до него и не завершившейся раньше.
             self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS log_analysis (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    agent_name TEXT NOT NULL,
-                    log_text TEXT NOT NULL,
-                    response TEXT NOT NULL,
-                    json_answer TEXT,
-                    processing_time REAL NOT NULL,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                UPDATE log_analysis
+                SET run_id = (
+                    SELECT s.id FROM log_stats s
+                    WHERE julianday(strftime('%Y-%m-%d %H:%M:%S', s.start_time), 'utc') <= julianday(log_analysis.timestamp)
+                      AND (s.end_time IS NULL OR julianday(s.end_time, 'utc') >= julianday(log_analysis.timestamp))
+                    ORDER BY s.start_time DESC
+                    LIMIT 1
                 )
+                WHERE run_id IS NULL
             ''')
-            
-            # Проверяем, существует ли столбец json_answer в существующей таблице
-            if db_exists:
-                self.cursor.execute("PRAGMA table_info(log_analysis)")
-                columns = [column[1] for column in self.cursor.fetchall()]
-                
-                if 'json_answer' not in columns:
-                    print("Обновление структуры базы данных: добавление столбца json_answer...")
-                    self.cursor.execute("ALTER TABLE log_analysis ADD COLUMN json_answer TEXT")
-                    print("Столбец json_answer успешно добавлен в существующую базу данных.")
-            
-            # Создаем таблицу для хранения статистики обработки
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS log_stats (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    start_time DATETIME NOT NULL,
-                    end_time DATETIME,
-                    total_logs INTEGER NOT NULL,
-                    processed_logs INTEGER NOT NULL,
-                    successful_logs INTEGER NOT NULL,
-                    failed_logs INTEGER NOT NULL,
-                    average_time REAL,
-                    status TEXT NOT NULL
+
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_log_analysis_run_id ON log_analysis(run_id)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_log_analysis_timestamp ON log_analysis(timestamp)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_log_analysis_agent_name ON log_analysis(agent_name)")
+
+    def _migrate_compact_storage(self):
+        """Миграция 4: общая таблица строк логов и столбцы для компактного хранения"""
+        # Строка лога хранится один раз и адресуется хэшем содержимого
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS log_lines (
+                hash BLOB PRIMARY KEY,
+                text TEXT NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        # Старые записи не переписываются: log_text/response остаются заполненными,
+        # а новые записи оставляют их пустыми и используют log_hash/response_z
+        columns = self._get_columns('log_analysis')
+        if 'log_hash' not in columns:
+            self.cursor.execute("ALTER TABLE log_analysis ADD COLUMN log_hash BLOB REFERENCES log_lines(hash)")
+        if 'response_z' not in columns:
+            self.cursor.execute("ALTER TABLE log_analysis ADD COLUMN response_z BLOB")
+
+    def _verdict_expression(self, column):
+        """SQL-выражение генерируемого столбца вердикта"""
+        paths = self.VERDICT_FIELDS[column]
+        value = "COALESCE(" + ", ".join(f"json_extract(json_answer, '{path}')" for path in paths) + ")"
+        if column == 'verdict_class':
+            value = f"UPPER(TRIM({value}))"
+        elif column == 'verdict_confidence':
+            value = f"CAST({value} AS REAL)"
+        # json_valid защищает вставку от ошибки json_extract на поврежденном JSON
+        return f"CASE WHEN json_valid(json_answer) THEN {value} END"
+
+    def _migrate_verdict_columns(self):
+        """Миграция 5: столбцы вердикта (VIRTUAL - вычисляются из json_answer без перезаписи таблицы)"""
+        columns = self._get_columns_xinfo('log_analysis')
+        for column, column_type in (('verdict_class', 'TEXT'), ('verdict_confidence', 'REAL'), ('verdict_match', 'TEXT')):
+            if column not in columns:
+                self.cursor.execute(
+                    f"ALTER TABLE log_analysis ADD COLUMN {column} {column_type} "
+                    f"GENERATED ALWAYS AS ({self._verdict_expression(column)}) VIRTUAL"
                 )
-            ''')
-            
-            # Сохраняем изменения
-            self.conn.commit()
-            
-            # Проверяем, были ли таблицы созданы успешно
-            self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name IN ('log_analysis', 'log_stats')")
-            tables = self.cursor.fetchall()
-            
-            if len(tables) < 2:
-                logging.error("Не все таблицы были успешно созданы. Проверьте права доступа к базе данных.")
-                print(f"Ошибка: не все таблицы были созданы в базе данных {self.db_path}")
-                
-            if not db_exists:
-                logging.info(f"База данных {self.db_path} создана и инициализирована.")
-                print(f"База данных {self.db_path} успешно создана.")
-                
-        except Exception as e:
-            logging.error(f"Критическая ошибка при инициализации базы данных: {e}")
-            print(f"Критическая ошибка при инициализации базы данных: {e}")
-            
-            # Пробуем удалить файл базы, если он существует, но поврежден
-            if os.path.exists(self.db_path):
-                try:
-                    self.disconnect()
-                    print(f"Пытаемся пересоздать базу данных {self.db_path}...")
-                    os.remove(self.db_path)
-                    # Повторная инициализация базы
-                    self.connect()
-                    
-                    # Создаем таблицы заново
-                    self.cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS log_analysis (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            agent_name TEXT NOT NULL,
-                            log_text TEXT NOT NULL,
-                            response TEXT NOT NULL,
-                            json_answer TEXT,
-                            processing_time REAL NOT NULL,
-                            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                        )
-                    ''')
-                    
-                    self.cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS log_stats (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            start_time DATETIME NOT NULL,
-                            end_time DATETIME,
-                            total_logs INTEGER NOT NULL,
-                            processed_logs INTEGER NOT NULL,
-                            successful_logs INTEGER NOT NULL,
-                            failed_logs INTEGER NOT NULL,
-                            average_time REAL,
-                            status TEXT NOT NULL
-                        )
-                    ''')
-                    
-                    self.conn.commit()
-                    logging.info("База данных успешно пересоздана.")
-                    print("База данных успешно пересоздана.")
-                    
-                except Exception as e2:
-                    logging.error(f"Не удалось пересоздать базу данных: {e2}")
-                    print(f"Не удалось пересоздать базу данных: {e2}")
-        finally:
-            self.disconnect()    
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_log_analysis_verdict ON log_analysis(verdict_class, timestamp)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_log_analysis_agent_verdict ON log_analysis(agent_name, verdict_class, timestamp)")
+
+    def _migrate_search_index(self):
+        """Миграция 6: полнотекстовый индекс по строке лога и ответу агента"""
+        self.cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not self.cursor.fetchone()[0]:
+            logging.warning("SQLite собран без FTS5: полнотекстовый поиск будет выполняться через LIKE")
+            return
+        # content='' - индекс без копии текстов: тексты уже хранятся (сжатыми) в log_analysis,
+        # а rowid индекса совпадает с log_analysis.id
+        self.cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS log_analysis_fts USING fts5(
+                log_text, response,
+                content='',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+        # Индексация уже сохраненных результатов (xrm_decompress регистрируется в connect)
+        self.cursor.execute('''
+            INSERT INTO log_analysis_fts (rowid, log_text, response)
+            SELECT a.id, COALESCE(l.text, a.log_text),
+                   CASE WHEN a.response_z IS NULL THEN a.response ELSE xrm_decompress(a.response_z) END
+            FROM log_analysis a
+            LEFT JOIN log_lines l ON l.hash = a.log_hash
+            WHERE a.id NOT IN (SELECT rowid FROM log_analysis_fts)
+        ''')
+
+    def _migrate_log_hash_index(self):
+        """Миграция 7: индекс log_hash для поиска строк log_lines, на которые больше нет ссылок"""
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_log_analysis_log_hash ON log_analysis(log_hash)")
+
+    def _migrate_rollup_tables(self):
+        """Миграция 8: почасовая сводка результатов (час x агент x вердикт x сессия)"""
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS log_rollup_hourly (
+                bucket TEXT NOT NULL,
+                agent_name TEXT NOT NULL,
+                verdict_class TEXT NOT NULL DEFAULT '',
+                run_id INTEGER NOT NULL DEFAULT 0,
+                result_count INTEGER NOT NULL DEFAULT 0,
+                total_time REAL NOT NULL DEFAULT 0,
+                confidence_sum REAL NOT NULL DEFAULT 0,
+                confidence_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, agent_name, verdict_class, run_id)
+            ) WITHOUT ROWID
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_log_rollup_agent ON log_rollup_hourly(agent_name, bucket)")
+        # Пересчет с нуля, чтобы повторный запуск миграции не удвоил счетчики
+        self.cursor.execute("DELETE FROM log_rollup_hourly")
+        self._update_rollup("1 = 1", ())
+
+    def _migrate_verdict_validation(self):
+        """Миграция 9: признак проверки вердикта по схеме и счетчик ответов, не прошедших проверку"""
+        if 'verdict_valid' not in self._get_columns_xinfo('log_analysis'):
+            self.cursor.execute("ALTER TABLE log_analysis ADD COLUMN verdict_valid INTEGER")
+        if 'invalid_logs' not in self._get_columns('log_stats'):
+            self.cursor.execute("ALTER TABLE log_stats ADD COLUMN invalid_logs INTEGER NOT NULL DEFAULT 0")
+
+    def _migrate_agent_session_id(self):
+        """Миграция 10: сеанс агента, в котором шла обработка (для очистки сеансов анализатора)"""
+        if 'agent_session_id' not in self._get_columns('log_stats'):
+            self.cursor.execute("ALTER TABLE log_stats ADD COLUMN agent_session_id TEXT")
+
+    def _migrate_chat_turns(self):
+        """Миграция 11: история чатов с агентами (вопросы и ответы по сеансам)"""
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chat_turns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                agent_id TEXT,
+                agent_name TEXT,
+                turn INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at DATETIME NOT NULL,
+                first_chunk_time REAL,
+                total_time REAL,
+                references_json TEXT
+            )
+        ''')
+        # Индекс по session_id упорядочен по rowid - постраничное чтение сеанса идет по нему
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_turns_session ON chat_turns(session_id)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_turns_created_at ON chat_turns(created_at)")
+
+        self.cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not self.cursor.fetchone()[0]:
+            return
+        # Тексты ходов короткие и хранятся несжатыми, поэтому индекс использует их как внешний контент
+        self.cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS chat_turns_fts USING fts5(
+                content,
+                content='chat_turns', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS chat_turns_fts_insert AFTER INSERT ON chat_turns BEGIN
+                INSERT INTO chat_turns_fts (rowid, content) VALUES (new.id, new.content);
+            END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS chat_turns_fts_delete AFTER DELETE ON chat_turns BEGIN
+                INSERT INTO chat_turns_fts (chat_turns_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            END
+        ''')
+        self.cursor.execute("INSERT INTO chat_turns_fts (chat_turns_fts) VALUES ('rebuild')")
+
+    def _update_rollup(self, where, params, sign=1):
+        """Добавление (sign=1) или вычитание (sign=-1) строк log_analysis из почасовой сводки.
+
+        Вызывается в транзакции вставки или удаления строк, поэтому сводка
+        всегда согласована с таблицей; агрегирование идет по всему пакету сразу.
+        """
+        op = "+" if sign > 0 else "-"
+        self.cursor.execute(f'''
+            INSERT INTO log_rollup_hourly (bucket, agent_name, verdict_class, run_id,
+                                           result_count, total_time, confidence_sum, confidence_count)
+            SELECT strftime('%Y-%m-%d %H:00:00', timestamp), agent_name,
+                   COALESCE(verdict_class, ''), COALESCE(run_id, 0),
+                   {op}COUNT(*), {op}TOTAL(processing_time), {op}TOTAL(verdict_confidence), {op}COUNT(verdict_confidence)
+            FROM log_analysis
+            WHERE {where}
+            GROUP BY 1, 2, 3, 4
+            ON CONFLICT (bucket, agent_name, verdict_class, run_id) DO UPDATE SET
+                result_count = result_count + excluded.result_count,
+                total_time = total_time + excluded.total_time,
+                confidence_sum = confidence_sum + excluded.confidence_sum,
+                confidence_count = confidence_count + excluded.confidence_count
+        ''', list(params))
+        if sign < 0:
+            self.cursor.execute("DELETE FROM log_rollup_hourly WHERE result_count <= 0")
+
+    def _fetchall(self, query, params=()):
+        """Выполнение запроса на чтение и получение всех строк"""
+        self.connect()
+        return self.cursor.execute(query, params).fetchall()
+
     def connect(self):
-        """Установка соединения с базой данных"""
-        self.conn = sqlite3.connect(self.db_path)
-        self.cursor = self.conn.cursor()
-    
-    def disconnect(self):
-        """Закрытие соединения с базой данных"""
-        if self.conn:
-            self.conn.close()
-            self.conn = None
-            self.cursor = None
-    
-    def extract_json_from_response(self, response_text):
-        """Извлечение JSON из ответа агента с использованием регулярных выражений"""
+        """Получение соединения текущего потока (открывается один раз и переиспользуется)"""
+        conn = self.conn
+        if conn is not None:
+            return conn
+
+        register_sqlite_adapters()
+        # check_same_thread=False нужен только для закрытия всех соединений из close();
+        # каждое соединение используется исключительно своим потоком
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=LOG_DB_BUSY_TIMEOUT,
+            check_same_thread=False,
+            cached_statements=LOG_DB_STATEMENT_CACHE
+        )
+        # auto_vacuum применяется только к новой (пустой) базе, поэтому задается до всего остального;
+        # существующую базу переводит convert_to_incremental_vacuum()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+        conn.execute(f"PRAGMA journal_mode = {LOG_DB_JOURNAL_MODE};")
+        conn.execute(f"PRAGMA synchronous = {LOG_DB_SYNCHRONOUS};")
+        conn.execute(f"PRAGMA cache_size = {-int(LOG_DB_CACHE_SIZE_KB)};")
+        conn.execute("PRAGMA temp_store = MEMORY;")
+        conn.execute("PRAGMA foreign_keys = ON;")
+        # Распаковка response_z в SQL (индексация и удаление из полнотекстового индекса)
+        conn.create_function("xrm_decompress", 1, self.decompress_text, deterministic=True)
+
+        self._local.conn = conn
+        self._local.cursor = conn.cursor()
+        with self._connections_lock:
+            orphaned = [c for thread, c in self._connections if not thread.is_alive()]
+            self._connections = [(thread, c) for thread, c in self._connections if thread.is_alive()]
+            self._connections.append((threading.current_thread(), conn))
+        # Потоки, завершившиеся без disconnect(), не должны удерживать файлы базы
+        for orphan in orphaned:
+            try:
+                orphan.close()
+            except Exception as e:
+                logging.error(f"Ошибка при закрытии соединения с базой данных: {e}")
+        return conn
+
+    def disconnect(self):
+        """Закрытие соединения текущего потока"""
+        conn = self.conn
+        if conn:
+            with self._connections_lock:
+                self._connections = [(thread, c) for thread, c in self._connections if c is not conn]
+            conn.close()
+            self._local.conn = None
+            self._local.cursor = None
+
+    def close(self):
+        """Закрытие всех открытых соединений (при завершении работы)"""
+        with self._connections_lock:
+            connections = [conn for _, conn in self._connections]
+            self._connections = []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                logging.error(f"Ошибка при закрытии соединения с базой данных: {e}")
+        self._local = threading.local()
+
+    def _rollback(self):
+        """Откат незавершенной транзакции соединения текущего потока"""
         try:
-            # Поиск JSON-объектов в тексте ответа
-            # Ищем паттерн типа {"ключ": значение, ...}
-            json_pattern = r'\{[^{}]*(?:"[^"]*"\s*:\s*[^,}]+[,}])+[^{}]*\}'
-            
-            matches = re.findall(json_pattern, response_text)
-            
-            if matches:
-                # Пытаемся распарсить найденные JSON
-                for match in matches:
-                    try:
-                        # Проверяем, является ли найденная строка валидным JSON
-                        parsed_json = json.loads(match)
-                        # Возвращаем первый успешно распарсенный JSON как строку
-                        return json.dumps(parsed_json, ensure_ascii=False, indent=2)
-                    except json.JSONDecodeError:
-                        continue
-            
-            # Если стандартный поиск не дал результатов, попробуем более широкий поиск
-            # Ищем любые фигурные скобки, которые могут содержать JSON
-            broader_pattern = r'\{[^{}]*\}'
-            broader_matches = re.findall(broader_pattern, response_text)
-            
-            for match in broader_matches:
-                try:
-                    parsed_json = json.loads(match)
-                    return json.dumps(parsed_json, ensure_ascii=False, indent=2)
-                except json.JSONDecodeError:
-                    continue
-            
-            # Если JSON не найден, возвращаем None
-            return None
-            
-        except Exception as e:
-            logging.error(f"Ошибка при извлечении JSON из ответа: {e}")
-            return None
+            if self.conn:
+                self.conn.rollback()
+        except Exception:
+            pass
     
-    def save_log_analysis(self, agent_name, log_text, response, processing_time):
+    def save_log_analysis(self, agent_name, log_text, response, processing_time, run_id=None):
         """Сохранение результата анализа лога в базу данных"""
         try:
             self.connect()
             
             # Извлекаем JSON из ответа агента
-            json_answer = self.extract_json_from_response(response)
+            row = self.prepare_log_analysis_row(agent_name, log_text, response, processing_time, run_id)
+            json_answer = row["json_answer"]
             
-            self.cursor.execute(
-                "INSERT INTO log_analysis (agent_name, log_text, response, json_answer, processing_time) VALUES (?, ?, ?, ?, ?)",
-                (agent_name, log_text, response, json_answer, processing_time)
-            )
+            analysis_id = self._insert_log_analysis_rows([row])
             self.conn.commit()
-              # Логируем информацию о найденном JSON
+            # Логируем информацию о найденном JSON
             if json_answer:
                 logging.info(f"JSON извлечен из ответа агента: {json_answer[:100]}...")
             else:
                 logging.info("JSON не найден в ответе агента")
             
-            return self.cursor.lastrowid
+            return analysis_id
         except Exception as e:
+            self._rollback()
             logging.error(f"Ошибка при сохранении анализа лога: {e}")
             return None
-        finally:
-            self.disconnect()
+
+    def _insert_log_analysis_rows(self, rows):
+        """Вставка подготовленных строк в текущую транзакцию, возвращает ID последней строки"""
+        self.cursor.executemany(
+            "INSERT OR IGNORE INTO log_lines (hash, text) VALUES (:log_hash, :log_text)",
+            rows
+        )
+        self.cursor.executemany(
+            "INSERT INTO log_analysis (agent_name, log_text, response, log_hash, response_z, json_answer, processing_time, timestamp, run_id, verdict_valid) "
+            "VALUES (:agent_name, '', '', :log_hash, :response_z, :json_answer, :processing_time, :timestamp, :run_id, :verdict_valid)",
+            rows
+        )
+        last_id = self.cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+        # Транзакция держит блокировку записи с первой вставки, поэтому ID пакета идут подряд
+        first_id = last_id - len(rows) + 1
+        self._update_rollup("id BETWEEN ? AND ?", (first_id, last_id))
+
+        if self.search_enabled:
+            self.cursor.executemany(
+                "INSERT INTO log_analysis_fts (rowid, log_text, response) VALUES (?, ?, ?)",
+                [(first_id + idx, row["log_text"], row["response"]) for idx, row in enumerate(rows)]
+            )
+        return last_id
+
+    def get_log_analysis(self, analysis_id):
+        """Получение результата анализа по ID с распакованными текстами"""
+        try:
+            self.connect()
+            self.cursor.execute(self.LOG_ANALYSIS_SELECT + " WHERE a.id = ?", (analysis_id,))
+            row = self.cursor.fetchone()
+            return self._decode_log_analysis_row(row) if row else None
+        except Exception as e:
+            logging.error(f"Ошибка при получении результата анализа: {e}")
+            return None
+
+    def save_log_analysis_batch(self, rows):
+        """Пакетное сохранение результатов анализа одной транзакцией"""
+        if not rows:
+            return 0
+        try:
+            self.connect()
+            self._insert_log_analysis_rows(rows)
+            self.conn.commit()
+            return len(rows)
+        except Exception as e:
+            self._rollback()
+            logging.error(f"Ошибка при пакетном сохранении анализа логов: {e}")
+            return 0
     
-    def create_log_stats_session(self, total_logs):
+    def create_log_stats_session(self, total_logs, agent_session_id=None):
         """Создание записи о новой сессии обработки логов"""
         try:
             self.connect()
             self.cursor.execute(
-                "INSERT INTO log_stats (start_time, total_logs, processed_logs, successful_logs, failed_logs, status) VALUES (?, ?, ?, ?, ?, ?)",
-                (datetime.datetime.now(), total_logs, 0, 0, 0, "running")
+                "INSERT INTO log_stats (start_time, total_logs, processed_logs, successful_logs, failed_logs, status, agent_session_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (datetime.datetime.now(), total_logs, 0, 0, 0, "running", agent_session_id)
             )
             self.conn.commit()
             return self.cursor.lastrowid
+        except Exception as e:
+            self._rollback()
+            logging.error(f"Ошибка при создании записи статистики: {e}")
+            return None
+    
+    def update_log_stats(self, stats_id, processed=0, successful=0, failed=0, status=None, invalid=0):
+        """Обновление статистики обработки логов (счетчики увеличиваются атомарно на стороне БД)"""
+        try:
+            self.connect()
+            
+            if status == "completed":
+                # Финализация статистики при завершении
+                end_time = datetime.datetime.now()
+                
+                # Расчет среднего времени обработки
+                self.cursor.execute(
+                    "SELECT AVG(processing_time) FROM log_analysis WHERE run_id = ?",
+                    (stats_id,)
+                )
+                avg_time = self.cursor.fetchone()[0] or 0
+                
+                self.cursor.execute(
+                    "UPDATE log_stats SET processed_logs = processed_logs + ?, successful_logs = successful_logs + ?, failed_logs = failed_logs + ?, invalid_logs = invalid_logs + ?, end_time = ?, average_time = ?, status = ? WHERE id = ?",
+                    (processed, successful, failed, invalid, end_time, avg_time, status, stats_id)
+                )
+            else:
+                # Обновление текущей статистики и, при необходимости, статуса
+                self.cursor.execute(
+                    "UPDATE log_stats SET processed_logs = processed_logs + ?, successful_logs = successful_logs + ?, failed_logs = failed_logs + ?, invalid_logs = invalid_logs + ?, status = COALESCE(?, status) WHERE id = ?",
+                    (processed, successful, failed, invalid, status, stats_id)
+                )
+            
+            updated = self.cursor.rowcount > 0
+            self.conn.commit()
+            return updated
+        except Exception as e:
+            self._rollback()
+            logging.error(f"Ошибка при обновлении статистики: {e}")
+            return False
+    
+    def get_stats_summary(self):
+        """Получение сводной статистики обработки логов"""
+        try:
+            self.connect()
+            self.cursor.execute("""
+                SELECT COUNT(*) as total_sessions, 
+                       SUM(total_logs) as total_logs,
+                       SUM(processed_logs) as processed_logs,
+                       SUM(successful_logs) as successful_logs,
+                       SUM(failed_logs) as failed_logs,
+                       AVG(average_time) as avg_time,
+                       SUM(invalid_logs) as invalid_logs
+                FROM log_stats
+            """)
+            result = self.cursor.fetchone()
+            if not result:
+                return None
+                
+            return {
+                "total_sessions": result[0],
+                "total_logs": result[1] or 0,
+                "processed_logs": result[2] or 0,
+                "successful_logs": result[3] or 0,
+                "failed_logs": result[4] or 0,
+                "avg_time": result[5] or 0,
+                "invalid_logs": result[6] or 0
+            }
+        except Exception as e:
+            logging.error(f"Ошибка при получении сводной статистики: {e}")
+            return None
+    
+    def get_recent_stats(self, limit=5):
+        """Получение последних сессий обработки логов"""
+        try:
+            self.connect()
+            self.cursor.execute("""
+                SELECT id, start_time, end_time, total_logs, processed_logs, 
+                       successful_logs, failed_logs, average_time, status, invalid_logs
+                FROM log_stats
+                ORDER BY start_time DESC
+                LIMIT ?
+            """, (limit,))
+            
+            rows = self.cursor.fetchall()
+            if not rows:
+                return []
+                
+            stats = []
+            for row in rows:
+                stats.append({
+                    "id": row[0],
+                    "start_time": row[1],
+                    "end_time": row[2],
+                    "total_logs": row[3],
+                    "processed_logs": row[4],
+                    "successful_logs": row[5],
+                    "failed_logs": row[6],
+                    "average_time": row[7] or 0,
+                    "status": row[8],
+                    "invalid_logs": row[9]
+                })
+            
+            return stats
+        except Exception as e:
+            logging.error(f"Ошибка при получении последней статистики: {e}")
+            return []
+
+    def get_verdict_counts(self, run_id=None, agent_name=None, since=None, until=None, by_agent=False):
+        """Количество результатов по вердиктам (и агентам) со средней уверенностью"""
+        try:
+            self.connect()
+            where, params = self._build_analysis_filters(run_id, agent_name, since, until)
+            group_columns = "a.agent_name, a.verdict_class" if by_agent else "a.verdict_class"
+            self.cursor.execute(f"""
+                SELECT {group_columns}, COUNT(*), AVG(a.verdict_confidence)
+                FROM log_analysis a{where}
+                GROUP BY {group_columns}
+                ORDER BY COUNT(*) DESC
+            """, params)
+
+            result = []
+            for row in self.cursor.fetchall():
+                if by_agent:
+                    agent, verdict, count, avg_confidence = row
+                else:
+                    agent = agent_name
+                    verdict, count, avg_confidence = row
+                result.append({
+                    "agent_name": agent,
+                    "verdict": verdict,
+                    "count": count,
+                    "avg_confidence": avg_confidence
+                })
+            return result
+        except Exception as e:
+            logging.error(f"Ошибка при получении статистики вердиктов: {e}")
+            return []
+
+    def find_by_verdict(self, verdict, run_id=None, agent_name=None, since=None, until=None,
+                        min_confidence=None, limit=100):
+        """Результаты анализа с заданным вердиктом, начиная с самых новых"""
+        try:
+            self.connect()
+            where, params = self._build_analysis_filters(
+                run_id, agent_name, since, until, verdict=verdict, min_confidence=min_confidence
+            )
+            self.cursor.execute(
+                self.LOG_ANALYSIS_SELECT + where + " ORDER BY a.timestamp DESC LIMIT ?",
+                params + [limit]
+            )
+            return [self._decode_log_analysis_row(row) for row in self.cursor.fetchall()]
+        except Exception as e:
+            logging.error(f"Ошибка при поиске результатов по вердикту: {e}")
+            return []
+
+    @staticmethod
+    def build_search_query(text):
+        """Преобразование пользовательского текста в запрос FTS5: все слова, как фразы"""
+        terms = text.split()
+        return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+    def search_log_analysis(self, text, run_id=None, agent_name=None, since=None, until=None,
+                            limit=50, raw_query=False):
+        """Полнотекстовый поиск по строкам логов и ответам агента, лучшие совпадения первыми"""
+        try:
+            self.connect()
+            where, params = self._build_analysis_filters(run_id, agent_name, since, until)
+
+            if not self.search_enabled:
+                # Без FTS5 остается только полный просмотр таблицы через LIKE
+                condition = "(COALESCE(l.text, a.log_text) LIKE ? OR a.response LIKE ? OR xrm_decompress(a.response_z) LIKE ?)"
+                pattern = f"%{text}%"
+                where = (where + " AND " if where else " WHERE ") + condition
+                self.cursor.execute(
+                    self.LOG_ANALYSIS_SELECT + where + " ORDER BY a.timestamp DESC LIMIT ?",
+                    params + [pattern, pattern, pattern, limit]
+                )
+                return [self._decode_log_analysis_row(row) for row in self.cursor.fetchall()]
+
+            match = text if raw_query else self.build_search_query(text)
+            if not match:
+                return []
+            where = (where + " AND " if where else " WHERE ") + "log_analysis_fts MATCH ?"
+            self.cursor.execute(f"""
+                SELECT {self.LOG_ANALYSIS_COLUMNS}, bm25(log_analysis_fts) AS rank
+                FROM log_analysis_fts
+                JOIN log_analysis a ON a.id = log_analysis_fts.rowid
+                LEFT JOIN log_lines l ON l.hash = a.log_hash{where}
+                ORDER BY rank
+                LIMIT ?
+            """, params + [match, limit])
+
+            results = []
+            for row in self.cursor.fetchall():
+                result = self._decode_log_analysis_row(row)
+                result["rank"] = row[13]
+                results.append(result)
+            return results
+        except Exception as e:
+            logging.error(f"Ошибка при полнотекстовом поиске: {e}")
+            return []
+
+    def iter_log_analysis_chunks(self, run_id=None, agent_name=None, since=None, until=None,
+                                 chunk_size=None):
+        """Постраничное чтение результатов анализа в порядке ID (память не зависит от размера таблицы)"""
+        chunk_size = chunk_size or LOG_EXPORT_CHUNK_SIZE
+        self.connect()
+        where, params = self._build_analysis_filters(run_id, agent_name, since, until)
+        where = (where + " AND " if where else " WHERE ") + "a.id > ?"
+        query = self.LOG_ANALYSIS_SELECT + where + " ORDER BY a.id LIMIT ?"
+
+        # Продолжение по последнему ID вместо одного долгого курсора: каждая порция -
+        # короткое чтение, которое не мешает контрольным точкам WAL и записи
+        last_id = 0
+        while True:
+            self.cursor.execute(query, params + [last_id, chunk_size])
+            rows = self.cursor.fetchall()
+            if not rows:
+                break
+            yield [self._decode_log_analysis_row(row) for row in rows]
+            last_id = rows[-1][0]
+            if len(rows) < chunk_size:
+                break
+
+    # История чатов с агентами (только SQLite: хранится в той же базе и при LOG_DB_BACKEND = "mysql")
+    CHAT_TURN_COLUMNS = (
+        "id, session_id, agent_id, agent_name, turn, role, content, created_at, "
+        "first_chunk_time, total_time, references_json"
+    )
+
+    def _decode_chat_turn(self, row):
+        """Строка chat_turns в словарь"""
+        references = []
+        if row[10]:
+            try:
+                references = json.loads(row[10])
+            except json.JSONDecodeError:
+                pass
+        return {
+            "id": row[0],
+            "session_id": row[1],
+            "agent_id": row[2],
+            "agent_name": row[3],
+            "turn": row[4],
+            "role": row[5],
+            "content": row[6],
+            "created_at": self._format_time(row[7]),
+            "first_chunk_time": row[8],
+            "total_time": row[9],
+            "references": references,
+        }
+
+    def add_chat_turn(self, session_id, agent_id, agent_name, question, answer,
+                      first_chunk_time=None, total_time=None, references=None):
+        """Сохранение вопроса и ответа агента как очередного хода сеанса; возвращает номер хода"""
+        try:
+            self.connect()
+            now = datetime.datetime.now()
+            # Номер хода вычисляется в той же транзакции, что и вставка: параллельные
+            # записи в один сеанс не получат одинаковый номер
+            self.cursor.execute('''
+                INSERT INTO chat_turns (session_id, agent_id, agent_name, turn, role, content, created_at)
+                SELECT ?, ?, ?, COALESCE(MAX(turn), 0) + 1, 'user', ?, ?
+                FROM chat_turns WHERE session_id = ?
+            ''', (session_id, agent_id, agent_name, question, now, session_id))
+            self.cursor.execute("SELECT turn FROM chat_turns WHERE id = ?", (self.cursor.lastrowid,))
+            turn = self.cursor.fetchone()[0]
+            self.cursor.execute('''
+                INSERT INTO chat_turns (session_id, agent_id, agent_name, turn, role, content, created_at,
+                                        first_chunk_time, total_time, references_json)
+                VALUES (?, ?, ?, ?, 'assistant', ?, ?, ?, ?, ?)
+            ''', (
+                session_id, agent_id, agent_name, turn, answer, now, first_chunk_time, total_time,
+                json.dumps(references, ensure_ascii=False) if references else None
+            ))
+            self.conn.commit()
+            return turn
+        except Exception as e:
+            self._rollback()
+            logging.error(f"Ошибка при сохранении истории чата: {e}")
+            return None
+
+    def get_chat_sessions(self, limit=None, offset=0):
+        """Сеансы из истории чатов, последние первыми: ID, агент, число ходов, время, первый вопрос"""
+        limit = limit or CHAT_HISTORY_PAGE_SIZE
+        try:
+            rows = self._fetchall('''
+                SELECT s.session_id, s.agent_name, s.turns, s.started, s.last_activity,
+                       (SELECT content FROM chat_turns c
+                        WHERE c.session_id = s.session_id AND c.role = 'user'
+                        ORDER BY c.id LIMIT 1)
+                FROM (
+                    SELECT session_id, MAX(agent_name) AS agent_name, MAX(turn) AS turns,
+                           MIN(created_at) AS started, MAX(created_at) AS last_activity
+                    FROM chat_turns
+                    GROUP BY session_id
+                ) s
+                ORDER BY s.last_activity DESC
+                LIMIT ? OFFSET ?
+            ''', (limit, offset))
+            return [
+                {
+                    "session_id": row[0],
+                    "agent_name": row[1],
+                    "turns": row[2],
+                    "started": self._format_time(row[3]),
+                    "last_activity": self._format_time(row[4]),
+                    "first_question": row[5],
+                }
+                for row in rows
+            ]
+        except Exception as e:
+            logging.error(f"Ошибка при получении списка сеансов из истории чатов: {e}")
+            return []
+
+    def iter_chat_turns(self, session_id, page_size=None):
+        """Постраничное чтение истории сеанса: каждая страница загружается по мере перебора"""
+        page_size = page_size or CHAT_HISTORY_PAGE_SIZE
+        last_id = 0
+        while True:
+            rows = self._fetchall(
+                f"SELECT {self.CHAT_TURN_COLUMNS} FROM chat_turns WHERE session_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (session_id, last_id, page_size)
+            )
+            if not rows:
+                break
+            yield [self._decode_chat_turn(row) for row in rows]
+            last_id = rows[-1][0]
+            if len(rows) < page_size:
+                break
+
+    def search_chat_turns(self, text, limit=50):
+        """Поиск по истории чатов, лучшие совпадения первыми (без FTS5 - последние первыми)"""
+        try:
+            if not self.chat_search_enabled:
+                rows = self._fetchall(
+                    f"SELECT {self.CHAT_TURN_COLUMNS} FROM chat_turns WHERE content LIKE ? ORDER BY id DESC LIMIT ?",
+                    (f"%{text}%", limit)
+                )
+                return [self._decode_chat_turn(row) for row in rows]
+
+            match = self.build_search_query(text)
+            if not match:
+                return []
+            rows = self._fetchall(f'''
+                SELECT {", ".join("t." + column.strip() for column in self.CHAT_TURN_COLUMNS.split(","))}
+                FROM chat_turns_fts
+                JOIN chat_turns t ON t.id = chat_turns_fts.rowid
+                WHERE chat_turns_fts MATCH ?
+                ORDER BY bm25(chat_turns_fts)
+                LIMIT ?
+            ''', (match, limit))
+            return [self._decode_chat_turn(row) for row in rows]
+        except Exception as e:
+            logging.error(f"Ошибка при поиске по истории чатов: {e}")
+            return []
+
+    def _delete_analysis_rows(self, where, params, batch_size=None, max_rows=None):
+        """Удаление результатов анализа небольшими транзакциями, возвращает число удаленных строк"""
+        batch_size = batch_size or LOG_PURGE_BATCH_SIZE
+        self.connect()
+        deleted = 0
+        while max_rows is None or deleted < max_rows:
+            limit = batch_size if max_rows is None else min(batch_size, max_rows - deleted)
+            try:
+                self.cursor.execute(
+                    f"SELECT a.id, a.log_hash FROM log_analysis a WHERE {where} ORDER BY a.id LIMIT ?",
+                    list(params) + [limit]
+                )
+                rows = self.cursor.fetchall()
+                if not rows:
+                    break
+                ids = [row[0] for row in rows]
+                hashes = list({row[1] for row in rows if row[1] is not None})
+                id_marks = ",".join("?" * len(ids))
+
+                if self.search_enabled:
+                    # Из индекса без копии текстов удаляют, передавая исходные значения
+                    self.cursor.execute(f'''
+                        INSERT INTO log_analysis_fts (log_analysis_fts, rowid, log_text, response)
+                        SELECT 'delete', a.id, COALESCE(l.text, a.log_text),
+                               CASE WHEN a.response_z IS NULL THEN a.response ELSE xrm_decompress(a.response_z) END
+                        FROM log_analysis a
+                        LEFT JOIN log_lines l ON l.hash = a.log_hash
+                        WHERE a.id IN ({id_marks})
+                    ''', ids)
+                self._update_rollup(f"id IN ({id_marks})", ids, sign=-1)
+                self.cursor.execute(f"DELETE FROM log_analysis WHERE id IN ({id_marks})", ids)
+                if hashes:
+                    self.cursor.execute(f'''
+                        DELETE FROM log_lines
+                        WHERE hash IN ({",".join("?" * len(hashes))})
+                          AND NOT EXISTS (SELECT 1 FROM log_analysis WHERE log_hash = log_lines.hash)
+                    ''', hashes)
+                self.conn.commit()
+            except Exception:
+                self._rollback()
+                raise
+            deleted += len(ids)
+            # Между транзакциями даем анализатору и потоку записи захватить блокировку
+            time.sleep(0)
+        return deleted
+
+    def purge_run(self, stats_id, batch_size=None):
+        """Удаление сессии обработки и всех ее результатов; None, если удаление невозможно"""
+        try:
+            self.connect()
+            self.cursor.execute("SELECT status FROM log_stats WHERE id = ?", (stats_id,))
+            row = self.cursor.fetchone()
+            if not row:
+                return None
+            if row[0] == "running":
+                logging.warning(f"Сессия обработки #{stats_id} еще выполняется и не может быть удалена")
+                return None
+
+            deleted = self._delete_analysis_rows("a.run_id = ?", (stats_id,), batch_size)
+            self.cursor.execute("DELETE FROM log_stats WHERE id = ?", (stats_id,))
+            self.conn.commit()
+            logging.info(f"Удалена сессия обработки #{stats_id} ({deleted} результатов)")
+            return deleted
+        except Exception as e:
+            self._rollback()
+            logging.error(f"Ошибка при удалении сессии обработки: {e}")
+            return None
+
+    def get_database_size(self):
+        """Размер базы данных: файл, занятые и свободные страницы, режим auto_vacuum"""
+        self.connect()
+        page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        auto_vacuum = self.conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        return {
+            "file_bytes": page_count * page_size,
+            "used_bytes": (page_count - freelist_count) * page_size,
+            "free_bytes": freelist_count * page_size,
+            "auto_vacuum": {0: "NONE", 1: "FULL", 2: "INCREMENTAL"}.get(auto_vacuum, str(auto_vacuum)),
+        }
+
+    def apply_retention(self, max_age_days=None, max_runs=None, max_size_mb=None, batch_size=None):
+        """Применение политики хранения; по умолчанию используются настройки LOG_RETENTION_*"""
+        max_age_days = LOG_RETENTION_DAYS if max_age_days is None else max_age_days
+        max_runs = LOG_RETENTION_MAX_RUNS if max_runs is None else max_runs
+        max_size_mb = LOG_RETENTION_MAX_SIZE_MB if max_size_mb is None else max_size_mb
+        result = {"deleted_rows": 0, "deleted_runs": 0}
+        try:
+            self.connect()
+
+            if max_age_days:
+                cutoff = datetime.datetime.now() - datetime.timedelta(days=max_age_days)
+                result["deleted_rows"] += self._delete_analysis_rows(
+                    f"a.timestamp < ? AND {self.RETENTION_DELETABLE}", (self.to_db_timestamp(cutoff),), batch_size
+                )
+                # Завершенные сессии, начатые до границы и не имеющие результатов
+                self.cursor.execute('''
+                    DELETE FROM log_stats
+                    WHERE status != 'running' AND start_time < ?
+                      AND NOT EXISTS (SELECT 1 FROM log_analysis WHERE run_id = log_stats.id)
+                ''', (cutoff,))
+                result["deleted_runs"] += self.cursor.rowcount
+                self.conn.commit()
+
+            if max_runs:
+                self.cursor.execute('''
+                    SELECT id FROM log_stats
+                    WHERE status != 'running'
+                      AND id NOT IN (SELECT id FROM log_stats ORDER BY id DESC LIMIT ?)
+                    ORDER BY id
+                ''', (max_runs,))
+                for (stats_id,) in self.cursor.fetchall():
+                    deleted = self.purge_run(stats_id, batch_size)
+                    if deleted is not None:
+                        result["deleted_rows"] += deleted
+                        result["deleted_runs"] += 1
+
+            if max_size_mb:
+                max_bytes = max_size_mb * 1024 * 1024
+                # Удаляем самые старые результаты долей, пропорциональной превышению, и
+                # перепроверяем размер (место в индексе освобождается только после слияния)
+                for _ in range(5):
+                    self.compact_search_index()
+                    used_bytes = self.get_database_size()["used_bytes"]
+                    if used_bytes <= max_bytes:
+                        break
+                    total_rows = self.conn.execute("SELECT COUNT(*) FROM log_analysis").fetchone()[0]
+                    if not total_rows:
+                        break
+                    to_delete = max(1, int(total_rows * (used_bytes - max_bytes) / used_bytes))
+                    deleted = self._delete_analysis_rows(self.RETENTION_DELETABLE, (), batch_size, max_rows=to_delete)
+                    if not deleted:
+                        break  # Остались только результаты выполняющихся сессий
+                    result["deleted_rows"] += deleted
+
+            return result
+        except Exception as e:
+            self._rollback()
+            logging.error(f"Ошибка при применении политики хранения: {e}")
+            return result
+
+    def compact_search_index(self, pages=None):
+        """Слияние сегментов полнотекстового индекса: удаленные записи занимают место до слияния"""
+        if not self.search_enabled:
+            return
+        pages = pages or LOG_VACUUM_STEP_PAGES
+        try:
+            self.connect()
+            while True:
+                changes_before = self.conn.total_changes
+                # Отрицательное значение - слияние без ожидания накопления сегментов,
+                # не более указанного числа страниц за транзакцию
+                self.conn.execute(
+                    "INSERT INTO log_analysis_fts (log_analysis_fts, rank) VALUES ('merge', ?)",
+                    (-int(pages),)
+                )
+                self.conn.commit()
+                if self.conn.total_changes - changes_before < 2:
+                    break
+                time.sleep(0)
+        except Exception as e:
+            self._rollback()
+            logging.error(f"Ошибка при слиянии полнотекстового индекса: {e}")
+
+    def incremental_vacuum(self, pages=None):
+        """Возврат свободных страниц ОС небольшими шагами (режим auto_vacuum=INCREMENTAL)"""
+        pages = pages or LOG_VACUUM_STEP_PAGES
+        self.compact_search_index(pages)
+        try:
+            self.connect()
+            freed = 0
+            while True:
+                free_before = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if not free_before:
+                    break
+                self.conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+                self.conn.commit()
+                free_after = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if free_after >= free_before:
+                    break  # auto_vacuum выключен - место освобождает только VACUUM
+                freed += free_before - free_after
+                time.sleep(0)
+            return freed
+        except Exception as e:
+            self._rollback()
+            logging.error(f"Ошибка при инкрементальной очистке базы данных: {e}")
+            return 0
+
+    def convert_to_incremental_vacuum(self):
+        """Однократный перевод существующей базы в auto_vacuum=INCREMENTAL (полный VACUUM)"""
+        try:
+            self.connect()
+            self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self.conn.execute("VACUUM")
+            return True
+        except Exception as e:
+            logging.error(f"Ошибка при выполнении VACUUM: {e}")
+            return False
+
+
+class SQLConnectionPool:
+    """Потокобезопасный пул соединений с сервером БД.
+
+    Соединения переиспользуются между запросами (без повторного TCP-подключения и
+    аутентификации), число одновременно открытых соединений ограничено, а соединение,
+    простоявшее дольше stale_timeout, проверяется перед выдачей.
+    """
+
+    def __init__(self, connect_func, ping_func=None, max_connections=10, stale_timeout=30,
+                 acquire_timeout=30):
+        """Инициализация пула (соединения открываются по мере необходимости)"""
+        self._connect = connect_func
+        self._ping = ping_func
+        self.max_connections = max_connections
+        self.stale_timeout = stale_timeout
+        self.acquire_timeout = acquire_timeout
+        self._idle = []  # Стек (соединение, время возврата): последнее возвращенное - самое "теплое"
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._created = 0
+        self._reused = 0
+        self._waits = 0
+        self._in_use = 0
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Выдача соединения на время блока with; при ошибке транзакция откатывается"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._waits += 1
+            if not self._slots.acquire(timeout=self.acquire_timeout):
+                raise TimeoutError(f"Нет свободных соединений с БД за {self.acquire_timeout} с")
+
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        except Exception:
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except Exception:
+                    # Соединение неработоспособно - не возвращаем его в пул
+                    self._discard(conn)
+                    conn = None
+            raise
+        finally:
+            if conn is not None:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def _checkout(self):
+        """Взять свободное соединение из пула или открыть новое"""
+        with self._lock:
+            self._in_use += 1
+            conn, returned_at = self._idle.pop() if self._idle else (None, None)
+
+        if conn is not None:
+            if self._ping and time.monotonic() - returned_at > self.stale_timeout:
+                try:
+                    self._ping(conn)
+                except Exception as e:
+                    logging.warning(f"Соединение с БД устарело и будет открыто заново: {e}")
+                    self._discard(conn)
+                    conn = None
+            if conn is not None:
+                with self._lock:
+                    self._reused += 1
+                return conn
+
+        conn = self._connect()
+        with self._lock:
+            self._created += 1
+        return conn
+
+    @staticmethod
+    def _discard(conn):
+        """Закрытие соединения без возврата в пул"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        """Счетчики пула: открыто, переиспользовано, ожиданий свободного соединения"""
+        with self._lock:
+            return {
+                "created": self._created,
+                "reused": self._reused,
+                "waits": self._waits,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "max_connections": self.max_connections,
+            }
+
+    def close_all(self):
+        """Закрытие всех свободных соединений (при завершении работы)"""
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+class MySQLResultStore(ResultStore):
+    """Хранилище результатов анализа на сервере MySQL (несколько анализаторов пишут в одну базу)"""
+
+    PARAM = "%s"
+    # Сжатый ответ не поддается полнотекстовому поиску на сервере, а место
+    # экономит сама СУБД (сжатие страниц InnoDB)
+    COMPRESS_RESPONSES = False
+    search_enabled = True
+
+    # Последовательность миграций схемы; версия хранится в таблице schema_version.
+    # DDL в MySQL не транзакционен, поэтому каждая миграция должна быть идемпотентной
+    MIGRATIONS = [
+        (1, "таблицы log_stats и log_analysis", "_migrate_base_tables"),
+        (2, "столбцы и индексы вердикта из json_answer", "_migrate_verdict_columns"),
+        (3, "полнотекстовый индекс по строкам логов и ответам", "_migrate_search_index"),
+        (4, "почасовые сводки по агентам, вердиктам и сессиям", "_migrate_rollup_tables"),
+        (5, "признак соответствия ответа схеме вердикта", "_migrate_verdict_validation"),
+        (6, "ID сеанса агента в статистике обработки", "_migrate_agent_session_id"),
+    ]
+
+    LOG_ANALYSIS_COLUMNS = """
+        a.id, a.agent_name, a.log_text, a.response, NULL AS response_z, a.json_answer,
+        a.processing_time, a.timestamp, a.run_id,
+        a.verdict_class, a.verdict_confidence, a.verdict_match, a.verdict_valid
+    """
+    LOG_ANALYSIS_SELECT = f"SELECT {LOG_ANALYSIS_COLUMNS} FROM log_analysis a"
+
+    def __init__(self, config=None):
+        """Подключение к серверу MySQL и применение миграций (требуется пакет pymysql)"""
+        try:
+            import pymysql
+        except ImportError:
+            raise RuntimeError("Для LOG_DB_BACKEND = \"mysql\" установите пакет pymysql: pip install pymysql")
+
+        self.pymysql = pymysql
+        self.config = dict(LOG_DB_MYSQL, **(config or {}))
+        self.pool = SQLConnectionPool(
+            lambda: self._open_connection(self.config["name"]),
+            ping_func=lambda conn: conn.ping(reconnect=True),
+            max_connections=self.config.get("max_connections", 10),
+            stale_timeout=self.config.get("stale_timeout", 30),
+        )
+        self.init_database()
+
+    def _open_connection(self, database=None):
+        """Открытие нового соединения с сервером"""
+        return self.pymysql.connect(
+            host=self.config["host"],
+            port=int(self.config["port"]),
+            user=self.config["user"],
+            password=self.config["password"],
+            database=database,
+            charset="utf8mb4",
+            autocommit=False,
+            connect_timeout=self.config.get("connect_timeout", 10),
+            # rowcount UPDATE - найденные, а не измененные строки (как в SQLite)
+            client_flag=self.pymysql.constants.CLIENT.FOUND_ROWS,
+        )
+
+    def init_database(self):
+        """Создание базы данных и применение миграций схемы"""
+        conn = self._open_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE DATABASE IF NOT EXISTS `{self.config['name']}` "
+                    "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci"
+                )
+            conn.commit()
+        finally:
+            conn.close()
+        self.migrate()
+        logging.info(
+            f"Хранилище результатов MySQL {self.config['host']}:{self.config['port']}/{self.config['name']} "
+            f"инициализировано (версия схемы {self.get_schema_version()})"
+        )
+
+    def get_schema_version(self):
+        """Текущая версия схемы базы данных"""
+        row = self._fetchone("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return row[0] if row else 0
+
+    def migrate(self):
+        """Последовательное применение недостающих миграций"""
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INT NOT NULL PRIMARY KEY)")
+                # Именованная блокировка: миграции не применяются двумя процессами одновременно
+                cursor.execute("SELECT GET_LOCK('xrm_director_migrations', 60)")
+                try:
+                    for version, description, method_name in self.MIGRATIONS:
+                        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+                        if cursor.fetchone()[0] >= version:
+                            continue
+                        logging.info(f"Применение миграции {version}: {description}")
+                        getattr(self, method_name)(cursor)
+                        cursor.execute("INSERT INTO schema_version (version) VALUES (%s)", (version,))
+                        conn.commit()
+                finally:
+                    cursor.execute("SELECT RELEASE_LOCK('xrm_director_migrations')")
+
+    def _get_columns(self, cursor, table):
+        """Список столбцов таблицы текущей базы"""
+        cursor.execute(
+            "SELECT column_name FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s",
+            (table,)
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+    def _get_indexes(self, cursor, table):
+        """Список индексов таблицы текущей базы"""
+        cursor.execute(
+            "SELECT DISTINCT index_name FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = %s",
+            (table,)
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+    def _migrate_base_tables(self, cursor):
+        """Миграция 1: таблицы статистики и результатов анализа"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS log_stats (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                start_time DATETIME(6) NOT NULL,
+                end_time DATETIME(6) NULL,
+                total_logs INT NOT NULL DEFAULT 0,
+                processed_logs INT NOT NULL DEFAULT 0,
+                successful_logs INT NOT NULL DEFAULT 0,
+                failed_logs INT NOT NULL DEFAULT 0,
+                average_time DOUBLE NULL,
+                status VARCHAR(32) NOT NULL,
+                KEY idx_log_stats_start_time (start_time)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS log_analysis (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                agent_name VARCHAR(255) NOT NULL,
+                log_text MEDIUMTEXT NOT NULL,
+                response MEDIUMTEXT NOT NULL,
+                json_answer JSON NULL,
+                processing_time DOUBLE NOT NULL,
+                timestamp DATETIME NOT NULL,
+                run_id BIGINT NULL,
+                KEY idx_log_analysis_timestamp (timestamp),
+                KEY idx_log_analysis_run_id (run_id),
+                KEY idx_log_analysis_agent_timestamp (agent_name, timestamp),
+                CONSTRAINT fk_log_analysis_run FOREIGN KEY (run_id) REFERENCES log_stats (id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        ''')
+
+    def _verdict_expression(self, column):
+        """SQL-выражение генерируемого столбца вердикта"""
+        paths = self.VERDICT_FIELDS[column]
+        value = "COALESCE(" + ", ".join(f"JSON_EXTRACT(json_answer, '{path}')" for path in paths) + ")"
+        if column == 'verdict_class':
+            return f"LEFT(UPPER(TRIM(JSON_UNQUOTE({value}))), 255)"
+        if column == 'verdict_confidence':
+            # Нечисловое значение в строгом режиме сервера прервало бы вставку строки
+            return f"CASE WHEN JSON_TYPE({value}) IN ('INTEGER', 'UNSIGNED INTEGER', 'DOUBLE', 'DECIMAL') THEN {value} + 0 END"
+        return f"JSON_UNQUOTE({value})"
+
+    def _migrate_verdict_columns(self, cursor):
+        """Миграция 2: столбцы вердикта (VIRTUAL - вычисляются из json_answer без перезаписи таблицы)"""
+        columns = self._get_columns(cursor, 'log_analysis')
+        for column, column_type in (('verdict_class', 'VARCHAR(255)'), ('verdict_confidence', 'DOUBLE'), ('verdict_match', 'TEXT')):
+            if column not in columns:
+                cursor.execute(
+                    f"ALTER TABLE log_analysis ADD COLUMN {column} {column_type} "
+                    f"GENERATED ALWAYS AS ({self._verdict_expression(column)}) VIRTUAL"
+                )
+        indexes = self._get_indexes(cursor, 'log_analysis')
+        if 'idx_log_analysis_verdict' not in indexes:
+            cursor.execute("CREATE INDEX idx_log_analysis_verdict ON log_analysis(verdict_class, timestamp)")
+        if 'idx_log_analysis_agent_verdict' not in indexes:
+            cursor.execute("CREATE INDEX idx_log_analysis_agent_verdict ON log_analysis(agent_name, verdict_class, timestamp)")
+
+    def _migrate_search_index(self, cursor):
+        """Миграция 3: полнотекстовый индекс InnoDB (MATCH ... AGAINST)"""
+        if 'ft_log_analysis_text' not in self._get_indexes(cursor, 'log_analysis'):
+            cursor.execute("CREATE FULLTEXT INDEX ft_log_analysis_text ON log_analysis(log_text, response)")
+
+    def _migrate_rollup_tables(self, cursor):
+        """Миграция 4: почасовая сводка результатов (час x агент x вердикт x сессия)"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS log_rollup_hourly (
+                bucket DATETIME NOT NULL,
+                agent_name VARCHAR(255) NOT NULL,
+                verdict_class VARCHAR(255) NOT NULL DEFAULT '',
+                run_id BIGINT NOT NULL DEFAULT 0,
+                result_count BIGINT NOT NULL DEFAULT 0,
+                total_time DOUBLE NOT NULL DEFAULT 0,
+                confidence_sum DOUBLE NOT NULL DEFAULT 0,
+                confidence_count BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, agent_name, verdict_class, run_id),
+                KEY idx_log_rollup_agent (agent_name, bucket)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        ''')
+        # Сводку ведут триггеры: ID многострочного INSERT в InnoDB не обязательно идут
+        # подряд, поэтому пакет нельзя пересчитать по диапазону ID, как в SQLite
+        for event, row, op in (("INSERT", "NEW", "+"), ("DELETE", "OLD", "-")):
+            trigger = f"trg_log_analysis_rollup_{event.lower()}"
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            cursor.execute(f'''
+                CREATE TRIGGER {trigger} AFTER {event} ON log_analysis FOR EACH ROW
+                INSERT INTO log_rollup_hourly (bucket, agent_name, verdict_class, run_id,
+                                               result_count, total_time, confidence_sum, confidence_count)
+                VALUES (DATE_FORMAT({row}.timestamp, '%Y-%m-%d %H:00:00'), {row}.agent_name,
+                        COALESCE({row}.verdict_class, ''), COALESCE({row}.run_id, 0),
+                        {op}1, {op}{row}.processing_time, {op}COALESCE({row}.verdict_confidence, 0),
+                        {op}({row}.verdict_confidence IS NOT NULL))
+                ON DUPLICATE KEY UPDATE
+                    result_count = result_count {op} 1,
+                    total_time = total_time {op} {row}.processing_time,
+                    confidence_sum = confidence_sum {op} COALESCE({row}.verdict_confidence, 0),
+                    confidence_count = confidence_count {op} ({row}.verdict_confidence IS NOT NULL)
+            ''')
+        # Пересчет с нуля, чтобы повторный запуск миграции не удвоил счетчики
+        cursor.execute("DELETE FROM log_rollup_hourly")
+        cursor.execute('''
+            INSERT INTO log_rollup_hourly (bucket, agent_name, verdict_class, run_id,
+                                           result_count, total_time, confidence_sum, confidence_count)
+            SELECT DATE_FORMAT(timestamp, '%Y-%m-%d %H:00:00') AS hour_bucket, agent_name,
+                   COALESCE(verdict_class, '') AS verdict_key, COALESCE(run_id, 0) AS run_key,
+                   COUNT(*), SUM(processing_time), COALESCE(SUM(verdict_confidence), 0), COUNT(verdict_confidence)
+            FROM log_analysis
+            GROUP BY hour_bucket, agent_name, verdict_key, run_key
+        ''')
+
+    def _migrate_verdict_validation(self, cursor):
+        """Миграция 5: признак проверки вердикта по схеме и счетчик ответов, не прошедших проверку"""
+        if 'verdict_valid' not in self._get_columns(cursor, 'log_analysis'):
+            cursor.execute("ALTER TABLE log_analysis ADD COLUMN verdict_valid TINYINT NULL")
+        if 'invalid_logs' not in self._get_columns(cursor, 'log_stats'):
+            cursor.execute("ALTER TABLE log_stats ADD COLUMN invalid_logs INT NOT NULL DEFAULT 0")
+
+    def _migrate_agent_session_id(self, cursor):
+        """Миграция 6: сеанс агента, в котором шла обработка (для очистки сеансов анализатора)"""
+        if 'agent_session_id' not in self._get_columns(cursor, 'log_stats'):
+            cursor.execute("ALTER TABLE log_stats ADD COLUMN agent_session_id VARCHAR(64) NULL")
+
+    def _fetchall(self, query, params=()):
+        """Выполнение запроса на чтение и получение всех строк"""
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+            conn.commit()  # Завершаем снимок REPEATABLE READ, чтобы следующий запрос видел новые данные
+            return rows
+
+    def _fetchone(self, query, params=()):
+        """Выполнение запроса на чтение и получение первой строки"""
+        rows = self._fetchall(query, params)
+        return rows[0] if rows else None
+
+    def _decode_log_analysis_row(self, row):
+        """Преобразование строки LOG_ANALYSIS_SELECT в словарь (время - строкой, как в SQLite)"""
+        result = super()._decode_log_analysis_row(row)
+        result["timestamp"] = self._format_time(result["timestamp"])
+        return result
+
+    _INSERT_LOG_ANALYSIS = (
+        "INSERT INTO log_analysis (agent_name, log_text, response, json_answer, processing_time, timestamp, run_id, verdict_valid) "
+        "VALUES (%(agent_name)s, %(log_text)s, %(response)s, %(json_answer)s, %(processing_time)s, %(timestamp)s, %(run_id)s, %(verdict_valid)s)"
+    )
+
+    def save_log_analysis(self, agent_name, log_text, response, processing_time, run_id=None):
+        """Сохранение результата анализа лога в базу данных"""
+        try:
+            row = self.prepare_log_analysis_row(agent_name, log_text, response, processing_time, run_id)
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(self._INSERT_LOG_ANALYSIS, row)
+                    analysis_id = cursor.lastrowid
+                conn.commit()
+            if row["json_answer"]:
+                logging.info(f"JSON извлечен из ответа агента: {row['json_answer'][:100]}...")
+            else:
+                logging.info("JSON не найден в ответе агента")
+            return analysis_id
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении анализа лога: {e}")
+            return None
+
+    def save_log_analysis_batch(self, rows):
+        """Пакетное сохранение результатов анализа одной транзакцией (многострочный INSERT)"""
+        if not rows:
+            return 0
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.executemany(self._INSERT_LOG_ANALYSIS, rows)
+                conn.commit()
+            return len(rows)
+        except Exception as e:
+            logging.error(f"Ошибка при пакетном сохранении анализа логов: {e}")
+            return 0
+
+    def get_log_analysis(self, analysis_id):
+        """Получение результата анализа по ID"""
+        try:
+            row = self._fetchone(self.LOG_ANALYSIS_SELECT + " WHERE a.id = %s", (analysis_id,))
+            return self._decode_log_analysis_row(row) if row else None
+        except Exception as e:
+            logging.error(f"Ошибка при получении результата анализа: {e}")
+            return None
+
+    def create_log_stats_session(self, total_logs, agent_session_id=None):
+        """Создание записи о новой сессии обработки логов"""
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        "INSERT INTO log_stats (start_time, total_logs, processed_logs, successful_logs, failed_logs, status, agent_session_id) "
+                        "VALUES (%s, %s, 0, 0, 0, 'running', %s)",
+                        (datetime.datetime.now(), total_logs, agent_session_id)
+                    )
+                    stats_id = cursor.lastrowid
+                conn.commit()
+            return stats_id
         except Exception as e:
             logging.error(f"Ошибка при создании записи статистики: {e}")
             return None
-        finally:
-            self.disconnect()
-    
-    def update_log_stats(self, stats_id, processed=0, successful=0, failed=0, status=None):
-        """Обновление статистики обработки логов"""
+
+    def update_log_stats(self, stats_id, processed=0, successful=0, failed=0, status=None, invalid=0):
+        """Обновление статистики обработки логов (счетчики увеличиваются атомарно на стороне БД)"""
         try:
-            self.connect()
-            
-            # Получение текущей статистики
-            self.cursor.execute("SELECT processed_logs, successful_logs, failed_logs FROM log_stats WHERE id = ?", (stats_id,))
-            row = self.cursor.fetchone()
-            if not row:
-                return False
-            
-            current_processed, current_successful, current_failed = row
-            
-            # Обновление статистики
-            new_processed = current_processed + processed
-            new_successful = current_successful + successful
-            new_failed = current_failed + failed
-            
-            if status == "completed":
-                # Финализация статистики при завершении
-                end_time = datetime.datetime.now()
-                
-                # Расчет среднего времени обработки
-                self.cursor.execute(
-                    "SELECT AVG(processing_time) FROM log_analysis WHERE timestamp > (SELECT start_time FROM log_stats WHERE id = ?)",
-                    (stats_id,)
-                )
-                avg_time = self.cursor.fetchone()[0] or 0
-                
-                self.cursor.execute(
-                    "UPDATE log_stats SET processed_logs = ?, successful_logs = ?, failed_logs = ?, end_time = ?, average_time = ?, status = ? WHERE id = ?",
-                    (new_processed, new_successful, new_failed, end_time, avg_time, status, stats_id)
-                )
-            else:
-                # Обновление текущей статистики
-                self.cursor.execute(
-                    "UPDATE log_stats SET processed_logs = ?, successful_logs = ?, failed_logs = ? WHERE id = ?",
-                    (new_processed, new_successful, new_failed, stats_id)
-                )
-                
-                if status:
-                    self.cursor.execute("UPDATE log_stats SET status = ? WHERE id = ?", (status, stats_id))
-            
-            self.conn.commit()
-            return True
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    if status == "completed":
+                        cursor.execute(
+                            "SELECT AVG(processing_time) FROM log_analysis WHERE run_id = %s",
+                            (stats_id,)
+                        )
+                        avg_time = cursor.fetchone()[0] or 0
+                        cursor.execute(
+                            "UPDATE log_stats SET processed_logs = processed_logs + %s, successful_logs = successful_logs + %s, "
+                            "failed_logs = failed_logs + %s, invalid_logs = invalid_logs + %s, end_time = %s, average_time = %s, "
+                            "status = %s WHERE id = %s",
+                            (processed, successful, failed, invalid, datetime.datetime.now(), avg_time, status, stats_id)
+                        )
+                    else:
+                        cursor.execute(
+                            "UPDATE log_stats SET processed_logs = processed_logs + %s, successful_logs = successful_logs + %s, "
+                            "failed_logs = failed_logs + %s, invalid_logs = invalid_logs + %s, status = COALESCE(%s, status) WHERE id = %s",
+                            (processed, successful, failed, invalid, status, stats_id)
+                        )
+                    updated = cursor.rowcount > 0
+                conn.commit()
+            return updated
         except Exception as e:
             logging.error(f"Ошибка при обновлении статистики: {e}")
             return False
-        finally:
-            self.disconnect()
-    
+
     def get_stats_summary(self):
         """Получение сводной статистики обработки логов"""
         try:
-            self.connect()
-            self.cursor.execute("""
-                SELECT COUNT(*) as total_sessions, 
-                       SUM(total_logs) as total_logs,
-                       SUM(processed_logs) as processed_logs,
-                       SUM(successful_logs) as successful_logs,
-                       SUM(failed_logs) as failed_logs,
-                       AVG(average_time) as avg_time
+            result = self._fetchone("""
+                SELECT COUNT(*), SUM(total_logs), SUM(processed_logs), SUM(successful_logs),
+                       SUM(failed_logs), AVG(average_time), SUM(invalid_logs)
                 FROM log_stats
             """)
-            result = self.cursor.fetchone()
             if not result:
                 return None
-                
             return {
                 "total_sessions": result[0],
-                "total_logs": result[1] or 0,
-                "processed_logs": result[2] or 0,
-                "successful_logs": result[3] or 0,
-                "failed_logs": result[4] or 0,
-                "avg_time": result[5] or 0
+                "total_logs": int(result[1] or 0),
+                "processed_logs": int(result[2] or 0),
+                "successful_logs": int(result[3] or 0),
+                "failed_logs": int(result[4] or 0),
+                "avg_time": float(result[5] or 0),
+                "invalid_logs": int(result[6] or 0)
             }
         except Exception as e:
             logging.error(f"Ошибка при получении сводной статистики: {e}")
             return None
-        finally:
-            self.disconnect()
-    
+
     def get_recent_stats(self, limit=5):
         """Получение последних сессий обработки логов"""
         try:
-            self.connect()
-            self.cursor.execute("""
-                SELECT id, start_time, end_time, total_logs, processed_logs, 
-                       successful_logs, failed_logs, average_time, status
+            rows = self._fetchall("""
+                SELECT id, start_time, end_time, total_logs, processed_logs,
+                       successful_logs, failed_logs, average_time, status, invalid_logs
                 FROM log_stats
                 ORDER BY start_time DESC
-                LIMIT ?
+                LIMIT %s
             """, (limit,))
-            
-            rows = self.cursor.fetchall()
-            if not rows:
-                return []
-                
-            stats = []
+            return [{
+                "id": row[0],
+                "start_time": self._format_time(row[1]),
+                "end_time": self._format_time(row[2]),
+                "total_logs": row[3],
+                "processed_logs": row[4],
+                "successful_logs": row[5],
+                "failed_logs": row[6],
+                "average_time": row[7] or 0,
+                "status": row[8],
+                "invalid_logs": row[9]
+            } for row in rows]
+        except Exception as e:
+            logging.error(f"Ошибка при получении последней статистики: {e}")
+            return []
+
+    def get_verdict_counts(self, run_id=None, agent_name=None, since=None, until=None, by_agent=False):
+        """Количество результатов по вердиктам (и агентам) со средней уверенностью"""
+        try:
+            where, params = self._build_analysis_filters(run_id, agent_name, since, until)
+            group_columns = "a.agent_name, a.verdict_class" if by_agent else "a.verdict_class"
+            rows = self._fetchall(f"""
+                SELECT {group_columns}, COUNT(*), AVG(a.verdict_confidence)
+                FROM log_analysis a{where}
+                GROUP BY {group_columns}
+                ORDER BY COUNT(*) DESC
+            """, params)
+
+            result = []
             for row in rows:
-                stats.append({
-                    "id": row[0],
-                    "start_time": row[1],
-                    "end_time": row[2],
-                    "total_logs": row[3],
-                    "processed_logs": row[4],
-                    "successful_logs": row[5],
-                    "failed_logs": row[6],
-                    "average_time": row[7] or 0,
-                    "status": row[8]
+                if by_agent:
+                    agent, verdict, count, avg_confidence = row
+                else:
+                    agent = agent_name
+                    verdict, count, avg_confidence = row
+                result.append({
+                    "agent_name": agent,
+                    "verdict": verdict,
+                    "count": count,
+                    "avg_confidence": avg_confidence
                 })
-            
-            return stats
+            return result
         except Exception as e:
-            logging.error(f"Ошибка при получении последней статистики: {e}")
+            logging.error(f"Ошибка при получении статистики вердиктов: {e}")
             return []
-        finally:
-            self.disconnect()
+
+    def find_by_verdict(self, verdict, run_id=None, agent_name=None, since=None, until=None,
+                        min_confidence=None, limit=100):
+        """Результаты анализа с заданным вердиктом, начиная с самых новых"""
+        try:
+            where, params = self._build_analysis_filters(
+                run_id, agent_name, since, until, verdict=verdict, min_confidence=min_confidence
+            )
+            rows = self._fetchall(
+                self.LOG_ANALYSIS_SELECT + where + " ORDER BY a.timestamp DESC LIMIT %s",
+                params + [limit]
+            )
+            return [self._decode_log_analysis_row(row) for row in rows]
+        except Exception as e:
+            logging.error(f"Ошибка при поиске результатов по вердикту: {e}")
+            return []
+
+    @staticmethod
+    def build_search_query(text):
+        """Преобразование пользовательского текста в запрос BOOLEAN MODE: все слова, как фразы"""
+        return " ".join('+"' + term.replace('"', ' ') + '"' for term in text.split())
+
+    def search_log_analysis(self, text, run_id=None, agent_name=None, since=None, until=None,
+                            limit=50, raw_query=False):
+        """Полнотекстовый поиск по строкам логов и ответам агента, лучшие совпадения первыми"""
+        try:
+            match = text if raw_query else self.build_search_query(text)
+            if not match:
+                return []
+            where, params = self._build_analysis_filters(run_id, agent_name, since, until)
+            condition = "MATCH(a.log_text, a.response) AGAINST (%s IN BOOLEAN MODE)"
+            where = (where + " AND " if where else " WHERE ") + condition
+            rows = self._fetchall(f"""
+                SELECT {self.LOG_ANALYSIS_COLUMNS}, {condition} AS score
+                FROM log_analysis a{where}
+                ORDER BY score DESC
+                LIMIT %s
+            """, [match] + params + [match, limit])
+
+            results = []
+            for row in rows:
+                result = self._decode_log_analysis_row(row)
+                # Как у bm25 в SQLite: меньше - лучше
+                result["rank"] = -float(row[13])
+                results.append(result)
+            return results
+        except Exception as e:
+            logging.error(f"Ошибка при полнотекстовом поиске: {e}")
+            return []
+
+    def iter_log_analysis_chunks(self, run_id=None, agent_name=None, since=None, until=None,
+                                 chunk_size=None):
+        """Постраничное чтение результатов анализа в порядке ID (память не зависит от размера таблицы)"""
+        chunk_size = chunk_size or LOG_EXPORT_CHUNK_SIZE
+        where, params = self._build_analysis_filters(run_id, agent_name, since, until)
+        where = (where + " AND " if where else " WHERE ") + "a.id > %s"
+        query = self.LOG_ANALYSIS_SELECT + where + " ORDER BY a.id LIMIT %s"
+
+        last_id = 0
+        while True:
+            rows = self._fetchall(query, params + [last_id, chunk_size])
+            if not rows:
+                break
+            yield [self._decode_log_analysis_row(row) for row in rows]
+            last_id = rows[-1][0]
+            if len(rows) < chunk_size:
+                break
+
+    def _delete_analysis_rows(self, where, params, batch_size=None, max_rows=None):
+        """Удаление результатов по условию порциями, каждая порция - своя короткая транзакция"""
+        batch_size = batch_size or LOG_PURGE_BATCH_SIZE
+        deleted = 0
+        while max_rows is None or deleted < max_rows:
+            limit = batch_size if max_rows is None else min(batch_size, max_rows - deleted)
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    # MySQL не допускает LIMIT в подзапросе IN - удаляем по списку ID
+                    cursor.execute(
+                        f"SELECT a.id FROM log_analysis a WHERE {where} ORDER BY a.id LIMIT %s",
+                        tuple(params) + (limit,)
+                    )
+                    ids = [row[0] for row in cursor.fetchall()]
+                    if ids:
+                        placeholders = ", ".join(["%s"] * len(ids))
+                        cursor.execute(f"DELETE FROM log_analysis WHERE id IN ({placeholders})", ids)
+                conn.commit()
+            if not ids:
+                break
+            deleted += len(ids)
+            if len(ids) < limit:
+                break
+            time.sleep(0)
+        return deleted
+
+    def purge_run(self, stats_id, batch_size=None):
+        """Удаление сессии обработки и всех ее результатов; None, если удаление невозможно"""
+        try:
+            row = self._fetchone("SELECT status FROM log_stats WHERE id = %s", (stats_id,))
+            if not row:
+                return None
+            if row[0] == "running":
+                logging.warning(f"Сессия обработки #{stats_id} еще выполняется и не может быть удалена")
+                return None
+
+            deleted = self._delete_analysis_rows("a.run_id = %s", (stats_id,), batch_size)
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("DELETE FROM log_stats WHERE id = %s", (stats_id,))
+                conn.commit()
+            logging.info(f"Удалена сессия обработки #{stats_id} ({deleted} результатов)")
+            return deleted
+        except Exception as e:
+            logging.error(f"Ошибка при удалении сессии обработки: {e}")
+            return None
+
+    def get_database_size(self):
+        """Размер таблиц в базе: данные и индексы, свободное место табличных пространств"""
+        row = self._fetchone("""
+            SELECT COALESCE(SUM(data_length + index_length), 0), COALESCE(SUM(data_free), 0)
+            FROM information_schema.tables
+            WHERE table_schema = DATABASE()
+        """)
+        used_bytes, free_bytes = int(row[0]), int(row[1])
+        return {
+            "file_bytes": used_bytes + free_bytes,
+            "used_bytes": used_bytes,
+            "free_bytes": free_bytes,
+            "auto_vacuum": "InnoDB",
+        }
+
+    def apply_retention(self, max_age_days=None, max_runs=None, max_size_mb=None, batch_size=None):
+        """Применение политики хранения; по умолчанию используются настройки LOG_RETENTION_*"""
+        max_age_days = LOG_RETENTION_DAYS if max_age_days is None else max_age_days
+        max_runs = LOG_RETENTION_MAX_RUNS if max_runs is None else max_runs
+        max_size_mb = LOG_RETENTION_MAX_SIZE_MB if max_size_mb is None else max_size_mb
+        result = {"deleted_rows": 0, "deleted_runs": 0}
+        try:
+            if max_age_days:
+                cutoff = datetime.datetime.now() - datetime.timedelta(days=max_age_days)
+                result["deleted_rows"] += self._delete_analysis_rows(
+                    f"a.timestamp < %s AND {self.RETENTION_DELETABLE}", (self.to_db_timestamp(cutoff),), batch_size
+                )
+                with self.pool.connection() as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute('''
+                            DELETE FROM log_stats
+                            WHERE status != 'running' AND start_time < %s
+                              AND NOT EXISTS (SELECT 1 FROM log_analysis WHERE run_id = log_stats.id)
+                        ''', (cutoff,))
+                        result["deleted_runs"] += cursor.rowcount
+                    conn.commit()
+
+            if max_runs:
+                rows = self._fetchall('''
+                    SELECT id FROM log_stats
+                    WHERE status != 'running' AND id <= (
+                        SELECT COALESCE(MIN(id), 0) - 1 FROM (
+                            SELECT id FROM log_stats ORDER BY id DESC LIMIT %s
+                        ) AS recent
+                    )
+                    ORDER BY id
+                ''', (max_runs,))
+                for (stats_id,) in rows:
+                    deleted = self.purge_run(stats_id, batch_size)
+                    if deleted is not None:
+                        result["deleted_rows"] += deleted
+                        result["deleted_runs"] += 1
+
+            if max_size_mb:
+                # Статистика размера information_schema обновляется InnoDB с задержкой,
+                # поэтому пропорциональное удаление по ней приводило бы к лишним удалениям
+                logging.warning("Ограничение LOG_RETENTION_MAX_SIZE_MB не поддерживается для MySQL и пропущено")
+
+            return result
+        except Exception as e:
+            logging.error(f"Ошибка при применении политики хранения: {e}")
+            return result
+
+    def compact_search_index(self, pages=None):
+        """Полнотекстовый индекс InnoDB обслуживается сервером"""
+
+    def incremental_vacuum(self, pages=None):
+        """Место удаленных строк InnoDB переиспользует сам; возврат ОС - OPTIMIZE TABLE"""
+        return 0
+
+    def convert_to_incremental_vacuum(self):
+        """Не применимо к MySQL"""
+        logging.warning("Инкрементальная очистка доступна только для хранилища SQLite")
+        return False
+
+    def close(self):
+        """Закрытие всех соединений пула (при завершении работы)"""
+        self.pool.close_all()
+
+
+def create_result_store():
+    """Создание хранилища результатов анализа в соответствии с LOG_DB_BACKEND"""
+    if LOG_DB_BACKEND == "mysql":
+        return MySQLResultStore()
+    if LOG_DB_BACKEND != "sqlite":
+        logging.warning(f"Неизвестное хранилище LOG_DB_BACKEND = {LOG_DB_BACKEND!r}, используется SQLite")
+    return Database()
+
+
+class LogDatabaseMaintenance:
+    """Фоновое обслуживание базы результатов: политика хранения и инкрементальная очистка"""
+
+    def __init__(self, db, interval=None):
+        """Инициализация обслуживания базы данных"""
+        self.db = db
+        self.interval = interval or LOG_MAINTENANCE_INTERVAL
+        self.maintenance_thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """Запуск фонового потока обслуживания"""
+        if self.maintenance_thread and self.maintenance_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self.maintenance_thread = threading.Thread(target=self._run, name="log-db-maintenance")
+        self.maintenance_thread.daemon = True
+        self.maintenance_thread.start()
+
+    def stop(self, timeout=5):
+        """Остановка фонового потока (текущая порция удаления будет завершена)"""
+        self._stop_event.set()
+        if self.maintenance_thread:
+            self.maintenance_thread.join(timeout)
+            self.maintenance_thread = None
+
+    def run_once(self):
+        """Один проход обслуживания"""
+        if LOG_RETENTION_DAYS or LOG_RETENTION_MAX_RUNS or LOG_RETENTION_MAX_SIZE_MB:
+            result = self.db.apply_retention()
+            if result["deleted_rows"] or result["deleted_runs"]:
+                logging.info(
+                    f"Политика хранения: удалено результатов {result['deleted_rows']}, "
+                    f"сессий {result['deleted_runs']}"
+                )
+        self.db.incremental_vacuum()
+
+    def _run(self):
+        """Основной цикл фонового обслуживания"""
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error(f"Ошибка фонового обслуживания базы данных: {e}")
+
+
+class LogResultWriter:
+    """Фоновый поток групповой записи результатов анализа в базу данных"""
+
+    _STOP = object()  # Маркер завершения работы потока записи
+
+    def __init__(self, db, batch_size=None, flush_interval_ms=None, max_pending=None):
+        """Инициализация очереди записи"""
+        self.db = db
+        self.batch_size = batch_size or LOG_WRITER_BATCH_SIZE
+        self.flush_interval = (flush_interval_ms or LOG_WRITER_FLUSH_INTERVAL_MS) / 1000.0
+        self.write_queue = queue.Queue(maxsize=max_pending or LOG_WRITER_MAX_PENDING)
+        self.writer_thread = None
+        self.written_rows = 0
+        self.failed_rows = 0
+        self._lock = threading.Lock()
+
+    def is_running(self):
+        """Проверка, запущен ли поток записи"""
+        return self.writer_thread is not None and self.writer_thread.is_alive()
+
+    def start(self):
+        """Запуск потока записи (повторный вызов ничего не делает)"""
+        with self._lock:
+            if self.is_running():
+                return
+            self.writer_thread = threading.Thread(target=self._run, name="log-result-writer")
+            self.writer_thread.daemon = True
+            self.writer_thread.start()
+        # Гарантируем запись накопленных результатов при завершении программы
+        atexit.register(self.stop)
+
+    def submit(self, agent_name, log_text, response, processing_time, run_id=None, json_scanner=None):
+        """Постановка результата в очередь записи (ждет, если очередь заполнена)"""
+        self.submit_row(
+            self.db.prepare_log_analysis_row(agent_name, log_text, response, processing_time, run_id, json_scanner)
+        )
+
+    def submit_row(self, row):
+        """Постановка в очередь строки, подготовленной prepare_log_analysis_row"""
+        if not self.is_running():
+            # Поток записи не запущен - пишем синхронно, чтобы не потерять результат
+            self._write([row])
+            return
+        self.write_queue.put(row)
+
+    def flush(self, timeout=None):
+        """Ожидание записи всех результатов, поставленных в очередь до вызова"""
+        if not self.is_running():
+            return True
+        done = threading.Event()
+        self.write_queue.put(done)
+        return done.wait(timeout)
+
+    def stop(self, timeout=None):
+        """Остановка потока записи с записью всех оставшихся результатов"""
+        with self._lock:
+            thread = self.writer_thread
+            if thread is None:
+                return
+            if thread.is_alive():
+                self.write_queue.put(self._STOP)
+                thread.join(timeout)
+            self.writer_thread = None
+        atexit.unregister(self.stop)
+
+    def _write(self, batch):
+        """Запись пакета и учет результата"""
+        written = self.db.save_log_analysis_batch(batch)
+        self.written_rows += written
+        if written < len(batch):
+            self.failed_rows += len(batch) - written
+            logging.error(f"Не удалось записать в базу данных {len(batch) - written} результатов анализа")
+
+    def _run(self):
+        """Основной цикл: накопление пакета до batch_size строк или flush_interval секунд"""
+        batch = []
+        waiters = []
+        stopping = False
+        while not stopping:
+            item = self.write_queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is self._STOP:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+
+                if stopping or waiters or len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.write_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write(batch)
+                batch = []
+            for waiter in waiters:
+                waiter.set()
+            waiters = []
+
+        # Сбрасываем в базу все, что успели поставить в очередь после маркера остановки
+        while True:
+            try:
+                item = self.write_queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is not self._STOP:
+                batch.append(item)
+        if batch:
+            self._write(batch)
+
+
+class LogStatsBuffer:
+    """Счетчики статистики одного запуска, накапливаемые в памяти и записываемые раз в интервал"""
+
+    def __init__(self, db, stats_id, flush_interval=None):
+        """Инициализация буфера для записи log_stats с указанным ID"""
+        self.db = db
+        self.stats_id = stats_id
+        self.flush_interval = LOG_STATS_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.processed = 0
+        self.successful = 0
+        self.failed = 0
+        self.invalid = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, processed=0, successful=0, failed=0, invalid=0):
+        """Учет результатов; запись в БД выполняется не чаще одного раза за интервал"""
+        with self._lock:
+            self.processed += processed
+            self.successful += successful
+            self.failed += failed
+            self.invalid += invalid
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self, status=None):
+        """Запись накопленных счетчиков (и статуса) одним атомарным UPDATE"""
+        with self._lock:
+            processed, successful, failed, invalid = self.processed, self.successful, self.failed, self.invalid
+            self.processed = self.successful = self.failed = self.invalid = 0
+            self._last_flush = time.monotonic()
+
+        if not (processed or successful or failed or invalid or status):
+            return True
+
+        updated = self.db.update_log_stats(
+            self.stats_id,
+            processed=processed,
+            successful=successful,
+            failed=failed,
+            status=status,
+            invalid=invalid
+        )
+        if not updated:
+            # Возвращаем счетчики в буфер, чтобы записать их при следующей попытке
+            with self._lock:
+                self.processed += processed
+                self.successful += successful
+                self.failed += failed
+                self.invalid += invalid
+        return updated
 
 
 class LogProcessor:
@@ -1424,15 +5291,21 @@ class LogProcessor:
     def __init__(self, rag_menu):
         """Инициализация процессора логов"""
         self.rag_menu = rag_menu  # Ссылка на основное меню
-        self.db = Database()  # Создаем экземпляр класса для работы с БД
+        self.db = create_result_store()  # Хранилище результатов (SQLite или MySQL)
+        self.result_writer = LogResultWriter(self.db)  # Групповая запись результатов в БД
+        self.db_maintenance = LogDatabaseMaintenance(self.db)  # Хранение и очистка БД в фоне
+        self.db_maintenance.start()
         self.processing_flag = False  # Флаг для управления обработкой
         self.paused = False  # Флаг для приостановки обработки
         self.processor_thread = None  # Поток для обработки логов
         self.current_stats_id = None  # ID текущей сессии в БД
+        self.stats_buffer = None  # Буфер счетчиков статистики текущей сессии
         self.current_agent = None  # Текущий агент
         self.current_session = None  # Текущая сессия
         self.prompt_template = ""  # Шаблон промпта для отправки агенту
-        self.log_queue = queue.Queue()  # Очередь для логов
+        self.verdict_schema = None  # Схема вердикта выбранного промпта (VERDICT_SCHEMAS)
+        self.requeue_attempts = {}  # Номер строки лога -> повторные запросы из-за ответа не по схеме
+        self.log_queue = queue.Queue()  # Очередь строк логов: (номер строки в файле, текст)
         
         # Настройка логирования с явным указанием кодировки UTF-8
         logging.basicConfig(
@@ -1461,11 +5334,11 @@ class LogProcessor:
                     self.log_queue.get_nowait()
                 except queue.Empty:
                     break
-              # Добавление строк в очередь
-            for line in lines:
+              # Добавление строк в очередь (номер строки различает одинаковые строки лога)
+            for line_number, line in enumerate(lines, 1):
                 line = line.strip()
                 if line:  # Пропускаем пустые строки
-                    self.log_queue.put(line)
+                    self.log_queue.put((line_number, line))
                     
             return len(lines)
         except Exception as e:
@@ -1519,7 +5392,11 @@ class LogProcessor:
             
         # Создание новой сессии с агентом
         try:
-            self.current_session = self.current_agent.create_session()
+            prewarmer = getattr(self.rag_menu, "session_prewarmer", None)
+            if prewarmer:
+                self.current_session = prewarmer.take(self.current_agent)
+            else:
+                self.current_session = self.current_agent.create_session()
             print(f"\nСоздан новый сеанс с агентом '{self.current_agent.title}' для обработки логов")
             print(f"ID сеанса: {self.current_session.id}")
         except Exception as e:
@@ -1531,6 +5408,12 @@ class LogProcessor:
         if not self.prompt_template:
             print("Обработка отменена: не выбран шаблон промпта.")
             return False
+        prompt_key = next(
+            (key for key, prompt in CONFIG['PREDEFINED_PROMPTS'].items() if prompt == self.prompt_template),
+            None
+        )
+        self.verdict_schema = VerdictSchema.for_prompt(prompt_key)
+        self.requeue_attempts = {}
             
         # Загрузка логов из файла
         log_count = self.load_logs_from_file(LOG_FILE_PATH)
@@ -1541,12 +5424,14 @@ class LogProcessor:
         print(f"\nЗагружено {log_count} строк логов из файла {LOG_FILE_PATH}")
         
         # Создание записи о сессии обработки в БД
-        self.current_stats_id = self.db.create_log_stats_session(log_count)
+        self.current_stats_id = self.db.create_log_stats_session(log_count, self.current_session.id)
         if not self.current_stats_id:
             print("Ошибка при создании записи статистики в базе данных.")
             return False
+        self.stats_buffer = LogStatsBuffer(self.db, self.current_stats_id)
             
-        # Запуск потока обработки
+        # Запуск потока групповой записи и потока обработки
+        self.result_writer.start()
         self.processing_flag = True
         self.paused = False
         self.processor_thread = threading.Thread(target=self.process_logs)
@@ -1566,10 +5451,17 @@ class LogProcessor:
         if self.processor_thread:
             print("\nОстановка обработки логов...")
             self.processor_thread.join(timeout=3)  # Ожидание завершения потока
-            
-        # Обновление статуса в БД
-        if self.current_stats_id:
-            self.db.update_log_stats(self.current_stats_id, status="stopped")
+
+        # Дожидаемся записи результатов, уже поставленных в очередь
+        self.result_writer.flush()
+
+        # Запись накопленной статистики и статуса в БД
+        if self.stats_buffer:
+            self.stats_buffer.flush(status="stopped")
+
+        http_pool = getattr(self.rag_menu.rag_object, "http_pool", None)
+        if http_pool:
+            logging.info(format_pool_stats(http_pool.stats()))
             
         print("Обработка логов остановлена.")
         self.processor_thread = None
@@ -1613,12 +5505,26 @@ class LogProcessor:
             
         return "Обработка запущена"
     
+    def requeue_log_line(self, line_number, log_line):
+        """Возврат строки лога в очередь для повторного запроса, если попытки не исчерпаны"""
+        if not VERDICT_REQUEUE_INVALID:
+            return False
+        attempts = self.requeue_attempts.get(line_number, 0)
+        if attempts >= VERDICT_REQUEUE_ATTEMPTS:
+            return False
+        self.requeue_attempts[line_number] = attempts + 1
+        self.log_queue.put((line_number, log_line))
+        return True
+
     def process_logs(self):
         """Основная функция обработки логов в отдельном потоке"""
         processed_count = 0
         successful_count = 0
         failed_count = 0
+        invalid_count = 0
         total_logs = self.log_queue.qsize()
+        # Буфер этого запуска: после остановки по таймауту может быть начат следующий
+        stats_buffer = self.stats_buffer
         
         try:
             while self.processing_flag and not self.log_queue.empty():
@@ -1627,7 +5533,8 @@ class LogProcessor:
                     time.sleep(1)
                     continue
                       # Получение строки лога из очереди
-                log_line = self.log_queue.get_nowait()
+                line_number, log_line = self.log_queue.get_nowait()
+                requeued = False
                 current_log_number = total_logs - self.log_queue.qsize()
                   # Формирование промпта для агента
                 if self.prompt_template == "NO_PROMPT":
@@ -1653,13 +5560,16 @@ class LogProcessor:
                         # Увеличенный таймаут для ожидания ответа от агента
                         response = self.current_session.ask(prompt, stream=True)
                         
-                        # Получение и отображение потокового ответа от агента
+                        # Получение и отображение потокового ответа от агента;
+                        # JSON ищется в каждой новой части, пока ожидается следующая
                         response_parts = []
+                        json_scanner = JSONObjectScanner()
                         for resp in response:
                             if resp and hasattr(resp, 'content'):
                                 new_content = resp.content[len(content):]
                                 content = resp.content
                                 response_parts.append(new_content)
+                                json_scanner.feed(new_content)
                                 print(f"\rПолучен ответ от агента ({len(content)} символов)", end="", flush=True)
                                 
                         # Объединение всех частей ответа
@@ -1681,36 +5591,48 @@ class LogProcessor:
                     processing_time = end_time - start_time
                     print(f"Время обработки: {processing_time:.2f} секунд")
                     
-                    # Сохранение результата в базу данных
+                    # Проверка вердикта по схеме промпта и передача результата
+                    # потоку групповой записи в базу данных
                     if content:
-                        # Сохраняем результат и ждем завершения операции
-                        print("Сохранение результата в базу данных...")
-                        result_id = self.db.save_log_analysis(
+                        row = self.db.prepare_log_analysis_row(
                             self.current_agent.title,
                             log_line,
                             content,
-                            processing_time
+                            processing_time,
+                            self.current_stats_id,
+                            json_scanner,
+                            self.verdict_schema
                         )
-                        
-                        if result_id:
-                            logging.info(f"Успешно обработана строка лога: {log_line[:50]}... (ID: {result_id})")
-                            print(f"Результат сохранен в базу данных (ID: {result_id})")
-                            successful_count += 1
+                        verdict = row.pop("verdict")
+                        if verdict is not None and not verdict.valid:
+                            errors = "; ".join(verdict.errors)
+                            logging.warning(f"Ответ агента не соответствует схеме вердикта ({errors}): {log_line[:50]}...")
+                            print(f"Ответ не соответствует схеме вердикта: {errors}")
+                            requeued = self.requeue_log_line(line_number, log_line)
+                            if not requeued:
+                                # Строка учитывается один раз - по ответу последней попытки
+                                invalid_count += 1
+
+                        if requeued:
+                            total_logs += 1
+                            print("Строка лога возвращена в очередь для повторного запроса")
                         else:
-                            logging.error(f"Не удалось сохранить результат для лога: {log_line[:50]}...")
-                            print("Не удалось сохранить результат в базу данных")
-                            failed_count += 1
+                            self.result_writer.submit_row(row)
+                            logging.info(f"Успешно обработана строка лога: {log_line[:50]}...")
+                            print("Результат передан на запись в базу данных")
+                            successful_count += 1
                     else:
                         # Если ответ пустой, считаем это неудачей
                         failed_count += 1
                         logging.warning(f"Пустой ответ от агента для лога: {log_line[:50]}...")
                         print("Сохранение информации о пустом ответе в базу данных...")
                         # Сохраняем информацию о пустом ответе в БД
-                        self.db.save_log_analysis(
+                        self.result_writer.submit(
                             self.current_agent.title,
                             log_line,
                             "ERROR: Пустой ответ от агента",
-                            processing_time
+                            processing_time,
+                            self.current_stats_id
                         )
                         
                 except Exception as e:
@@ -1722,33 +5644,36 @@ class LogProcessor:
                     # Добавляем запись об ошибке в БД
                     try:
                         print("Сохранение информации об ошибке в базу данных...")
-                        self.db.save_log_analysis(
+                        self.result_writer.submit(
                             self.current_agent.title if self.current_agent else "Unknown",
                             log_line,
                             f"ERROR: {str(e)}",
-                            0.0
+                            0.0,
+                            self.current_stats_id
                         )
                         print("Информация об ошибке сохранена")
                     except Exception as db_error:
                         logging.error(f"Не удалось сохранить ошибку в БД: {db_error}")
                         print(f"Не удалось сохранить информацию об ошибке: {db_error}")
                 
-                # Увеличиваем счетчик обработанных строк
-                processed_count += 1
+                # Увеличиваем счетчик обработанных строк (возвращенная в очередь
+                # строка будет учтена при повторной обработке)
+                if not requeued:
+                    processed_count += 1
+                    self.requeue_attempts.pop(line_number, None)
                 
-                # Обновление статистики в БД для каждой обработанной строки
+                # Учет строки в буфере статистики (в БД записывается раз в интервал)
                 try:
-                    print("Обновление статистики обработки...")
-                    self.db.update_log_stats(
-                        self.current_stats_id, 
-                        processed=1,
-                        successful=1 if successful_count > 0 else 0,
-                        failed=1 if failed_count > 0 else 0
+                    stats_buffer.add(
+                        processed=0 if requeued else 1,
+                        successful=successful_count,
+                        failed=failed_count,
+                        invalid=invalid_count
                     )
-                    print("Статистика обновлена")
-                    # Сбрасываем счетчики после обновления
+                    # Сбрасываем счетчики строки после учета
                     successful_count = 0
                     failed_count = 0
+                    invalid_count = 0
                 except Exception as e:
                     logging.error(f"Ошибка при обновлении статистики: {e}")
                     print(f"Ошибка при обновлении статистики: {e}")
@@ -1761,10 +5686,8 @@ class LogProcessor:
             if self.processing_flag:  # Если обработка не была остановлена принудительно
                 # Финальное обновление статистики
                 print("\nЗавершение обработки логов и обновление статистики...")
-                self.db.update_log_stats(
-                    self.current_stats_id,
-                    status="completed"
-                )
+                self.result_writer.flush()
+                stats_buffer.flush(status="completed")
                 logging.info("Обработка логов завершена")
                 print("Обработка логов успешно завершена!")
                 self.processing_flag = False
@@ -1774,12 +5697,105 @@ class LogProcessor:
             print(f"\nКритическая ошибка: {str(e)}")
             # Обновление статуса в БД
             try:
-                self.db.update_log_stats(self.current_stats_id, status="error")
+                self.result_writer.flush()
+                stats_buffer.flush(status="error")
                 print("Статус обработки в БД обновлен на 'error'")
             except Exception:
                 pass
             self.processing_flag = False
+        finally:
+            # stop_processing ждет поток ограниченное время: ответ, полученный после
+            # записи статуса "stopped", учитывается здесь, когда поток действительно завершен
+            try:
+                self.result_writer.flush()
+                stats_buffer.flush()
+            except Exception as e:
+                logging.error(f"Ошибка при записи статистики после остановки обработки: {e}")
     
+    def search_results(self):
+        """Интерактивный полнотекстовый поиск по результатам анализа"""
+        query = input("\nВведите текст для поиска: ").strip()
+        if not query:
+            return
+        agent_name = input("Название агента (Enter - все агенты): ").strip() or None
+        run_id = input("ID сессии обработки (Enter - все сессии): ").strip()
+        if run_id and not run_id.isdigit():
+            print("ID сессии должен быть числом.")
+            return
+
+        # Результаты, еще ожидающие записи, тоже должны находиться
+        self.result_writer.flush()
+        results = self.db.search_log_analysis(
+            query,
+            run_id=int(run_id) if run_id else None,
+            agent_name=agent_name,
+            limit=20
+        )
+        print()
+        print_log_search_results(results)
+
+    def database_maintenance(self):
+        """Обслуживание базы результатов: удаление сессий, политика хранения, очистка"""
+        size = self.db.get_database_size()
+        print("\nОбслуживание базы данных")
+        print(CONFIG['MENU_SEPARATOR'])
+        print(f"Размер файла: {size['file_bytes'] / 1024 / 1024:.1f} МБ "
+              f"(данные: {size['used_bytes'] / 1024 / 1024:.1f} МБ, свободно: {size['free_bytes'] / 1024 / 1024:.1f} МБ)")
+        print(f"Режим auto_vacuum: {size['auto_vacuum']}")
+        print(CONFIG['MENU_SEPARATOR'])
+        print("1. Удалить сессию обработки и ее результаты")
+        print("2. Применить политику хранения")
+        print("3. Освободить место на диске (инкрементальная очистка)")
+        print("4. Включить инкрементальную очистку для этой базы (полный VACUUM)")
+        print("0. Отмена")
+
+        choice = input("\nВыберите действие: ").strip()
+        if choice == "1":
+            stats_id = input("Введите ID сессии обработки: ").strip()
+            if not stats_id.isdigit():
+                print("ID сессии должен быть числом.")
+                return
+            self.result_writer.flush()
+            deleted = self.db.purge_run(int(stats_id))
+            if deleted is None:
+                print("Сессия не найдена, еще выполняется или не может быть удалена.")
+            else:
+                print(f"Сессия #{stats_id} удалена, удалено результатов: {deleted}")
+        elif choice == "2":
+            try:
+                days = input(f"Хранить результаты, дней [{LOG_RETENTION_DAYS or 'без ограничения'}]: ").strip()
+                runs = input(f"Хранить последних сессий [{LOG_RETENTION_MAX_RUNS or 'без ограничения'}]: ").strip()
+                size_mb = input(f"Максимальный размер данных, МБ [{LOG_RETENTION_MAX_SIZE_MB or 'без ограничения'}]: ").strip()
+                result = self.db.apply_retention(
+                    max_age_days=float(days) if days else None,
+                    max_runs=int(runs) if runs else None,
+                    max_size_mb=float(size_mb) if size_mb else None
+                )
+            except ValueError:
+                print("Пожалуйста, введите корректное число.")
+                return
+            print(f"Удалено результатов: {result['deleted_rows']}, сессий: {result['deleted_runs']}")
+        elif choice == "3":
+            freed = self.db.incremental_vacuum()
+            print(f"Освобождено страниц: {freed}")
+            if size['auto_vacuum'] in ("NONE", "FULL"):
+                print("Инкрементальная очистка выключена для этой базы, используйте пункт 4.")
+        elif choice == "4":
+            if self.processing_flag:
+                print("Остановите обработку логов перед выполнением VACUUM.")
+                return
+            print("Выполняется VACUUM, это может занять время...")
+            if self.db.convert_to_incremental_vacuum():
+                print("Инкрементальная очистка включена.")
+            else:
+                print("Не удалось выполнить VACUUM.")
+
+    def shutdown(self):
+        """Завершение работы: запись оставшихся результатов и закрытие БД"""
+        self.db_maintenance.stop()
+        self.result_writer.stop()
+        self.db.close()
+
     def show_statistics(self):
         """Отображение статистики обработки логов"""
         # Получение сводной статистики
@@ -1795,6 +5811,7 @@ class LogProcessor:
         print(f"Обработано строк: {summary['processed_logs']} ({summary['processed_logs']/max(1, summary['total_logs'])*100:.1f}%)")
         print(f"Успешно обработано: {summary['successful_logs']}")
         print(f"Ошибок обработки: {summary['failed_logs']}")
+        print(f"Ответов не по схеме вердикта: {summary['invalid_logs']}")
         print(f"Среднее время обработки: {summary['avg_time']:.2f} сек.")
         print(CONFIG['MENU_SEPARATOR'])
         
@@ -1814,9 +5831,36 @@ class LogProcessor:
                 print(f"Начало: {stats['start_time']}")
                 print(f"Продолжительность: {duration}")
                 print(f"Обработано: {stats['processed_logs']}/{stats['total_logs']} строк")
-                print(f"Успешно: {stats['successful_logs']}, Ошибок: {stats['failed_logs']}")
+                print(f"Успешно: {stats['successful_logs']}, Ошибок: {stats['failed_logs']}, "
+                      f"Не по схеме: {stats['invalid_logs'] or 0}")
                 if stats['average_time']:
                     print(f"Среднее время: {stats['average_time']:.2f} сек.")
+
+        # Распределение вердиктов и результаты по агентам (из почасовых сводок)
+        verdicts = self.db.get_rollup_stats(group_by=("verdict_class",))
+        if verdicts:
+            print(CONFIG['MENU_SEPARATOR'])
+            print("\nРаспределение вердиктов:")
+            for item in verdicts:
+                line = f"{item['verdict_class'] or 'без вердикта'}: {item['count']}"
+                if item['avg_confidence'] is not None:
+                    line += f" (средняя уверенность {item['avg_confidence']:.2f})"
+                print(line)
+
+        agents = self.db.get_rollup_stats(group_by=("agent_name",))
+        if agents:
+            print(CONFIG['MENU_SEPARATOR'])
+            print("\nРезультаты по агентам:")
+            for item in agents:
+                print(f"{item['agent_name']}: {item['count']} (среднее время {item['avg_time']:.2f} сек.)")
+
+        since = datetime.datetime.now() - datetime.timedelta(hours=24)
+        hours = self.db.get_rollup_stats(group_by=("bucket",), since=since)
+        if hours:
+            print(CONFIG['MENU_SEPARATOR'])
+            print("\nРезультаты за последние 24 часа (UTC):")
+            for item in hours:
+                print(f"{item['bucket'][:16]}: {item['count']}")
                     
         print(CONFIG['MENU_SEPARATOR'])
 
@@ -1833,6 +5877,10 @@ def main():
         if args.no_streaming:
             CONFIG['ENABLE_STREAMING'] = False
         
+        # Обновление кэша агентов до выполнения команды
+        if args.refresh_agents:
+            AgentDirectory().list(refresh=True)
+            
         # Обработка CLI команд
         if args.list_agents:
             # Показать список агентов
@@ -1851,10 +5899,85 @@ def main():
                 agent_id=args.agent_id,
                 agent_title=args.agent_title,
                 session_id=args.session_id,
-                create_new_session=args.new_session
+                create_new_session=args.new_session,
+                use_daemon=not args.no_daemon
+            )
+            sys.exit(0 if success else 1)
+            
+        elif args.send_file:
+            # Пакетная отправка сообщений из файла
+            success = cli_send_file(
+                path=args.send_file,
+                agent_id=args.agent_id,
+                agent_title=args.agent_title,
+                concurrency=args.concurrency
+            )
+            sys.exit(0 if success else 1)
+            
+        elif args.cleanup_sessions:
+            # Массовое удаление сеансов
+            success = cli_cleanup_sessions(
+                agent_id=args.agent_id,
+                agent_title=args.agent_title,
+                older_than_hours=args.older_than,
+                analyzer_only=args.analyzer_only,
+                dry_run=args.dry_run
+            )
+            sys.exit(0 if success else 1)
+            
+        elif args.history or args.history_search:
+            # Просмотр истории чатов
+            success = cli_chat_history(
+                session_id=args.session_id,
+                search=args.history_search,
+                limit=args.limit
+            )
+            sys.exit(0 if success else 1)
+            
+        elif args.daemon:
+            # Запуск демона агентов
+            success = cli_run_daemon()
+            sys.exit(0 if success else 1)
+            
+        elif args.stop_daemon:
+            # Остановка демона агентов
+            success = cli_stop_daemon()
+            sys.exit(0 if success else 1)
+            
+        elif args.search:
+            # Поиск по результатам анализа логов
+            success = cli_search_logs(
+                query=args.search,
+                run_id=args.run_id,
+                agent_name=args.agent_title,
+                since=args.since,
+                until=args.until,
+                limit=args.limit
+            )
+            sys.exit(0 if success else 1)
+            
+        elif args.export:
+            # Выгрузка результатов анализа логов
+            success = cli_export_logs(
+                output_path=args.export,
+                export_format=args.export_format,
+                run_id=args.run_id,
+                agent_name=args.agent_title,
+                since=args.since,
+                until=args.until
             )
             sys.exit(0 if success else 1)
             
+        elif args.benchmark_json:
+            # Сравнение способов извлечения JSON из ответов агента
+            benchmark_json_extraction()
+            sys.exit(0)
+            
+        elif args.benchmark_startup:
+            # Замер времени запуска CLI
+            benchmark_startup()
+            sys.exit(0)
+            
         else:
             # Если аргументы не переданы, запускаем интерактивное меню
             menu = RAGFlowMenu()